@@ -0,0 +1,125 @@
+"""
+Tests for the vectorized distance kernels in utils.py, checked against
+plain scalar loops over one pair of vectors at a time
+
+Usage:
+    python -m pytest -q test_distance_kernels.py
+"""
+
+import importlib.util
+import math
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+for dependency in ("dateutil", "IPython", "ipywidgets", "pandas", "requests", "together"):
+    pytest.importorskip(dependency)
+
+# Loaded by path: Module 1 has a different utils.py
+_spec = importlib.util.spec_from_file_location(
+    "assignment2_utils", os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils.py"))
+utils = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(utils)
+
+# ============================================================================
+# SCALAR REFERENCES
+# ============================================================================
+
+def scalar_cosine(v1, v2):
+    dot = sum(float(a) * float(b) for a, b in zip(v1, v2))
+    norm_1 = math.sqrt(sum(float(a) * float(a) for a in v1))
+    norm_2 = math.sqrt(sum(float(b) * float(b) for b in v2))
+    return dot / (norm_1 * norm_2)
+
+def scalar_euclidean(v1, v2):
+    return math.sqrt(sum((float(a) - float(b)) ** 2 for a, b in zip(v1, v2)))
+
+def scalar_top_k(row, top_k, largest=True):
+    return sorted(range(len(row)), key=lambda i: (-row[i] if largest else row[i], i))[:top_k]
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 24)).astype(np.float32)
+    # Duplicate rows and repeated values exercise identical vectors and ties
+    vectors[10] = vectors[3]
+    vectors[20:25] = np.round(vectors[20:25])
+    return vectors
+
+@pytest.fixture(scope="module")
+def queries(corpus):
+    rng = np.random.default_rng(1)
+    return np.vstack([corpus[[3, 20, 150]], rng.standard_normal((40, 24)).astype(np.float32)])
+
+# ============================================================================
+# SINGLE-QUERY FUNCTIONS
+# ============================================================================
+
+def test_single_query_functions_match_scalar_loops(corpus, queries):
+    for query in queries[:10]:
+        assert utils.cosine_similarity(query, corpus) == pytest.approx(
+            [scalar_cosine(query, row) for row in corpus], rel=1e-5, abs=1e-6)
+        assert utils.euclidean_distance(query, corpus) == pytest.approx(
+            [scalar_euclidean(query, row) for row in corpus], rel=1e-5, abs=1e-5)
+    # A single vector is treated as a one-row array
+    assert len(utils.cosine_similarity(queries[0], corpus[0])) == 1
+    with pytest.raises(ValueError):
+        utils.euclidean_distance(queries[0][:5], corpus)
+
+# ============================================================================
+# BATCHED KERNELS
+# ============================================================================
+
+def test_cosine_similarity_matrix_matches_scalar_loop(corpus, queries):
+    similarities = utils.cosine_similarity_matrix(queries, utils.normalize_rows(corpus))
+    assert similarities.shape == (len(queries), len(corpus))
+    expected = [[scalar_cosine(query, row) for row in corpus] for query in queries]
+    np.testing.assert_allclose(similarities, expected, rtol=1e-5, atol=1e-5)
+    # Zero rows normalize to zero instead of dividing by zero
+    assert not np.isnan(utils.normalize_rows(np.zeros((2, 3)))).any()
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+def test_euclidean_distance_matrix_matches_scalar_loop(chunk_size, corpus, queries):
+    expected = [[scalar_euclidean(query, row) for row in corpus] for query in queries]
+    # 43 x 300 x 24 entries is past the direct-subtraction limit, so this is the chunked path
+    assert len(queries) * corpus.size > 1 << 16
+    distances = utils.euclidean_distance_matrix(queries, corpus, chunk_size=chunk_size)
+    assert distances.dtype == np.float64
+    np.testing.assert_allclose(distances, expected, rtol=1e-7, atol=1e-6)
+    squared_norms = np.einsum("ij,ij->i", corpus.astype(np.float64), corpus.astype(np.float64))
+    np.testing.assert_array_equal(
+        utils.euclidean_distance_matrix(queries, corpus, squared_norms, chunk_size=chunk_size), distances)
+
+    # The small-input path subtracts directly
+    small = utils.euclidean_distance_matrix(queries[:3], corpus[:50])
+    np.testing.assert_allclose(small, np.asarray(expected)[:3, :50], rtol=1e-12, atol=1e-12)
+
+def test_identical_vectors_are_at_distance_zero(corpus, queries):
+    # Query 0 is corpus row 3, which row 10 duplicates
+    for distances in (utils.euclidean_distance_matrix(queries, corpus, chunk_size=5),
+                      utils.euclidean_distance_matrix(queries[:1], corpus[:20])):
+        assert distances[0, 3] < 1e-6 and distances[0, 10] < 1e-6
+    large = np.full((1, 64), 1e4, dtype=np.float32)
+    assert utils.euclidean_distance_matrix(np.repeat(large, 2000, axis=0), large)[:, 0].max() < 1e-6
+    with pytest.raises(ValueError):
+        utils.euclidean_distance_matrix(queries[:, :5], corpus)
+
+@pytest.mark.parametrize("top_k", [0, 1, 5, 300, 400])
+def test_top_k_indices_match_a_full_sort(top_k, corpus, queries):
+    similarities = utils.cosine_similarity_matrix(queries, utils.normalize_rows(corpus))
+    distances = utils.euclidean_distance_matrix(queries, corpus)
+    # Heavy ties: scores rounded to one decimal
+    tied = np.round(similarities, 1)
+    for scores, largest in ((similarities, True), (distances, False), (tied, True), (tied, False)):
+        indices = utils.top_k_indices(scores, top_k, largest=largest)
+        assert indices.shape == (len(queries), min(top_k, len(corpus)))
+        assert indices.tolist() == [scalar_top_k(row.tolist(), top_k, largest) for row in scores]
+        assert utils.top_k_indices(scores[0], top_k, largest=largest).tolist() == indices[0].tolist()
+
+def test_batch_semantic_search_matches_scalar_loop(corpus, queries):
+    indices, similarities = utils.batch_semantic_search(queries, utils.normalize_rows(corpus), top_k=5)
+    for query, row_indices, row_similarities in zip(queries, indices, similarities):
+        scores = [scalar_cosine(query, row) for row in corpus]
+        assert sorted(scores, reverse=True)[:5] == pytest.approx(row_similarities.tolist(), abs=1e-5)
+        assert [scores[i] for i in row_indices] == pytest.approx(row_similarities.tolist(), abs=1e-5)
@@ -23,26 +23,13 @@ def cosine_similarity(v1, array_of_vectors):
     """
     # Ensure that v1 is a numpy array
     v1 = np.array(v1)
-    # Initialize a list to store similarities
-    similarities = []
+    # A single vector becomes a one-row matrix
+    array_of_vectors = np.atleast_2d(np.asarray(array_of_vectors))
     
-    # Check if array_of_vectors is a single vector
-    if len(np.shape(array_of_vectors)) == 1:
-        array_of_vectors = [array_of_vectors]
-    
-    # Iterate over each vector in the array
-    for v2 in array_of_vectors:
-        # Convert the current vector to a numpy array
-        v2 = np.array(v2)
-        # Compute the dot product of v1 and v2
-        dot_product = np.dot(v1, v2)
-        # Compute the norms of the vectors
-        norm_v1 = np.linalg.norm(v1)
-        norm_v2 = np.linalg.norm(v2)
-        # Compute the cosine similarity and append to the list
-        similarity = dot_product / (norm_v1 * norm_v2)
-        similarities.append(similarity)
-    return np.array(similarities)
+    # All dot products in one matrix-vector product, all norms in one call
+    dot_products = array_of_vectors @ v1
+    norms = np.linalg.norm(array_of_vectors, axis=1)
+    return dot_products / (np.linalg.norm(v1) * norms)
 
 def euclidean_distance(v1, array_of_vectors):
     """
@@ -57,25 +44,148 @@ def euclidean_distance(v1, array_of_vectors):
     """
     # Ensure that v1 is a numpy array
     v1 = np.array(v1)
-    # Initialize a list to store distances
-    distances = []
+    # A single vector becomes a one-row matrix
+    array_of_vectors = np.atleast_2d(np.asarray(array_of_vectors))
+    
+    # Check if the input arrays have the same shape
+    if v1.shape != array_of_vectors.shape[1:]:
+        raise ValueError(f"Shapes don't match: v1 shape: {v1.shape}, v2 shape: {array_of_vectors.shape[1:]}")
+    # Calculate all distances at once, row by row
+    distances = np.sqrt(np.sum((array_of_vectors - v1) ** 2, axis=1))
+    return list(distances)
+
+
+# Batched kernels for semantic search over a large embedding matrix.
+# Normalize the corpus once with normalize_rows, then score whole batches of
+# queries with a single matrix product instead of one vector at a time.
+def normalize_rows(matrix, dtype=np.float32):
+    """
+    L2-normalize each row of a matrix, so cosine similarity becomes a dot product.
+    
+    Parameters:
+    matrix (array-like): A 2D array with one vector per row (or a single vector).
+    dtype (numpy dtype): The dtype of the result, float32 by default.
+
+    Returns:
+    numpy.ndarray: A C-contiguous matrix of unit-length rows. All-zero rows stay zero.
+    """
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=dtype))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return np.ascontiguousarray(matrix / norms)
+
+def cosine_similarity_matrix(queries, normalized_corpus):
+    """
+    Compute the cosine similarity between every query and every corpus vector.
+    
+    Parameters:
+    queries (array-like): A 2D array with one query vector per row (or a single vector).
+    normalized_corpus (numpy.ndarray): The corpus, already passed through normalize_rows.
+
+    Returns:
+    numpy.ndarray: A (number of queries, number of corpus vectors) matrix of similarities.
+    """
+    queries = normalize_rows(queries, dtype=normalized_corpus.dtype)
+    # One BLAS matrix product for the whole batch
+    return queries @ normalized_corpus.T
+
+def euclidean_distance_matrix(queries, corpus, corpus_squared_norms=None, chunk_size=1024):
+    """
+    Compute the Euclidean distance between every query and every corpus vector.
     
-    # Check if array_of_vectors is a single vector
-    if len(np.shape(array_of_vectors)) == 1:
-        array_of_vectors = [array_of_vectors]
+    Small inputs subtract directly, which is exact for identical vectors. Larger
+    ones use ||q - c||^2 = ||q||^2 - 2 q.c + ||c||^2 so the only large operation is
+    one matrix product per chunk of queries; it runs in float64, because in float32
+    the cancellation leaves distances of about 1e-3 between identical vectors.
     
-    # Iterate over each vector in the array
-    for v2 in array_of_vectors:
-        # Convert the current vector to a numpy array
-        v2 = np.array(v2)
-        # Check if the input arrays have the same shape
-        if v1.shape != v2.shape:
-            raise ValueError(f"Shapes don't match: v1 shape: {v1.shape}, v2 shape: {v2.shape}")
-        # Calculate the Euclidean distance and append to the list
-        dist = np.sqrt(np.sum((v1 - v2) ** 2))
-        distances.append(dist)
+    Parameters:
+    queries (array-like): A 2D array with one query vector per row (or a single vector).
+    corpus (numpy.ndarray): A 2D array with one vector per row.
+    corpus_squared_norms (numpy.ndarray, optional): Precomputed float64 squared norms of the corpus rows.
+    chunk_size (int): The number of queries upcast to float64 at a time.
+
+    Returns:
+    numpy.ndarray: A float64 (number of queries, number of corpus vectors) matrix of distances.
+    """
+    queries = np.atleast_2d(np.asarray(queries))
+    corpus = np.asarray(corpus)
+    if queries.shape[1] != corpus.shape[1]:
+        raise ValueError(f"Shapes don't match: queries shape: {queries.shape}, corpus shape: {corpus.shape}")
+    if queries.shape[0] * corpus.size <= 1 << 16:
+        difference = queries[:, None, :].astype(np.float64) - corpus
+        return np.sqrt(np.einsum("ijk,ijk->ij", difference, difference))
+    corpus = corpus.astype(np.float64, copy=False)
+    if corpus_squared_norms is None:
+        corpus_squared_norms = np.einsum("ij,ij->i", corpus, corpus)
+    distances = np.empty((queries.shape[0], corpus.shape[0]))
+    for start in range(0, queries.shape[0], chunk_size):
+        chunk = queries[start:start + chunk_size].astype(np.float64)
+        squared = distances[start:start + chunk_size]
+        np.matmul(chunk, corpus.T, out=squared)
+        squared *= -2
+        squared += np.einsum("ij,ij->i", chunk, chunk)[:, None]
+        squared += corpus_squared_norms
+        # Rounding can push distances of near-identical vectors slightly below zero
+        np.maximum(squared, 0, out=squared)
+        np.sqrt(squared, out=squared)
     return distances
 
+def top_k_indices(scores, top_k, largest=True):
+    """
+    Find the top_k entries of each row of a score matrix, best first.
+    
+    argpartition selects the top_k in linear time; only those are then sorted.
+    
+    Parameters:
+    scores (numpy.ndarray): A 1D array of scores or a 2D array with one row per query.
+    top_k (int): The number of entries to return per row.
+    largest (bool): True for similarities (highest first), False for distances (lowest first).
+
+    Returns:
+    numpy.ndarray: The indices of the top_k entries per row, with the same number of dimensions as scores.
+    """
+    scores = np.asarray(scores)
+    single = scores.ndim == 1
+    scores = np.atleast_2d(scores)
+    keys = -scores if largest else scores
+    top_k = min(top_k, scores.shape[1])
+    if top_k <= 0:
+        indices = np.empty((scores.shape[0], 0), dtype=np.intp)
+    else:
+        if top_k < scores.shape[1]:
+            candidates = np.argpartition(keys, top_k - 1, axis=1)[:, :top_k]
+            # argpartition keeps an arbitrary subset of the entries tied with
+            # the k-th one; in the rows where that matters, keep the lowest indices
+            kth = np.take_along_axis(keys, candidates, axis=1).max(axis=1, keepdims=True)
+            left_out = (keys == kth).sum(axis=1) > (np.take_along_axis(keys, candidates, axis=1) == kth).sum(axis=1)
+            for row in np.flatnonzero(left_out):
+                better = np.flatnonzero(keys[row] < kth[row])
+                tied = np.flatnonzero(keys[row] == kth[row])[:top_k - len(better)]
+                candidates[row] = np.concatenate([better, tied])
+        else:
+            candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        # Sort the candidates by score, ties by index
+        candidate_keys = np.take_along_axis(keys, candidates, axis=1)
+        order = np.lexsort((candidates, candidate_keys), axis=1)
+        indices = np.take_along_axis(candidates, order, axis=1)
+    return indices[0] if single else indices
+
+def batch_semantic_search(query_embeddings, normalized_corpus, top_k=5):
+    """
+    Retrieve the top_k most similar corpus vectors for a batch of queries.
+    
+    Parameters:
+    query_embeddings (array-like): A 2D array with one query embedding per row (or a single embedding).
+    normalized_corpus (numpy.ndarray): The corpus, already passed through normalize_rows.
+    top_k (int): The number of results per query.
+
+    Returns:
+    tuple: (indices, similarities), each of shape (number of queries, top_k).
+    """
+    similarities = cosine_similarity_matrix(query_embeddings, normalized_corpus)
+    indices = top_k_indices(similarities, top_k)
+    return indices, np.take_along_axis(similarities, indices, axis=1)
+
 
 def format_date(date_string):
     # Parse the input string into a datetime object
@@ -20,22 +20,12 @@ def plot_vectors():
     v2 = np.array([1, 1])
     array_v = np.array([[3, 2], [5, 6]])
     
-    # Function to calculate cosine similarity
-    def cosine_similarity(vec1, vec2):
-        dot_product = np.dot(vec1, vec2)
-        norm_vec1 = np.linalg.norm(vec1)
-        norm_vec2 = np.linalg.norm(vec2)
-        return dot_product / (norm_vec1 * norm_vec2)
-    
-    # Function to calculate Euclidean distance
-    def euclidean_distance(vec1, vec2):
-        return np.linalg.norm(vec1 - vec2)
-    
-    # Calculate cosine similarities and Euclidean distances
-    cos_sim_v1_array_v = [cosine_similarity(v1, av) for av in array_v]
-    cos_sim_v2_array_v = [cosine_similarity(v2, av) for av in array_v]
-    euc_dist_v1_array_v = [euclidean_distance(v1, av) for av in array_v]
-    euc_dist_v2_array_v = [euclidean_distance(v2, av) for av in array_v]
+    # Calculate cosine similarities and Euclidean distances of v1 and v2
+    # against every vector of array_v, broadcasting instead of per-pair loops
+    queries = np.stack([v1, v2])
+    norms = np.linalg.norm(queries, axis=1)[:, None] * np.linalg.norm(array_v, axis=1)
+    cos_sim_v1_array_v, cos_sim_v2_array_v = queries @ array_v.T / norms
+    euc_dist_v1_array_v, euc_dist_v2_array_v = np.linalg.norm(queries[:, None, :] - array_v, axis=2)
     
     # Create a single plot for both v1 and v2 with array_v
     plt.figure(figsize=(8, 8))
@@ -0,0 +1,115 @@
+"""
+Tests for DenseIndex and retrieve in utils.py: the exact backend ranks the
+bundled news embeddings like the sklearn cosine_similarity path it replaced,
+and retrieve searches whichever index it is given
+
+Usage:
+    MODEL_PATH=/path/to/models python -m pytest -q test_dense_index.py
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+for dependency in ("dateutil", "IPython", "ipywidgets", "joblib", "pandas", "requests",
+                   "sentence_transformers", "sklearn", "together"):
+    pytest.importorskip(dependency)
+
+from sklearn.metrics.pairwise import cosine_similarity
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture(scope="module")
+def utils():
+    if "MODEL_PATH" not in os.environ:
+        pytest.skip("utils.py loads its sentence-transformers model from MODEL_PATH")
+    # utils.py reads its data files from the working directory; loaded by
+    # path because Module 2 has a different utils.py
+    cwd = os.getcwd()
+    os.chdir(HERE)
+    try:
+        spec = importlib.util.spec_from_file_location("assignment1_utils", os.path.join(HERE, "utils.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+@pytest.fixture(scope="module")
+def queries(utils):
+    rng = np.random.default_rng(0)
+    embeddings = np.asarray(utils.EMBEDDINGS)
+    rows = embeddings[rng.choice(len(embeddings), 20, replace=False)]
+    noisy = rows + 0.05 * rng.standard_normal(rows.shape).astype(np.float32)
+    return np.vstack([rows, noisy, rng.standard_normal((10, embeddings.shape[1])).astype(np.float32)])
+
+class FixedEncoder:
+    """Stands in for the sentence-transformers model: every query encodes to one vector"""
+
+    def __init__(self, vector):
+        self.vector = vector
+
+    def encode(self, query):
+        return self.vector
+
+def test_exact_backend_ranks_like_sklearn_cosine(utils, queries):
+    embeddings = np.asarray(utils.EMBEDDINGS)
+    index = utils.DenseIndex(embeddings)
+    for query in queries:
+        similarity_scores = cosine_similarity(query.reshape(1, -1), embeddings)[0]
+        np.testing.assert_allclose(index.scores(query), similarity_scores, rtol=1e-5, atol=1e-6)
+        expected = np.argsort(-similarity_scores)
+        for top_k in (1, 5, 50):
+            assert index.search(query, top_k).tolist() == expected[:top_k].tolist()
+    assert len(index.search(queries[0], len(embeddings) + 10)) == len(embeddings)
+    assert len(index.search(queries[0], 0)) == 0
+
+def test_retrieve_uses_the_index_override(utils, queries, monkeypatch):
+    embeddings = np.asarray(utils.EMBEDDINGS)
+    monkeypatch.setattr(utils, "model", FixedEncoder(queries[0]))
+    expected = utils.DenseIndex(embeddings).search(queries[0], 5)
+    if utils.INDEX.backend == "exact":
+        assert utils.retrieve("any query", 5).tolist() == expected.tolist()
+    # Rows of the override are reversed, so its answers are mirrored row numbers
+    reversed_index = utils.DenseIndex(embeddings[::-1])
+    assert utils.retrieve("any query", 5, index=reversed_index).tolist() == (len(embeddings) - 1 - expected).tolist()
+
+def test_unknown_backend_and_exact_search_options_are_rejected(utils):
+    with pytest.raises(ValueError):
+        utils.DenseIndex(utils.EMBEDDINGS, backend="faiss")
+    with pytest.raises(TypeError):
+        utils.DenseIndex(utils.EMBEDDINGS).search(np.ones(len(utils.EMBEDDINGS[0])), 5, ef_search=10)
+
+def test_ivfpq_backend_reranks_on_a_memory_mapped_npy_copy(utils, queries):
+    path = utils.embeddings_npy(os.path.join(HERE, "embeddings.joblib"))
+    assert path == os.path.join(HERE, "embeddings.npy")
+    np.testing.assert_array_equal(np.load(path, mmap_mode="r"), utils.EMBEDDINGS)
+    index = utils.DenseIndex(path, backend="ivfpq", nlist=16, m=8, nprobe=8)
+    assert isinstance(index.ann.full_vectors, np.memmap)
+    exact = utils.DenseIndex(path)
+
+    def recall(rerank):
+        # Stored rows and their noisy copies; the random queries have no real neighbours
+        found = sum(len(np.intersect1d(index.search(query, 10, rerank=rerank), exact.search(query, 10)))
+                    for query in queries[:40])
+        return found / 400
+
+    assert recall(100) >= 0.9
+    assert recall(100) > recall(0)
+
+@pytest.mark.parametrize("backend", ["int8", "binary"])
+def test_quantized_backends_keep_only_codes_in_ram(utils, queries, backend, monkeypatch):
+    # EMBEDDINGS_PATH is relative to the assignment directory, like the data files
+    monkeypatch.chdir(HERE)
+    assert isinstance(utils.EMBEDDINGS, np.memmap)
+    index = utils.DenseIndex(utils.EMBEDDINGS_PATH, backend=backend)
+    assert isinstance(index.ann.full_vectors, np.memmap)
+    assert index.ann.code_bytes * (4 if backend == "int8" else 32) == utils.EMBEDDINGS.nbytes
+    exact = utils.DenseIndex(utils.EMBEDDINGS_PATH)
+    # Binary codes rank coarsely, so they rescore a deeper shortlist
+    rerank = {"int8": 40, "binary": 100}[backend]
+    found = sum(len(np.intersect1d(index.search(query, 10, rerank=rerank), exact.search(query, 10)))
+                for query in queries[:40])
+    assert found / 400 >= 0.95
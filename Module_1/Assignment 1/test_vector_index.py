@@ -0,0 +1,164 @@
+"""
+Tests for the approximate indexes in vector_index.py, measured against
+exact cosine search on a clustered synthetic corpus
+
+Usage:
+    python -m pytest -q test_vector_index.py
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import vector_index as vi
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 32))
+    labels = rng.integers(0, len(centers), 2000)
+    return (centers[labels] + 0.6 * rng.standard_normal((2000, 32))).astype(np.float32)
+
+@pytest.fixture(scope="module")
+def queries(corpus):
+    return vi.noisy_queries(corpus, 100, noise=0.1, seed=1)
+
+# ============================================================================
+# HNSW
+# ============================================================================
+
+@pytest.fixture(scope="module")
+def hnsw(corpus):
+    return vi.HNSWIndex.from_embeddings(corpus, M=8, ef_construction=64)
+
+def test_hnsw_exact_search_matches_exact_cosine(hnsw, corpus, queries):
+    for query in queries[:20]:
+        unit = query / np.linalg.norm(query)
+        ids, scores = hnsw.exact_search(query, 10)
+        expected_ids, expected_scores = vi.exact_cosine_top_k(corpus, unit, 10)
+        assert ids.tolist() == expected_ids.tolist()
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+def test_hnsw_recall_floor(hnsw, queries):
+    assert hnsw.recall_at_k(queries, top_k=10, ef_search=50) >= 0.95
+    assert hnsw.recall_at_k(queries, top_k=10, ef_search=200) >= hnsw.recall_at_k(queries, top_k=10, ef_search=10)
+    # Returned similarities are the true cosines of the returned nodes, best first
+    ids, scores = hnsw.search(queries[0], 10)
+    unit = queries[0] / np.linalg.norm(queries[0])
+    np.testing.assert_allclose(scores, hnsw.vectors[ids] @ unit, rtol=1e-5)
+    assert np.all(np.diff(scores) <= 1e-6)
+
+def test_hnsw_save_load_round_trip(hnsw, queries, tmp_path):
+    path = str(tmp_path / "hnsw.npz")
+    hnsw.save(path)
+    loaded = vi.HNSWIndex.load(path)
+    assert len(loaded) == len(hnsw)
+    for query in queries:
+        for ef_search in (10, 50):
+            ids, scores = hnsw.search(query, 10, ef_search)
+            loaded_ids, loaded_scores = loaded.search(query, 10, ef_search)
+            assert loaded_ids.tolist() == ids.tolist()
+            assert loaded_scores.tolist() == scores.tolist()
+    # A loaded index keeps accepting inserts
+    new_ids = loaded.add(queries[:3])
+    assert new_ids.tolist() == [len(hnsw), len(hnsw) + 1, len(hnsw) + 2]
+    assert loaded.search(queries[1], 1)[0].tolist() == [len(hnsw) + 1]
+
+# ============================================================================
+# IVF-PQ
+# ============================================================================
+
+@pytest.fixture(scope="module")
+def vectors_path(corpus, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("vectors") / "embeddings.npy")
+    np.save(path, corpus)
+    return path
+
+@pytest.fixture(scope="module")
+def ivfpq(vectors_path):
+    return vi.IVFPQIndex.from_embeddings(vectors_path, nlist=32, m=8)
+
+def test_ivfpq_reranks_on_the_memory_mapped_file(ivfpq, vectors_path):
+    assert isinstance(ivfpq.full_vectors, np.memmap)
+    assert ivfpq.vectors_path == vectors_path
+    assert ivfpq.code_bytes == len(ivfpq) * (8 + ivfpq.m)
+
+def test_ivfpq_recall_with_and_without_rerank(ivfpq, corpus, queries):
+    def recall(nprobe, rerank):
+        found = 0
+        for query in queries:
+            ids, _ = ivfpq.search(query, 10, nprobe=nprobe, rerank=rerank)
+            exact, _ = vi.exact_cosine_top_k(corpus, query / np.linalg.norm(query), 10)
+            found += len(np.intersect1d(ids, exact))
+        return found / (10 * len(queries))
+
+    # Codes alone are lossy; re-ranking a shortlist from the probed cells recovers it
+    assert recall(nprobe=8, rerank=0) >= 0.6
+    assert recall(nprobe=8, rerank=100) >= 0.98
+    assert recall(nprobe=8, rerank=100) > recall(nprobe=8, rerank=0)
+    assert recall(nprobe=1, rerank=100) <= recall(nprobe=8, rerank=100)
+    assert ivfpq.recall_at_k(queries, 10, nprobe=8, rerank=100) == recall(nprobe=8, rerank=100)
+    # Re-ranked similarities are exact cosines
+    ids, scores = ivfpq.search(queries[0], 10, nprobe=8, rerank=100)
+    unit = queries[0] / np.linalg.norm(queries[0])
+    np.testing.assert_allclose(scores, ivfpq._normalized(corpus[ids]) @ unit, rtol=1e-5)
+
+def test_ivfpq_save_load_round_trip(ivfpq, queries, tmp_path):
+    path = str(tmp_path / "ivfpq.npz")
+    ivfpq.save(path)
+    loaded = vi.IVFPQIndex.load(path)
+    assert isinstance(loaded.full_vectors, np.memmap)
+    for query in queries[:20]:
+        for rerank in (0, 100):
+            ids, scores = ivfpq.search(query, 10, nprobe=8, rerank=rerank)
+            loaded_ids, loaded_scores = loaded.search(query, 10, nprobe=8, rerank=rerank)
+            assert loaded_ids.tolist() == ids.tolist()
+            np.testing.assert_array_equal(loaded_scores, scores)
+
+# ============================================================================
+# INT8 / BINARY QUANTIZED STORE
+# ============================================================================
+
+@pytest.fixture(scope="module", params=vi.QuantizedEmbeddingStore.MODES)
+def quantized(request, vectors_path):
+    return vi.QuantizedEmbeddingStore.from_embeddings(vectors_path, mode=request.param)
+
+def test_quantized_store_recall_with_rescoring(quantized, corpus, queries):
+    assert isinstance(quantized.full_vectors, np.memmap)
+    assert quantized.code_bytes == corpus.nbytes // (4 if quantized.mode == "int8" else 32)
+
+    def recall(rerank):
+        found = 0
+        for query in queries:
+            ids, _ = quantized.search(query, 10, rerank=rerank)
+            exact, _ = vi.exact_cosine_top_k(corpus, query / np.linalg.norm(query), 10)
+            found += len(np.intersect1d(ids, exact))
+        return found / (10 * len(queries))
+
+    # One sign bit of 32 dims is a coarse first pass: binary needs a deeper rescore
+    floor, rerank = {"int8": (0.9, 40), "binary": (0.3, 200)}[quantized.mode]
+    assert recall(0) >= floor
+    assert recall(rerank) >= 0.98
+    assert quantized.recall_at_k(queries, 10, rerank=rerank) == recall(rerank)
+    ids, scores = quantized.search(queries[0], 10, rerank=rerank)
+    unit = queries[0] / np.linalg.norm(queries[0])
+    np.testing.assert_allclose(scores, quantized._normalized(corpus[ids]) @ unit, rtol=1e-5)
+
+@pytest.mark.parametrize("width", [32, 64])
+def test_binary_popcount_paths_agree(corpus, queries, width, monkeypatch):
+    # 64 dims pack into 8 bytes per row, which bitwise_count reads as one uint64
+    corpus = np.hstack([corpus, corpus[:, ::-1]])[:, :width]
+    queries = np.hstack([queries, queries[:, ::-1]])[:, :width]
+    store = vi.QuantizedEmbeddingStore.from_embeddings(corpus, mode="binary")
+    bits = np.unpackbits(store.codes, axis=1)[:, :store.dim].astype(bool)
+    for query in queries[:20]:
+        unit = query / np.linalg.norm(query)
+        # Reference: matching signs counted one dimension at a time
+        expected = 1 - 2 * (bits != (unit > 0)).sum(axis=1) / store.dim
+        np.testing.assert_allclose(store._first_pass(unit), expected, rtol=1e-6)
+    native = [store._first_pass(query / np.linalg.norm(query)) for query in queries[:20]]
+    # numpy < 2 has no bitwise_count: the byte table must give the same scores
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+    assert not hasattr(np, "bitwise_count")
+    for query, scores in zip(queries[:20], native):
+        np.testing.assert_array_equal(store._first_pass(query / np.linalg.norm(query)), scores)
@@ -5,16 +5,34 @@ from pprint import pprint as original_pprint
 from dateutil import parser
 from sentence_transformers import SentenceTransformer
 import joblib
-from sklearn.metrics.pairwise import cosine_similarity
 import requests
 import os 
 from together import Together
+from vector_index import HNSWIndex, IVFPQIndex, QuantizedEmbeddingStore, load_embeddings
 
 model_name = os.path.join(os.environ['MODEL_PATH'], "BAAI/bge-base-en-v1.5")
 
 model = SentenceTransformer(model_name)
 
-EMBEDDINGS = joblib.load("embeddings.joblib")
+def embeddings_npy(joblib_path = "embeddings.joblib"):
+    """
+    Path of a .npy copy of the embeddings next to joblib_path, written the
+    first time it is needed (or when the joblib dump is newer), so indexes
+    can memory-map the float vectors instead of holding them in RAM.
+    """
+    npy_path = os.path.splitext(joblib_path)[0] + ".npy"
+    if not os.path.exists(npy_path) or os.path.getmtime(npy_path) < os.path.getmtime(joblib_path):
+        # Write under a temporary name, so no reader maps a partial file
+        partial_path = npy_path + ".partial"
+        with open(partial_path, "wb") as f:
+            np.save(f, np.asarray(joblib.load(joblib_path)))
+        os.replace(partial_path, npy_path)
+    return npy_path
+
+
+# Memory-mapped: rows are paged in when read, not held in RAM
+EMBEDDINGS_PATH = embeddings_npy()
+EMBEDDINGS = np.load(EMBEDDINGS_PATH, mmap_mode = "r")
 
 def pprint(*args, **kwargs):
     print(json.dumps(*args, indent = 2))
@@ -120,14 +138,104 @@ def concatenate_fields(dataset, fields):
 NEWS_DATA = pd.read_csv("./news_data_dedup.csv").to_dict(orient = 'records')
 
 
-def retrieve(query, top_k = 5):
+class DenseIndex:
+    """
+    Cosine-similarity index over a fixed embedding matrix.
+
+    The rows are normalized once when the index is built, so a query costs a
+    single matrix-vector product plus an O(N) argpartition, instead of
+    renormalizing every embedding and sorting every score on each call.
+
+    embeddings is a matrix or a .npy (or .joblib) path. backend="hnsw" or
+    backend="ivfpq" answers search from an approximate index in
+    vector_index.py instead; the other keyword arguments configure it (e.g.
+    M and ef_search for HNSW, nlist and nprobe for IVF-PQ).
+    backend="int8" or backend="binary" scans quantized codes 4x or 32x
+    smaller than float32, then rescores the best 4 * top_k in float.
+    Built from a .npy path, IVF-PQ and the quantized backends read those
+    float rows from the memory-mapped file, so only their codes stay in RAM.
+    """
+    BACKENDS = ("exact", "hnsw", "ivfpq", "int8", "binary")
+
+    def __init__(self, embeddings, backend = "exact", **options):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown DenseIndex backend: {backend}")
+        self.backend = backend
+        self.normalized = None
+        self.ann = None
+        if backend == "hnsw":
+            self.ann = HNSWIndex.from_embeddings(embeddings, **options)
+            return
+        if backend == "ivfpq":
+            self.ann = IVFPQIndex.from_embeddings(embeddings, **options)
+            # Full vectors for re-ranking the shortlist, search(..., rerank=100);
+            # from_embeddings already memory-mapped a .npy path
+            if self.ann.full_vectors is None:
+                self.ann.attach_vectors(embeddings)
+            return
+        if backend in QuantizedEmbeddingStore.MODES:
+            self.ann = QuantizedEmbeddingStore.from_embeddings(embeddings, mode = backend, **options)
+            # Float vectors for rescoring the first-pass shortlist; from_embeddings
+            # already memory-mapped a .npy path
+            if self.ann.full_vectors is None:
+                self.ann.attach_vectors(embeddings)
+            return
+
+        if isinstance(embeddings, str):
+            embeddings = load_embeddings(embeddings)
+        embeddings = np.asarray(embeddings)
+        # Keep float32 embeddings in float32, as sklearn's cosine_similarity does
+        if not np.issubdtype(embeddings.dtype, np.floating):
+            embeddings = embeddings.astype(np.float64)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        # All-zero rows stay zero, like sklearn's normalize
+        norms[norms == 0] = 1
+        self.normalized = np.ascontiguousarray(embeddings / norms)
+
+    def __len__(self):
+        return len(self.ann) if self.ann is not None else len(self.normalized)
+
+    def scores(self, query_embedding):
+        if self.normalized is None:
+            raise ValueError(f"scores needs the exact backend, not {self.backend}")
+        # Cosine similarity of the query with every row
+        query_embedding = np.asarray(query_embedding, dtype=self.normalized.dtype).ravel()
+        query_norm = np.linalg.norm(query_embedding)
+        if query_norm > 0:
+            query_embedding = query_embedding / query_norm
+        return self.normalized @ query_embedding
+
+    def search(self, query_embedding, top_k = 5, **search_options):
+        # Approximate backends take their own options, e.g. ef_search, nprobe or rerank
+        if self.ann is not None:
+            indices, _ = self.ann.search(query_embedding, top_k, **search_options)
+            return indices.astype(np.intp)
+        if search_options:
+            raise TypeError(f"The exact backend takes no search options, got {sorted(search_options)}")
+
+        similarity_scores = self.scores(query_embedding)
+        top_k = max(0, min(top_k, len(similarity_scores)))
+        if top_k == 0:
+            return np.empty(0, dtype=np.intp)
+
+        # Select the top_k in linear time, then sort only those
+        if top_k < len(similarity_scores):
+            candidates = np.argpartition(-similarity_scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(similarity_scores))
+        return candidates[np.argsort(-similarity_scores[candidates])]
+
+
+# DENSE_BACKEND=hnsw (or ivfpq, int8, binary) serves retrieve from an approximate index
+INDEX = DenseIndex(EMBEDDINGS_PATH, backend = os.environ.get("DENSE_BACKEND", "exact"))
+
+
+def retrieve(query, top_k = 5, index = None):
     query_embedding = model.encode(query)
 
-    similarity_scores = cosine_similarity(query_embedding.reshape(1,-1), EMBEDDINGS)[0]
-    
-    similarity_indices = np.argsort(-similarity_scores)
-
-    top_k_indices = similarity_indices[:top_k]
+    # Any DenseIndex over the same rows, e.g. DenseIndex(EMBEDDINGS, backend="hnsw")
+    index = INDEX if index is None else index
+    top_k_indices = index.search(query_embedding, top_k)
 
     return top_k_indices
 
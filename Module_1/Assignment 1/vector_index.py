@@ -0,0 +1,921 @@
+"""
+Approximate nearest-neighbour indexes for the assignments' embedding matrices
+HNSW graph search, IVF-PQ compressed search and int8/binary quantized storage,
+used as DenseIndex backends in utils.py
+
+Usage:
+    python vector_index.py --hnsw embeddings.joblib --ef-search 16 32 64 128
+    python vector_index.py --ivfpq embeddings.npy --nlist 256 --nprobe 1 4 16 --rerank 0 100
+    python vector_index.py --quantized embeddings.joblib --modes int8 binary --rerank 0 40 200
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# ============================================================================
+# HNSW APPROXIMATE NEAREST NEIGHBOURS
+# ============================================================================
+
+def load_embeddings(path: str):
+    """Embedding matrix from a ``.npy`` file (memory-mapped) or a
+    ``.joblib`` dump like the assignments' ``embeddings.joblib``
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    import joblib  # optional: only needed for .joblib files
+    return np.asarray(joblib.load(path))
+
+class HNSWIndex:
+    """Hierarchical navigable small world graph for approximate cosine search
+
+    Each vector gets a random top layer (exponentially rarer going up) and
+    is linked to up to ``M`` neighbours per layer (``2 * M`` on layer 0),
+    chosen with the neighbour-diversity heuristic of Malkov & Yashunin. A
+    search descends greedily from the top layer, then runs a best-first
+    search with a beam of ``ef_search`` candidates on layer 0; larger
+    ``ef_construction`` builds a better graph, larger ``ef_search`` trades
+    latency for recall (measure it with ``recall_at_k``).
+
+    Vectors are normalized on insert and identified by insertion order, so
+    an index built from an embedding matrix returns its row numbers.
+    Inserts are incremental; ``save``/``load`` persist the graph to one
+    ``.npz`` file.
+    """
+    
+    def __init__(self, dim: int, M: int = 16, ef_construction: int = 200, ef_search: int = 50,
+                 seed: int = 42):
+        if M < 2:
+            raise ValueError("M must be at least 2")
+        self.dim = dim
+        self.M = M
+        self.max_links0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_mult = 1 / math.log(M)
+        self._rng = np.random.default_rng(seed)
+        self._data = np.zeros((0, dim), dtype=np.float32)
+        self._count = 0
+        self.levels: List[int] = []                # node -> top layer
+        self._links: List[Dict[int, List[int]]] = []  # layer -> node -> neighbours
+        self.entry_point = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_embeddings(cls, embeddings, **kwargs) -> "HNSWIndex":
+        """Build an index over an embedding matrix or a ``load_embeddings`` path"""
+        if isinstance(embeddings, str):
+            embeddings = load_embeddings(embeddings)
+        embeddings = np.atleast_2d(embeddings)
+        index = cls(embeddings.shape[1], **kwargs)
+        index.add(embeddings)
+        return index
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @property
+    def vectors(self):
+        """The normalized vectors, one row per node"""
+        return self._data[:self._count]
+    
+    def _normalized(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+    
+    def add(self, vectors):
+        """Insert vectors (one per row), returning their node ids"""
+        vectors = self._normalized(vectors)
+        with self._lock:
+            start = self._count
+            needed = start + len(vectors)
+            if needed > len(self._data):
+                grown = np.zeros((max(needed, 2 * len(self._data)), self.dim), dtype=np.float32)
+                grown[:start] = self._data[:start]
+                self._data = grown
+            for vector in vectors:
+                self._insert(vector)
+            return np.arange(start, needed)
+    
+    def _insert(self, vector):
+        node = self._count
+        self._data[node] = vector
+        self._count += 1
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        self.levels.append(level)
+        while len(self._links) <= level:
+            self._links.append({})
+        for layer in range(level + 1):
+            self._links[layer][node] = []
+        
+        entry = self.entry_point
+        if entry is None:
+            self.entry_point = node
+            return
+        top = self.levels[entry]
+        nearest = [(1.0 - float(self._data[entry] @ vector), entry)]
+        for layer in range(top, level, -1):
+            nearest = self._search_layer(vector, nearest, 1, layer)
+        
+        for layer in range(min(level, top), -1, -1):
+            nearest = self._search_layer(vector, nearest, self.ef_construction, layer)
+            links = self._links[layer]
+            max_links = self.max_links0 if layer == 0 else self.M
+            links[node] = self._select(nearest, self.M)
+            for neighbour in links[node]:
+                neighbour_links = links[neighbour]
+                neighbour_links.append(node)
+                if len(neighbour_links) > max_links:
+                    # Over capacity: re-pick the neighbour's links with the heuristic
+                    dists = 1.0 - self._data[neighbour_links] @ self._data[neighbour]
+                    links[neighbour] = self._select(sorted(zip(dists.tolist(), neighbour_links)), max_links)
+        if level > top:
+            self.entry_point = node
+    
+    def _select(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """Up to ``m`` of the (distance, node) ``candidates`` (nearest first),
+        skipping any that is closer to an already selected node than to
+        the base, so links spread in different directions
+        """
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+        data = self._data
+        selected = []
+        for dist, candidate in candidates:
+            if selected and float((data[selected] @ data[candidate]).max()) > 1.0 - dist:
+                continue
+            selected.append(candidate)
+            if len(selected) == m:
+                break
+        return selected
+    
+    def _search_layer(self, query, entry_points: List[Tuple[float, int]], ef: int,
+                      layer: int) -> List[Tuple[float, int]]:
+        """Best-first search of one layer; the ``ef`` nearest (distance,
+        node) pairs found, nearest first
+        """
+        data = self._data
+        links = self._links[layer]
+        visited = {node for _, node in entry_points}
+        candidates = list(entry_points)
+        heapq.heapify(candidates)
+        results = [(-dist, node) for dist, node in entry_points]  # max-heap on distance
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if dist > -results[0][0]:
+                break
+            fresh = [neighbour for neighbour in links[node] if neighbour not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            # One matrix-vector product per expanded node
+            for dist, neighbour in zip((1.0 - data[fresh] @ query).tolist(), fresh):
+                if len(results) < ef or dist < -results[0][0]:
+                    heapq.heappush(candidates, (dist, neighbour))
+                    heapq.heappush(results, (-dist, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-neg_dist, node) for neg_dist, node in results)
+    
+    def search(self, query, top_k: int = 5, ef_search: int = None):
+        """Approximate top-k: (node ids, cosine similarities), best first"""
+        query = self._normalized(query)[0]
+        with self._lock:
+            entry = self.entry_point
+            if entry is None or top_k <= 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            ef = max(ef_search or self.ef_search, top_k)
+            nearest = [(1.0 - float(self._data[entry] @ query), entry)]
+            for layer in range(self.levels[entry], 0, -1):
+                nearest = self._search_layer(query, nearest, 1, layer)
+            nearest = self._search_layer(query, nearest, ef, 0)[:top_k]
+        ids = np.array([node for _, node in nearest], dtype=np.int64)
+        similarities = np.array([1.0 - dist for dist, _ in nearest], dtype=np.float32)
+        return ids, similarities
+    
+    def exact_search(self, query, top_k: int = 5):
+        """Brute-force top-k over every vector, the reference for recall"""
+        query = self._normalized(query)[0]
+        with self._lock:
+            scores = self.vectors @ query
+        top_k = max(0, min(top_k, len(scores)))
+        if top_k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows = np.argpartition(-scores, top_k - 1)[:top_k] if top_k < len(scores) else np.arange(len(scores))
+        order = np.lexsort((rows, -scores[rows]))
+        return rows[order].astype(np.int64), scores[rows[order]]
+    
+    def recall_at_k(self, queries, top_k: int = 10, ef_search: int = None) -> float:
+        """Mean fraction of the exact top-k that ``search`` returns"""
+        queries = np.atleast_2d(queries)
+        found = 0
+        for query in queries:
+            approx, _ = self.search(query, top_k, ef_search)
+            exact, _ = self.exact_search(query, top_k)
+            found += len(np.intersect1d(approx, exact))
+        return found / max(1, len(queries) * min(top_k, self._count))
+    
+    def save(self, path: str):
+        """Write vectors, layers and links to one ``.npz`` file at ``path``"""
+        with self._lock:
+            arrays = {
+                "vectors": self.vectors,
+                "levels": np.asarray(self.levels, dtype=np.int32),
+                "params": np.array([self.M, self.ef_construction, self.ef_search,
+                                    -1 if self.entry_point is None else self.entry_point], dtype=np.int64),
+            }
+            # Each layer as CSR: its nodes, offsets into one neighbour array
+            for layer, links in enumerate(self._links):
+                nodes = sorted(links)
+                arrays[f"nodes_{layer}"] = np.asarray(nodes, dtype=np.int64)
+                arrays[f"offsets_{layer}"] = np.cumsum([0] + [len(links[node]) for node in nodes], dtype=np.int64)
+                arrays[f"neighbours_{layer}"] = np.fromiter(
+                    (neighbour for node in nodes for neighbour in links[node]), dtype=np.int64)
+            with open(path, "wb") as f:
+                np.savez(f, **arrays)
+    
+    @classmethod
+    def load(cls, path: str, seed: int = 42) -> "HNSWIndex":
+        """Read an index written by ``save``; further inserts draw layers
+        from a fresh generator seeded with ``seed``
+        """
+        with np.load(path) as stored:
+            M, ef_construction, ef_search, entry = (int(value) for value in stored["params"])
+            vectors = stored["vectors"]
+            index = cls(vectors.shape[1], M=M, ef_construction=ef_construction, ef_search=ef_search, seed=seed)
+            index._data = np.array(vectors, dtype=np.float32)
+            index._count = len(vectors)
+            index.levels = stored["levels"].tolist()
+            layer = 0
+            while f"nodes_{layer}" in stored:
+                nodes = stored[f"nodes_{layer}"].tolist()
+                offsets = stored[f"offsets_{layer}"].tolist()
+                neighbours = stored[f"neighbours_{layer}"].tolist()
+                index._links.append({
+                    node: neighbours[offsets[i]:offsets[i + 1]] for i, node in enumerate(nodes)
+                })
+                layer += 1
+            index.entry_point = None if entry < 0 else entry
+        return index
+
+
+# ============================================================================
+# IVF-PQ COMPRESSED VECTOR INDEX
+# ============================================================================
+
+def _nearest_centroids(data, centroids, chunk: int = 65_536):
+    """Index of the nearest centroid (L2) of every row, in bounded-memory chunks"""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    nearest = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk):
+        block = np.asarray(data[start:start + chunk], dtype=np.float32)
+        # ||x - c||^2 without the ||x||^2 term, which does not change the argmin
+        nearest[start:start + chunk] = np.argmin(centroid_norms - 2 * (block @ centroids.T), axis=1)
+    return nearest
+
+def kmeans(data, k: int, iterations: int = 20, seed: int = 42):
+    """Lloyd's k-means on float32 rows, seeded with ``k`` distinct rows;
+    clusters that empty out are reseeded with random rows
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    if len(data) < k:
+        raise ValueError(f"k-means with k={k} needs at least {k} points, got {len(data)}")
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest_centroids(data, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        # Sum each cluster's rows in one pass over the rows sorted by cluster
+        order = np.argsort(assignment, kind="stable")
+        present = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[present]
+        centroids[present] = np.add.reduceat(data[order], starts, axis=0) / counts[present, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+    return centroids
+
+def exact_cosine_top_k(vectors, query, top_k: int, chunk: int = 65_536):
+    """Exact cosine top-k of a unit ``query`` over (possibly memory-mapped)
+    ``vectors``, read and normalized one chunk at a time: (ids, scores),
+    best first, ties by id
+    """
+    best_ids = np.zeros(0, dtype=np.int64)
+    best_scores = np.zeros(0, dtype=np.float32)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1)
+        scores = (block @ query) / np.where(norms == 0, 1, norms)
+        best_ids = np.concatenate([best_ids, np.arange(start, start + len(scores), dtype=np.int64)])
+        best_scores = np.concatenate([best_scores, scores])
+        if len(best_ids) > top_k > 0:
+            keep = np.argpartition(-best_scores, top_k - 1)[:top_k]
+            best_ids, best_scores = best_ids[keep], best_scores[keep]
+    order = np.lexsort((best_ids, -best_scores))[:max(top_k, 0)]
+    return best_ids[order], best_scores[order]
+
+class IVFPQIndex:
+    """Inverted-file index with product-quantized residuals for cosine search
+
+    ``train`` clusters normalized vectors into ``nlist`` coarse cells with
+    k-means, then splits each vector's residual (vector minus its cell
+    centroid) into ``m`` sub-vectors and learns a ``2 ** nbits`` entry
+    codebook per sub-space. A stored vector is just its id plus ``m``
+    one-byte codes: 8 codes replace 3 KB of float32 bge-base embedding.
+
+    A search ranks the ``nprobe`` cells nearest the query and scores their
+    codes by asymmetric distance: one (m, 2 ** nbits) lookup table of the
+    query residual's distance to every codeword, summed over code columns.
+    With ``rerank`` the best ``rerank`` candidates are re-scored exactly
+    against full vectors attached from a memory-mapped ``.npy`` file, so
+    full precision costs page reads for the shortlist, not RAM.
+
+    Ids are insertion order, i.e. row numbers of the embedding matrix.
+    """
+    
+    def __init__(self, dim: int, nlist: int = 256, m: int = 8, nbits: int = 8, nprobe: int = 8,
+                 seed: int = 42):
+        if dim % m:
+            raise ValueError(f"dim={dim} must be divisible by m={m}")
+        if not 1 <= nbits <= 8:
+            raise ValueError("nbits must be between 1 and 8")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None  # (nlist, dim)
+        self.codebooks = None  # (m, ksub, dim // m)
+        self.full_vectors = None
+        self.vectors_path = None
+        self._ids = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self._codes = [np.zeros((0, m), dtype=np.uint8) for _ in range(nlist)]
+        self._count = 0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_embeddings(cls, embeddings, train_size: int = 100_000, batch_size: int = 65_536,
+                        **kwargs) -> "IVFPQIndex":
+        """Train on a sample of an embedding matrix and add it in batches
+
+        ``embeddings`` may be a ``load_embeddings`` path; a ``.npy`` file is
+        memory-mapped and attached for exact re-ranking.
+        """
+        path = embeddings if isinstance(embeddings, str) else None
+        if path is not None:
+            embeddings = load_embeddings(path)
+        index = cls(embeddings.shape[1], **kwargs)
+        index.train(embeddings, train_size)
+        for start in range(0, len(embeddings), batch_size):
+            index.add(embeddings[start:start + batch_size])
+        if path is not None and path.endswith(".npy"):
+            index.attach_vectors(path)
+        return index
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @property
+    def is_trained(self) -> bool:
+        return self.codebooks is not None
+    
+    @property
+    def code_bytes(self) -> int:
+        """Memory held by the stored ids and codes"""
+        return sum(ids.nbytes + codes.nbytes for ids, codes in zip(self._ids, self._codes))
+    
+    def _normalized(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+    
+    def _subspaces(self, vectors):
+        return vectors.reshape(len(vectors), self.m, self.dim // self.m)
+    
+    def train(self, vectors, sample_size: int = 100_000):
+        """Learn coarse centroids and PQ codebooks from (a sample of) ``vectors``"""
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > sample_size:
+            vectors = vectors[np.sort(rng.choice(len(vectors), size=sample_size, replace=False))]
+        vectors = self._normalized(vectors)
+        centroids = kmeans(vectors, self.nlist, seed=self.seed)
+        residuals = self._subspaces(vectors - centroids[_nearest_centroids(vectors, centroids)])
+        ksub = min(1 << self.nbits, len(vectors))
+        codebooks = np.stack([
+            kmeans(residuals[:, sub], ksub, seed=self.seed + 1 + sub) for sub in range(self.m)
+        ])
+        with self._lock:
+            self.centroids, self.codebooks = centroids, codebooks
+    
+    def _encode(self, residuals):
+        sub_residuals = self._subspaces(residuals)
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for sub in range(self.m):
+            codes[:, sub] = _nearest_centroids(sub_residuals[:, sub], self.codebooks[sub])
+        return codes
+    
+    def add(self, vectors):
+        """Encode and store vectors (one per row), returning their ids"""
+        if not self.is_trained:
+            raise ValueError("IVFPQIndex must be trained before adding vectors")
+        vectors = self._normalized(vectors)
+        cells = _nearest_centroids(vectors, self.centroids)
+        codes = self._encode(vectors - self.centroids[cells])
+        with self._lock:
+            ids = np.arange(self._count, self._count + len(vectors), dtype=np.int64)
+            self._count += len(vectors)
+            order = np.argsort(cells, kind="stable")
+            bounds = np.cumsum(np.bincount(cells, minlength=self.nlist))
+            for cell, (start, end) in enumerate(zip(np.concatenate([[0], bounds[:-1]]), bounds)):
+                if end > start:
+                    rows = order[start:end]
+                    self._ids[cell] = np.concatenate([self._ids[cell], ids[rows]])
+                    self._codes[cell] = np.concatenate([self._codes[cell], codes[rows]])
+            return ids
+    
+    def attach_vectors(self, vectors):
+        """Full vectors for ``rerank``: a ``.npy`` path (memory-mapped) or an
+        array, with row ``i`` holding the vector of id ``i``
+        """
+        if isinstance(vectors, str):
+            self.vectors_path = vectors
+            vectors = load_embeddings(vectors)
+        self.full_vectors = vectors
+    
+    def search(self, query, top_k: int = 5, nprobe: int = None, rerank: int = None):
+        """Approximate top-k: (ids, cosine similarities), best first
+
+        Without ``rerank`` similarities are estimated from the codes; with
+        it the ``rerank`` best candidates are re-scored on full vectors.
+        """
+        if rerank and self.full_vectors is None:
+            raise ValueError("rerank needs full vectors, see attach_vectors")
+        query = self._normalized(query)[0]
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        with self._lock:
+            if not self.is_trained or top_k <= 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            centroid_dists = np.einsum("ij,ij->i", self.centroids, self.centroids) - 2 * (self.centroids @ query)
+            probed = np.argpartition(centroid_dists, nprobe - 1)[:nprobe] if nprobe < self.nlist else range(self.nlist)
+            sub_rows = np.arange(self.m)
+            ids, dists = [], []
+            for cell in probed:
+                if not len(self._ids[cell]):
+                    continue
+                # Lookup table: distance from each query residual sub-vector
+                # to every codeword, then one gather-and-sum per candidate
+                residual = self._subspaces((query - self.centroids[cell])[None])[0]
+                table = ((self.codebooks - residual[:, None, :]) ** 2).sum(axis=2)
+                ids.append(self._ids[cell])
+                dists.append(table[sub_rows, self._codes[cell]].sum(axis=1))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids, dists = np.concatenate(ids), np.concatenate(dists)
+        # Unit vectors: ||q - x||^2 = 2 - 2 cos(q, x)
+        scores = 1 - dists / 2
+        
+        shortlist = max(top_k, rerank or 0)
+        if len(ids) > shortlist:
+            keep = np.argpartition(-scores, shortlist - 1)[:shortlist]
+            ids, scores = ids[keep], scores[keep]
+        if rerank:
+            # Sorted ids read the memory-mapped rows in file order
+            order = np.argsort(ids)
+            ids = ids[order]
+            scores = self._normalized(self.full_vectors[ids]) @ query
+        order = np.lexsort((ids, -scores))[:top_k]
+        return ids[order], scores[order].astype(np.float32)
+    
+    def exact_search(self, query, top_k: int = 5):
+        """Brute-force top-k over the attached full vectors, the reference for recall"""
+        if self.full_vectors is None:
+            raise ValueError("exact search needs full vectors, see attach_vectors")
+        return exact_cosine_top_k(self.full_vectors, self._normalized(query)[0], top_k)
+    
+    def recall_at_k(self, queries, top_k: int = 10, nprobe: int = None, rerank: int = None) -> float:
+        """Mean fraction of the exact top-k that ``search`` returns"""
+        queries = np.atleast_2d(queries)
+        found = 0
+        for query in queries:
+            approx, _ = self.search(query, top_k, nprobe, rerank)
+            exact, _ = self.exact_search(query, top_k)
+            found += len(np.intersect1d(approx, exact))
+        return found / max(1, len(queries) * min(top_k, self._count))
+    
+    def save(self, path: str):
+        """Write centroids, codebooks and the inverted lists to one ``.npz`` file"""
+        if not self.is_trained:
+            raise ValueError("Cannot save an untrained IVFPQIndex")
+        with self._lock:
+            with open(path, "wb") as f:
+                np.savez(
+                    f,
+                    params=np.array([self.dim, self.nlist, self.m, self.nbits, self.nprobe,
+                                     self.seed, self._count], dtype=np.int64),
+                    centroids=self.centroids,
+                    codebooks=self.codebooks,
+                    offsets=np.cumsum([0] + [len(ids) for ids in self._ids], dtype=np.int64),
+                    ids=np.concatenate(self._ids),
+                    codes=np.concatenate(self._codes),
+                    vectors_path=np.array(self.vectors_path or ""),
+                )
+    
+    @classmethod
+    def load(cls, path: str) -> "IVFPQIndex":
+        """Read an index written by ``save``, re-attaching its vector file if any"""
+        with np.load(path) as stored:
+            dim, nlist, m, nbits, nprobe, seed, count = (int(value) for value in stored["params"])
+            index = cls(dim, nlist=nlist, m=m, nbits=nbits, nprobe=nprobe, seed=seed)
+            index.centroids = stored["centroids"]
+            index.codebooks = stored["codebooks"]
+            offsets, ids, codes = stored["offsets"], stored["ids"], stored["codes"]
+            index._ids = [ids[offsets[cell]:offsets[cell + 1]] for cell in range(nlist)]
+            index._codes = [codes[offsets[cell]:offsets[cell + 1]] for cell in range(nlist)]
+            index._count = count
+            vectors_path = str(stored["vectors_path"])
+        if vectors_path and os.path.exists(vectors_path):
+            index.attach_vectors(vectors_path)
+        return index
+
+
+# ============================================================================
+# INT8 / BINARY QUANTIZED EMBEDDING STORE
+# ============================================================================
+
+# Set bits of every byte value, for Hamming distance over packed bits
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+class QuantizedEmbeddingStore:
+    """Embedding matrix kept in RAM as int8 or 1-bit codes, rescored in float
+
+    ``mode="int8"`` stores each normalized vector as int8 with one scale
+    per dimension (4x smaller than float32); the first pass is a dot
+    product with the codes. ``mode="binary"`` keeps only the sign of each
+    dimension, packed 8 per byte (32x smaller); the first pass ranks by
+    Hamming distance, counted with a popcount table over XORed bytes.
+    The best ``rerank`` candidates are then re-scored exactly on float
+    vectors attached from a memory-mapped ``.npy`` file.
+
+    Ids are row numbers of the embedding matrix.
+    """
+    
+    MODES = ("int8", "binary")
+    
+    def __init__(self, vectors, mode: str = "int8", chunk: int = 4096):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        self.mode = mode
+        self.chunk = chunk
+        self.dim = vectors.shape[1]
+        self.full_vectors = None
+        self.vectors_path = None
+        self.scales = None  # int8: per-dimension dequantization scale
+        if mode == "int8":
+            # Symmetric per-dimension scale from the largest magnitude seen
+            max_abs = np.zeros(self.dim, dtype=np.float32)
+            for start in range(0, len(vectors), chunk):
+                max_abs = np.maximum(max_abs, np.abs(self._normalized(vectors[start:start + chunk])).max(axis=0))
+            self.scales = np.where(max_abs == 0, 1, max_abs / 127).astype(np.float32)
+        self.codes = np.concatenate([
+            self._quantize(self._normalized(vectors[start:start + chunk]))
+            for start in range(0, len(vectors), chunk)
+        ]) if len(vectors) else self._quantize(np.zeros((0, self.dim), dtype=np.float32))
+    
+    @classmethod
+    def from_embeddings(cls, embeddings, mode: str = "int8", **kwargs) -> "QuantizedEmbeddingStore":
+        """Quantize an embedding matrix or a ``load_embeddings`` path; a
+        ``.npy`` file is memory-mapped and attached for rescoring
+        """
+        path = embeddings if isinstance(embeddings, str) else None
+        if path is not None:
+            embeddings = load_embeddings(path)
+        store = cls(embeddings, mode, **kwargs)
+        if path is not None and path.endswith(".npy"):
+            store.attach_vectors(path)
+        return store
+    
+    def __len__(self) -> int:
+        return len(self.codes)
+    
+    @property
+    def code_bytes(self) -> int:
+        """Memory held by the quantized codes"""
+        return self.codes.nbytes
+    
+    def _normalized(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+    
+    def _quantize(self, unit_vectors):
+        if self.mode == "int8":
+            return np.clip(np.rint(unit_vectors / self.scales), -127, 127).astype(np.int8)
+        return np.packbits(unit_vectors > 0, axis=1)
+    
+    def attach_vectors(self, vectors):
+        """Float vectors for rescoring: a ``.npy`` path (memory-mapped) or an
+        array, with row ``i`` holding the vector of id ``i``
+        """
+        if isinstance(vectors, str):
+            self.vectors_path = vectors
+            vectors = load_embeddings(vectors)
+        self.full_vectors = vectors
+    
+    def _first_pass(self, query):
+        """Approximate similarity of the unit ``query`` to every row"""
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        if self.mode == "int8":
+            # numpy has no int8 GEMM: widen one chunk at a time for BLAS
+            scaled_query = query * self.scales
+            for start in range(0, len(self.codes), self.chunk):
+                block = self.codes[start:start + self.chunk].astype(np.float32)
+                scores[start:start + len(block)] = block @ scaled_query
+        else:
+            query_bits = np.packbits(query > 0)
+            codes = self.codes
+            if hasattr(np, "bitwise_count"):
+                # numpy >= 2 counts bits natively, 8 bytes at a time when rows allow
+                if codes.shape[1] % 8 == 0 and codes.flags.c_contiguous:
+                    codes, query_bits = codes.view(np.uint64), query_bits.view(np.uint64)
+                popcount = np.bitwise_count
+            else:
+                popcount = _POPCOUNT.__getitem__
+            for start in range(0, len(codes), self.chunk):
+                block = codes[start:start + self.chunk]
+                hamming = popcount(np.bitwise_xor(block, query_bits)).sum(axis=1, dtype=np.int32)
+                # Matching sign fraction, mapped to [-1, 1] like a cosine
+                scores[start:start + len(block)] = 1 - 2 * hamming / self.dim
+        return scores
+    
+    def search(self, query, top_k: int = 5, rerank: int = None):
+        """Top-k (ids, similarities), best first
+
+        ``rerank`` first-pass candidates (default ``4 * top_k`` when float
+        vectors are attached, 0 to skip) are re-scored exactly; otherwise
+        similarities are the quantized estimates.
+        """
+        if rerank is None:
+            rerank = 4 * top_k if self.full_vectors is not None else 0
+        if rerank and self.full_vectors is None:
+            raise ValueError("rerank needs full vectors, see attach_vectors")
+        if top_k <= 0 or not len(self.codes):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = self._normalized(query)[0]
+        scores = self._first_pass(query)
+        ids = np.arange(len(scores), dtype=np.int64)
+        
+        shortlist = max(top_k, rerank)
+        if len(ids) > shortlist:
+            keep = np.argpartition(-scores, shortlist - 1)[:shortlist]
+            ids, scores = ids[keep], scores[keep]
+        if rerank:
+            # Sorted ids read the memory-mapped rows in file order
+            ids = np.sort(ids)
+            scores = self._normalized(self.full_vectors[ids]) @ query
+        order = np.lexsort((ids, -scores))[:top_k]
+        return ids[order], scores[order].astype(np.float32)
+    
+    def exact_search(self, query, top_k: int = 5):
+        """Brute-force top-k over the attached float vectors, the reference for recall"""
+        if self.full_vectors is None:
+            raise ValueError("exact search needs full vectors, see attach_vectors")
+        return exact_cosine_top_k(self.full_vectors, self._normalized(query)[0], top_k)
+    
+    def recall_at_k(self, queries, top_k: int = 10, rerank: int = None) -> float:
+        """Mean fraction of the exact top-k that ``search`` returns"""
+        queries = np.atleast_2d(queries)
+        found = 0
+        for query in queries:
+            approx, _ = self.search(query, top_k, rerank)
+            exact, _ = self.exact_search(query, top_k)
+            found += len(np.intersect1d(approx, exact))
+        return found / max(1, len(queries) * min(top_k, len(self)))
+    
+    def save(self, path: str):
+        """Write the codes (and int8 scales) to one ``.npz`` file"""
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                mode=np.array(self.mode),
+                dim=np.array(self.dim),
+                codes=self.codes,
+                scales=self.scales if self.scales is not None else np.zeros(0, dtype=np.float32),
+                vectors_path=np.array(self.vectors_path or ""),
+            )
+    
+    @classmethod
+    def load(cls, path: str) -> "QuantizedEmbeddingStore":
+        """Read a store written by ``save``, re-attaching its vector file if any"""
+        with np.load(path) as stored:
+            mode = str(stored["mode"])
+            store = cls(np.zeros((0, int(stored["dim"])), dtype=np.float32), mode)
+            store.codes = stored["codes"]
+            if mode == "int8":
+                store.scales = stored["scales"]
+            vectors_path = str(stored["vectors_path"])
+        if vectors_path and os.path.exists(vectors_path):
+            store.attach_vectors(vectors_path)
+        return store
+
+# ============================================================================
+# RECALL / LATENCY BENCHMARKS
+# ============================================================================
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p99 and mean, in milliseconds"""
+    ms = sorted(s * 1000 for s in seconds)
+    if not ms:
+        return {"p50_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0}
+    return {
+        "p50_ms": ms[max(1, math.ceil(0.50 * len(ms))) - 1],
+        "p99_ms": ms[max(1, math.ceil(0.99 * len(ms))) - 1],
+        "mean_ms": sum(ms) / len(ms),
+    }
+
+def noisy_queries(embeddings, num_queries: int, noise: float = 0.1, seed: int = 7):
+    """Stored rows plus Gaussian noise, so queries resemble but do not equal the corpus"""
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(embeddings[rng.choice(len(embeddings), size=num_queries)], dtype=np.float32)
+    scale = noise * np.linalg.norm(rows, axis=1, keepdims=True) / np.sqrt(rows.shape[1])
+    return rows + scale * rng.standard_normal(rows.shape).astype(np.float32)
+
+def memmappable(embeddings_path: str) -> str:
+    """``embeddings_path`` if it is a .npy file, else a temporary .npy copy
+    that the indexes can memory-map for exact rescoring
+    """
+    if embeddings_path.endswith(".npy"):
+        return embeddings_path
+    vectors_path = os.path.join(tempfile.mkdtemp(), "embeddings.npy")
+    np.save(vectors_path, load_embeddings(embeddings_path))
+    return vectors_path
+
+def exact_top_k_sets(index, queries, top_k: int):
+    """Exact top-k id sets per query and the exact-search latency"""
+    exact, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        exact.append(set(index.exact_search(query, top_k)[0].tolist()))
+        timings.append(time.perf_counter() - start)
+    return exact, latency_summary(timings)
+
+def benchmark_hnsw(embeddings, queries, top_k: int = 10, M: int = 16, ef_construction: int = 200,
+                   ef_search_values: List[int] = (16, 32, 64, 128)) -> List[Dict]:
+    """Recall@k and latency of HNSW at each ef_search against exact search"""
+    start = time.perf_counter()
+    index = HNSWIndex.from_embeddings(embeddings, M=M, ef_construction=ef_construction)
+    build_seconds = time.perf_counter() - start
+    exact, exact_latency = exact_top_k_sets(index, queries, top_k)
+
+    results = []
+    for ef_search in ef_search_values:
+        found, timings = 0, []
+        for query, truth in zip(queries, exact):
+            start = time.perf_counter()
+            ids, _ = index.search(query, top_k, ef_search)
+            timings.append(time.perf_counter() - start)
+            found += len(truth.intersection(ids.tolist()))
+        results.append({
+            "index": f"hnsw-M{M}-efc{ef_construction}-ef{ef_search}",
+            "num_vectors": len(index),
+            "build_seconds": build_seconds,
+            "recall_at_k": found / max(1, sum(len(truth) for truth in exact)),
+            "latency": {"approximate": latency_summary(timings), "exact": exact_latency},
+        })
+    return results
+
+def benchmark_ivfpq(embeddings_path: str, queries, top_k: int = 10, nlist: int = 256, m: int = 8,
+                    nprobe_values: List[int] = (1, 4, 16), rerank_values: List[int] = (0, 100)) -> List[Dict]:
+    """Recall@k, latency and code size of IVF-PQ per nprobe/rerank against exact search"""
+    # Re-ranking and the exact reference read a memory-mapped .npy file
+    start = time.perf_counter()
+    index = IVFPQIndex.from_embeddings(memmappable(embeddings_path), nlist=nlist, m=m)
+    build_seconds = time.perf_counter() - start
+    full_bytes = index.full_vectors.nbytes
+    exact, exact_latency = exact_top_k_sets(index, queries, top_k)
+
+    results = []
+    for nprobe in nprobe_values:
+        for rerank in rerank_values:
+            found, timings = 0, []
+            for query, truth in zip(queries, exact):
+                start = time.perf_counter()
+                ids, _ = index.search(query, top_k, nprobe, rerank)
+                timings.append(time.perf_counter() - start)
+                found += len(truth.intersection(ids.tolist()))
+            results.append({
+                "index": f"ivfpq-nlist{nlist}-m{m}-nprobe{nprobe}-rerank{rerank}",
+                "num_vectors": len(index),
+                "build_seconds": build_seconds,
+                "recall_at_k": found / max(1, sum(len(truth) for truth in exact)),
+                "memory": {"code_bytes": index.code_bytes, "full_vector_bytes": full_bytes},
+                "latency": {"approximate": latency_summary(timings), "exact": exact_latency},
+            })
+    return results
+
+def benchmark_quantized(embeddings_path: str, queries, top_k: int = 10, modes: List[str] = ("int8", "binary"),
+                        rerank_values: List[int] = (0, 40, 200)) -> List[Dict]:
+    """Recall@k, latency and code size of each quantization mode and rerank depth vs exact search"""
+    vectors_path = memmappable(embeddings_path)
+    results = []
+    for mode in modes:
+        start = time.perf_counter()
+        store = QuantizedEmbeddingStore.from_embeddings(vectors_path, mode=mode)
+        build_seconds = time.perf_counter() - start
+        exact, exact_latency = exact_top_k_sets(store, queries, top_k)
+        for rerank in rerank_values:
+            found, timings = 0, []
+            for query, truth in zip(queries, exact):
+                start = time.perf_counter()
+                ids, _ = store.search(query, top_k, rerank)
+                timings.append(time.perf_counter() - start)
+                found += len(truth.intersection(ids.tolist()))
+            results.append({
+                "index": f"{mode}-rerank{rerank}",
+                "num_vectors": len(store),
+                "build_seconds": build_seconds,
+                "recall_at_k": found / max(1, sum(len(truth) for truth in exact)),
+                "memory": {"code_bytes": store.code_bytes, "full_vector_bytes": store.full_vectors.nbytes},
+                "latency": {"approximate": latency_summary(timings), "exact": exact_latency},
+            })
+    return results
+
+def print_result(result: Dict, top_k: int):
+    approximate, exact = result["latency"]["approximate"], result["latency"]["exact"]
+    line = (f"   {result['index']:<36} build {result['build_seconds']:.1f}s | "
+            f"recall@{top_k} {result['recall_at_k']:.3f} | "
+            f"p50/p99 {approximate['p50_ms']:.2f}/{approximate['p99_ms']:.2f} ms "
+            f"(exact {exact['p50_ms']:.2f}/{exact['p99_ms']:.2f} ms)")
+    memory = result.get("memory")
+    if memory:
+        line += f" | codes {memory['code_bytes'] / 1e6:,.1f} MB vs {memory['full_vector_bytes'] / 1e6:,.1f} MB"
+    print(line)
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Recall@k and latency of the vector indexes vs exact search")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--hnsw", metavar="EMBEDDINGS", help="benchmark HNSW on a .joblib/.npy embedding matrix")
+    source.add_argument("--ivfpq", metavar="EMBEDDINGS", help="benchmark IVF-PQ on a .joblib/.npy embedding matrix")
+    source.add_argument("--quantized", metavar="EMBEDDINGS",
+                        help="benchmark int8/binary quantized search on a .joblib/.npy embedding matrix")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--hnsw-m", type=int, nargs="+", default=[16], help="HNSW links per node")
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--nlist", type=int, default=256, help="IVF coarse cells")
+    parser.add_argument("--pq-m", type=int, default=8, help="PQ sub-quantizers (bytes per vector)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 100],
+                        help="shortlist sizes re-scored on full vectors (0 = codes only)")
+    parser.add_argument("--modes", nargs="+", default=["int8", "binary"], choices=QuantizedEmbeddingStore.MODES)
+    parser.add_argument("--output", default="vector_bench_results.json")
+    args = parser.parse_args(argv)
+
+    embeddings_path = args.hnsw or args.ivfpq or args.quantized
+    embeddings = load_embeddings(embeddings_path)
+    queries = noisy_queries(embeddings, args.queries, seed=args.seed + 1)
+    print(f"\n🧭 {len(embeddings):,} embeddings x {embeddings.shape[1]} dims, top-{args.top_k}")
+    results = []
+    if args.hnsw:
+        for M in args.hnsw_m:
+            results += benchmark_hnsw(embeddings, queries, args.top_k, M, args.ef_construction, args.ef_search)
+    elif args.ivfpq:
+        del embeddings
+        results += benchmark_ivfpq(embeddings_path, queries, args.top_k, args.nlist, args.pq_m,
+                                   args.nprobe, args.rerank)
+    else:
+        del embeddings
+        results += benchmark_quantized(embeddings_path, queries, args.top_k, args.modes, args.rerank)
+    for result in results:
+        print_result(result, args.top_k)
+
+    with open(args.output, "w") as f:
+        json.dump({"embeddings": embeddings_path, "queries": args.queries, "top_k": args.top_k,
+                   "seed": args.seed, "results": results}, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
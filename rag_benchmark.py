@@ -0,0 +1,276 @@
+"""
+Benchmark suite for the lexical retrievers in rag_python_examples.py
+Synthetic pizza-schema corpora with Zipfian vocabularies, from 1k to 1M docs
+
+Usage:
+    python rag_benchmark.py --sizes 1000 10000 100000 --output bench.json
+    python rag_benchmark.py --compare bench.json   # flag regressions vs a previous run
+    python rag_benchmark.py --retrievers bm25 bm25-wand --query-terms 6 10   # WAND vs exhaustive
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from itertools import accumulate
+from typing import Dict, List
+
+from rag_python_examples import (
+    BM25Retriever, Document, PartitionedRAGSystem, RAGSystem, TFIDFRetriever,
+)
+
+# ============================================================================
+# SYNTHETIC CORPUS
+# ============================================================================
+
+PIZZA_TERMS = [
+    "pizza", "dough", "oven", "cheese", "mozzarella", "tomato", "sauce", "basil", "crust",
+    "wood-fired", "neapolitan", "flour", "yeast", "knead", "bake", "slice", "pepperoni",
+    "olive", "garlic", "oregano", "delivery", "franchise", "restaurant", "naples", "italy",
+    "dubai", "recipe", "fermentation", "temperature", "crispy",
+]
+AUTHORS = ["Chef Maria", "Chef Marco", "Food Historian", "Business Analyst", "Chef Aisha", "Critic Leo"]
+CATEGORIES = ["Recipe", "Culture", "Business", "Review", "Technique"]
+REGIONS = ["UAE", "Italy", "USA", "UK", "India"]
+TAGS = ["pizza", "cooking", "oven", "dough", "recipe", "italy", "history", "business", "dubai", "vegan"]
+
+def build_vocabulary(size: int) -> List[str]:
+    """Pizza terms first (the most frequent ranks), then synthetic filler words"""
+    return PIZZA_TERMS + [f"word{i:06d}" for i in range(size - len(PIZZA_TERMS))]
+
+def zipf_cum_weights(size: int, exponent: float) -> List[float]:
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, size + 1)))
+
+def generate_corpus(num_docs: int, vocab_size: int = 50_000, exponent: float = 1.1,
+                    seed: int = 42) -> List[Document]:
+    """Reproducible documents with Zipf-distributed words and realistic metadata"""
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(vocab_size)
+    cum_weights = zipf_cum_weights(vocab_size, exponent)
+
+    documents = []
+    for doc_id in range(num_docs):
+        length = max(5, int(rng.lognormvariate(4.2, 0.5)))  # median ~67 words
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=length)
+        documents.append(Document(
+            id=doc_id,
+            title=" ".join(words[:6]).title(),
+            content=" ".join(words),
+            metadata={
+                "author": rng.choice(AUTHORS),
+                "date": f"{rng.randint(2022, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "category": rng.choice(CATEGORIES),
+                "region": rng.choice(REGIONS),
+                "access_level": "premium" if rng.random() < 0.3 else "public",
+                "tags": rng.sample(TAGS, rng.randint(1, 3)),
+            }
+        ))
+    return documents
+
+def generate_queries(num_queries: int, vocab_size: int = 50_000, exponent: float = 1.1,
+                     seed: int = 7, min_terms: int = 1, max_terms: int = 4) -> List[str]:
+    """``min_terms``-``max_terms`` term queries drawn from the same Zipf distribution as the corpus"""
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(vocab_size)
+    cum_weights = zipf_cum_weights(vocab_size, exponent)
+    return [
+        " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(min_terms, max_terms)))
+        for _ in range(num_queries)
+    ]
+
+def generate_filters(num_queries: int, seed: int = 11) -> List[Dict]:
+    """User contexts, as RAGSystem.retrieve_with_* keyword arguments"""
+    rng = random.Random(seed)
+    return [
+        {
+            "user_access": rng.choice(["public", "premium"]),
+            "user_region": rng.choice(REGIONS + [None]),
+            "category": rng.choice(CATEGORIES + [None, None]),
+        }
+        for _ in range(num_queries)
+    ]
+
+def as_index_filters(user_filters: Dict) -> Dict:
+    """RAGSystem keyword arguments -> MetadataIndex.allowed_docs arguments"""
+    return {
+        "access_level": user_filters["user_access"],
+        "region": user_filters["user_region"],
+        "category": user_filters["category"],
+    }
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    ms = sorted(s * 1000 for s in seconds)
+    return {
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "mean_ms": sum(ms) / len(ms) if ms else 0.0,
+    }
+
+def build(name: str, documents: List[Document]):
+    if name in ("tfidf", "tfidf-wand"):
+        return TFIDFRetriever(documents)
+    if name in ("bm25", "bm25-wand"):
+        return BM25Retriever(documents)
+    if name == "partitioned":
+        return PartitionedRAGSystem(documents, partition_by="access_level")
+    # Cache disabled so repeated queries measure retrieval, not lookups
+    return RAGSystem(documents, cache_size=0)
+
+def search(name: str, index, query: str, top_k: int, user_filters: Dict = None):
+    if name in ("rag", "partitioned"):
+        return index.retrieve_with_bm25(query, top_k=top_k, **(user_filters or {}))
+    filters = as_index_filters(user_filters) if user_filters else None
+    return index.retrieve(query, top_k=top_k, wand=name.endswith("-wand"), filters=filters)
+
+def benchmark(name: str, documents: List[Document], queries: List[str], user_filters: List[Dict],
+              top_k: int = 10, measure_memory: bool = True, warmup: int = 20) -> Dict:
+    start = time.perf_counter()
+    index = build(name, documents)
+    build_seconds = time.perf_counter() - start
+
+    memory = None
+    if measure_memory:
+        # Separate build: tracemalloc slows allocation and would skew the timing
+        del index
+        tracemalloc.start()
+        index = build(name, documents)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory = {"index_bytes": current, "peak_build_bytes": peak}
+
+    # Warm up lazily computed state (block maxima, decoded postings) first
+    for query in queries[:warmup]:
+        search(name, index, query, top_k)
+
+    latencies = {}
+    for mode in ("unfiltered", "filtered"):
+        timings = []
+        for query, filters in zip(queries, user_filters):
+            start = time.perf_counter()
+            search(name, index, query, top_k, filters if mode == "filtered" else None)
+            timings.append(time.perf_counter() - start)
+        latencies[mode] = latency_summary(timings)
+
+    return {
+        "retriever": name,
+        "num_docs": len(documents),
+        "build_seconds": build_seconds,
+        "memory": memory,
+        "latency": latencies,
+    }
+
+def compare(results: List[Dict], baseline_path: str, tolerance: float) -> List[str]:
+    """Metrics that got worse than the baseline run by more than ``tolerance``"""
+    with open(baseline_path) as f:
+        baseline = {(r["retriever"], r["num_docs"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        old = baseline.get((result["retriever"], result["num_docs"]))
+        if old is None:
+            continue
+        metrics = [("build_seconds", old["build_seconds"], result["build_seconds"])]
+        for mode, summary in result["latency"].items():
+            for stat in ("p50_ms", "p95_ms", "p99_ms"):
+                metrics.append((f"{mode}.{stat}", old["latency"][mode][stat], summary[stat]))
+        for metric, before, after in metrics:
+            if before > 0 and after > before * (1 + tolerance):
+                regressions.append(
+                    f"{result['retriever']} @ {result['num_docs']:,} docs: {metric} "
+                    f"{before:.3f} -> {after:.3f} (+{(after / before - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+# ============================================================================
+# RUN BENCHMARKS
+# ============================================================================
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="corpus sizes in documents (up to 1000000)")
+    parser.add_argument("--retrievers", nargs="+", default=["tfidf", "bm25", "rag"],
+                        choices=["tfidf", "bm25", "tfidf-wand", "bm25-wand", "rag", "partitioned"])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--query-terms", type=int, nargs=2, default=[1, 4], metavar=("MIN", "MAX"),
+                        help="terms per query")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20, help="untimed queries before measuring")
+    parser.add_argument("--vocab-size", type=int, default=50_000)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of word frequencies")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc build pass")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown vs --compare before flagging (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    queries = generate_queries(args.queries, args.vocab_size, args.zipf, seed=args.seed + 1,
+                               min_terms=args.query_terms[0], max_terms=args.query_terms[1])
+    user_filters = generate_filters(args.queries, seed=args.seed + 2)
+
+    results = []
+    for size in args.sizes:
+        start = time.perf_counter()
+        documents = generate_corpus(size, args.vocab_size, args.zipf, seed=args.seed)
+        print(f"\n📚 {size:,} documents generated in {time.perf_counter() - start:.1f}s")
+        for name in args.retrievers:
+            result = benchmark(name, documents, queries, user_filters, args.top_k,
+                               not args.no_memory, args.warmup)
+            results.append(result)
+            memory = result["memory"]
+            memory_text = f" | {memory['index_bytes'] / 1e6:,.1f} MB" if memory else ""
+            print(f"   {name:<10} build {result['build_seconds']:.2f}s{memory_text} | "
+                  + " | ".join(
+                      f"{mode} p50/p95/p99 {s['p50_ms']:.2f}/{s['p95_ms']:.2f}/{s['p99_ms']:.2f} ms"
+                      for mode, s in result["latency"].items()
+                  ))
+        del documents
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "queries": args.queries,
+            "top_k": args.top_k,
+            "warmup": args.warmup,
+            "vocab_size": args.vocab_size,
+            "zipf": args.zipf,
+            "query_terms": args.query_terms,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"⚠️  {line}")
+        if regressions:
+            return 1
+        print(f"✅ No regressions beyond {args.tolerance:.0%} vs {args.compare}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
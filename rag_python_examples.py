@@ -3,10 +3,35 @@ Complete RAG System with TF-IDF, BM25, and Metadata Filtering
 Real-world pizza recipe knowledge base example
 """
 
+import csv
+import heapq
+import json
 import math
-from collections import defaultdict
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict, defaultdict
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from itertools import accumulate, chain, groupby, islice
+from operator import itemgetter
+from typing import Callable, Iterable, List, Dict, Tuple, Iterator
+
+try:  # only needed by SparseScoringEngine (PART 11)
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
 
 # ============================================================================
 # PART 1: DOCUMENT & METADATA SETUP
@@ -117,122 +142,980 @@ def build_vocab_and_idf(documents: List[Document]) -> Tuple[Dict, Dict]:
     
     return vocab, idf
 
-# ============================================================================
-# PART 3: TF-IDF IMPLEMENTATION
-# ============================================================================
+def simple_stem(word: str) -> str:
+    """Light suffix stripping (cooking -> cook, ovens -> oven)"""
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
 
-class TFIDFRetriever:
-    """Traditional TF-IDF keyword search"""
+class Analyzer:
+    """Compiled text analysis pipeline with a shared integer vocabulary
+
+    Tokenizes with a precompiled regex and, by default, yields exactly the
+    terms of ``preprocess_text``; stopword removal and stemming are opt-in.
+    Terms are interned to dense integer ids, and each document's id array
+    is cached, so a document is analyzed once no matter how many indexes,
+    deletes or merges look at it. Retrievers built with the same analyzer
+    share term ids.
+
+    With ``offsets=True`` the cache also keeps each term's character span
+    in the original text, so snippets can be cut and highlighted without
+    tokenizing the document again (see ``make_snippet``). Documents that
+    were indexed without offsets (segments, streams, parallel builds) get
+    their spans on first use instead, kept for the ``span_cache_size``
+    most recently used documents.
+    """
+    
+    TOKEN_RE = re.compile(r"\S+")
+    STRIP_CHARS = ".,!?;:"
+    
+    def __init__(self, stopwords: List[str] = None, stemmer: Callable[[str], str] = None,
+                 min_length: int = 3, cache: bool = True, offsets: bool = False,
+                 span_cache_size: int = 1024):
+        self.stopwords = frozenset(stopwords or ())
+        self.stemmer = stemmer
+        self.min_length = min_length
+        self.cache = cache
+        self.offsets = offsets
+        self.vocabulary: Dict[str, int] = {}  # term -> id
+        self.terms: List[str] = []            # id -> term
+        # doc id -> (content, term ids, flat [start, end, ...] spans or None)
+        self._analyzed: Dict[int, Tuple[str, array, array]] = {}
+        # LRU of doc id -> (content, words, flat spans) for read-only analysis
+        self.span_cache_size = span_cache_size
+        self._span_cache = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def tokenize(self, text: str) -> List[str]:
+        strip = self.STRIP_CHARS
+        min_length = self.min_length
+        words = [w.strip(strip) for w in self.TOKEN_RE.findall(text.lower()) if len(w) >= min_length]
+        if self.stopwords:
+            words = [w for w in words if w not in self.stopwords]
+        if self.stemmer is not None:
+            words = [self.stemmer(w) for w in words]
+        return words
+    
+    def tokenize_with_spans(self, text: str) -> Tuple[List[str], array]:
+        """``tokenize`` plus the [start, end) of each term in ``text``,
+        flattened as ``[start0, end0, start1, end1, ...]``
+        """
+        strip = self.STRIP_CHARS
+        min_length = self.min_length
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # Rare characters change length when lowercased; lowercase per
+            # token instead so offsets still index the original text
+            lowered = None
+        words = []
+        spans = array("I")
+        for match in self.TOKEN_RE.finditer(text if lowered is None else lowered):
+            raw = match.group() if lowered is not None else match.group().lower()
+            if len(raw) < min_length:
+                continue
+            word = raw.strip(strip)
+            if word in self.stopwords:
+                continue
+            # Strip characters are ASCII, so measure them on the raw token
+            start = match.start() + len(raw) - len(raw.lstrip(strip))
+            end = match.end() - len(raw) + len(raw.rstrip(strip))
+            words.append(word)
+            spans.append(start)
+            spans.append(max(start, end))
+        if self.stemmer is not None:
+            words = [self.stemmer(w) for w in words]
+        return words, spans
+    
+    @property
+    def config(self) -> Tuple:
+        """Constructor arguments that reproduce this analyzer's tokenization"""
+        return self.stopwords, self.stemmer, self.min_length
+    
+    def term_id(self, term: str) -> int:
+        """Id of ``term``, assigning the next free one if it is new"""
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            with self._lock:
+                term_id = self.vocabulary.get(term)
+                if term_id is None:
+                    term_id = len(self.terms)
+                    self.terms.append(term)
+                    self.vocabulary[term] = term_id
+        return term_id
+    
+    def analyze(self, doc: Document) -> array:
+        """Term ids of ``doc.content`` in order, cached per document id"""
+        cached = self._analyzed.get(doc.id)
+        if cached is not None and cached[0] is doc.content:
+            return cached[1]
+        return self._analyze(doc, self.offsets)[0]
+    
+    def analyze_with_spans(self, doc: Document, unknown: Dict[str, int] = None) -> Tuple[array, array]:
+        """Term ids and flat character spans of ``doc.content``; the spans
+        come from the cache when the document was indexed with ``offsets``
+
+        With an ``unknown`` dict a cache miss is analyzed read-only: nothing
+        is interned, and words outside the vocabulary get negative ids,
+        numbered in ``unknown`` (see ``query_terms``). The words and spans
+        go to an LRU of ``span_cache_size`` documents, so a document is
+        tokenized once however often it is shown; ids are looked up per
+        call, since the vocabulary may have grown in between.
+        """
+        cached = self._analyzed.get(doc.id)
+        if cached is not None and cached[0] is doc.content and cached[2] is not None:
+            return cached[1], cached[2]
+        if unknown is None:
+            return self._analyze(doc, True)
+        with self._lock:
+            entry = self._span_cache.get(doc.id)
+            # Equal, not identical: store-backed documents are decoded afresh per read
+            if entry is not None and entry[0] == doc.content:
+                self._span_cache.move_to_end(doc.id)
+            else:
+                entry = None
+        if entry is None:
+            words, spans = self.tokenize_with_spans(doc.content)
+            if self.span_cache_size > 0:
+                with self._lock:
+                    self._span_cache[doc.id] = (doc.content, words, spans)
+                    self._span_cache.move_to_end(doc.id)
+                    while len(self._span_cache) > self.span_cache_size:
+                        self._span_cache.popitem(last=False)
+        else:
+            _, words, spans = entry
+        return array("i", self._lookup(words, unknown)), spans
+    
+    def _analyze(self, doc: Document, offsets: bool) -> Tuple[array, array]:
+        if offsets:
+            words, spans = self.tokenize_with_spans(doc.content)
+        else:
+            words, spans = self.tokenize(doc.content), None
+        term_ids = array("I", [self.term_id(w) for w in words])
+        if self.cache:
+            self._analyzed[doc.id] = (doc.content, term_ids, spans)
+        return term_ids, spans
+    
+    def term_frequencies(self, doc: Document) -> Tuple[Counter, int]:
+        """term id -> tf, and the token count, of one document"""
+        term_ids = self.analyze(doc)
+        return Counter(term_ids), len(term_ids)
+    
+    def query_terms(self, query: str, unknown: Dict[str, int] = None) -> List[int]:
+        """Ids of the query's known terms, in query order (repeats kept)
+
+        With an ``unknown`` dict, unknown terms are kept too, under the
+        negative ids ``analyze_with_spans`` gives them.
+        """
+        vocabulary = self.vocabulary
+        if unknown is not None:
+            return self._lookup(self.tokenize(query), unknown)
+        return [vocabulary[w] for w in self.tokenize(query) if w in vocabulary]
+    
+    def _lookup(self, words: List[str], unknown: Dict[str, int]) -> List[int]:
+        vocabulary = self.vocabulary
+        ids = []
+        for word in words:
+            term_id = vocabulary.get(word)
+            if term_id is None:
+                term_id = unknown.setdefault(word, -1 - len(unknown))
+            ids.append(term_id)
+        return ids
+    
+    def evict(self, doc_id: int):
+        """Drop a document's cached analysis"""
+        self._analyzed.pop(doc_id, None)
+        with self._lock:
+            self._span_cache.pop(doc_id, None)
+
+def _index_shard(args) -> Tuple[List[str], array, array, array, array]:
+    """Process-pool worker: the postings of one shard as flat arrays
+
+    Returns the shard's terms in order of first occurrence, the end offset
+    of each term's postings, and flat doc_idx / tf / doc-length arrays.
+    Arrays pickle as raw bytes, so shipping them back costs far less than
+    millions of (doc_idx, tf) tuples.
+    """
+    contents, start, config = args
+    analyzer = Analyzer(*config, cache=False)
+    postings = {}
+    doc_lengths = array("I")
+    for doc_idx, content in enumerate(contents, start):
+        words = analyzer.tokenize(content)
+        for word, count in Counter(words).items():
+            plist = postings.get(word)
+            if plist is None:
+                plist = postings[word] = array("I")
+            plist.append(doc_idx)
+            plist.append(count)
+        doc_lengths.append(len(words))
+    
+    ends, docs, tfs = array("Q"), array("I"), array("I")
+    for plist in postings.values():
+        docs.extend(plist[0::2])
+        tfs.extend(plist[1::2])
+        ends.append(len(docs))
+    return list(postings), ends, docs, tfs, doc_lengths
+
+def build_inverted_index(documents: List[Document], analyzer: Analyzer = None,
+                         workers: int = 1) -> Tuple[Dict, List[int]]:
+    """Build term id -> postings of (doc_idx, tf) plus a doc-length array
+
+    doc_idx is the position of the document in ``documents``, so postings
+    lists come out sorted by document and lengths can be looked up by index.
+
+    With ``workers > 1`` the documents are cut into contiguous shards that
+    are analyzed in a process pool (the analyzer's stemmer must then be
+    picklable, e.g. a module-level function). Each shard returns flat
+    arrays (see ``_index_shard``); as shards come back in document order,
+    appending each shard's slice to the term's list keeps every postings
+    list sorted, and interning terms in each shard's first-occurrence order
+    assigns the same term ids as the serial build. The result equals the
+    serial build. Workers tokenize on their own, so the parallel build
+    leaves the analyzer's per-document cache empty.
+    """
+    analyzer = analyzer or Analyzer()
+    if workers > 1 and len(documents) > 1:
+        # A few shards per worker keeps the pool busy when shards are uneven
+        shard_size = -(-len(documents) // (workers * 4))
+        shards = (
+            ([doc.content for doc in documents[start:start + shard_size]], start, analyzer.config)
+            for start in range(0, len(documents), shard_size)
+        )
+        postings = {}
+        doc_lengths = array("I")
+        term_id = analyzer.term_id
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for words, ends, docs, tfs, shard_lengths in pool.map(_index_shard, shards):
+                start = 0
+                for word, end in zip(words, ends):
+                    term = term_id(word)
+                    plist = postings.get(term)
+                    if plist is None:
+                        plist = postings[term] = []
+                    plist.extend(zip(docs[start:end], tfs[start:end]))
+                    start = end
+                doc_lengths.extend(shard_lengths)
+        return postings, list(doc_lengths)
     
-    def __init__(self, documents: List[Document]):
+    postings = defaultdict(list)
+    doc_lengths = []
+    
+    for doc_idx, doc in enumerate(documents):
+        tf, doc_length = analyzer.term_frequencies(doc)
+        for term, count in tf.items():
+            postings[term].append((doc_idx, count))
+        doc_lengths.append(doc_length)
+    
+    return dict(postings), doc_lengths
+
+# The index a batch worker process serves, set by its pool's initializer.
+# Every pool forks its own processes, so each one sees only its own index.
+_batch_index = None
+
+def _init_batch_worker(index: "LexicalIndex"):
+    global _batch_index
+    _batch_index = index
+
+def _batch_chunk(args) -> List[List[Tuple[int, float]]]:
+    chunk, top_k, allowed = args
+    return _batch_index._batch_top_k(chunk, top_k, allowed)
+
+class LexicalIndex:
+    """Inverted index state shared by the lexical retrievers
+
+    Built in memory from ``documents``, or served straight from an mmap'ed
+    ``LexicalSegment`` (see PART 8) so workers skip the rebuild on startup. With
+    ``workers > 1`` the in-memory build is spread over a process pool.
+
+    The index can also be updated in place (see PART 10): added documents go
+    to an in-memory delta segment, deletes leave tombstones, and IDF and
+    ``avg_doc_length`` are derived from incrementally maintained counts.
+    Once enough changes pile up, a background merge folds everything back
+    into a single compacted segment.
+
+    Postings, IDF and block maxima are keyed by the ``Analyzer``'s integer
+    term ids; ``vocab`` and ``doc_vectors`` still speak in terms. Indexes
+    over the same documents and analyzer can share one build by passing
+    ``build_inverted_index``'s result as ``inverted_index``, and a
+    ``metadata_index`` already built over ``documents`` (and, with a
+    segment, checked against it by ``LexicalSegment.checked``).
+    """
+    
+    # Merge once tombstones + delta documents exceed this share of the index
+    merge_threshold = 0.25
+    
+    def __init__(self, documents: List[Document], segment: "LexicalSegment" = None,
+                 analyzer: Analyzer = None, workers: int = 1, inverted_index: Tuple[Dict, List[int]] = None,
+                 metadata_index: "MetadataIndex" = None):
+        self._lock = threading.RLock()
+        self._merge_thread = None
+        self._process_pool = None  # (pool, index version, workers), see _batch_pool
+        self.version = 0
+        self._owns_analyzer = analyzer is None
+        self.analyzer = analyzer or Analyzer()
+        
+        # A DocumentStore stays on disk; updates only append in memory (see PART 15)
+        if isinstance(documents, DocumentStore):
+            documents = _StoredDocuments(documents)
+        else:
+            documents = list(documents)
+        if segment is None:
+            if inverted_index is None:
+                inverted_index = build_inverted_index(documents, self.analyzer, workers)
+            postings, doc_lengths = inverted_index
+            # Postings are only read after the build; lengths grow with adds
+            self._load_base(documents, postings, list(doc_lengths), metadata_index=metadata_index)
+        else:
+            if metadata_index is None:
+                # One pass over the documents checks them and indexes their metadata
+                metadata_index = MetadataIndex(segment.checked(documents))
+            postings = _SegmentTermIds(segment.postings, self.analyzer)
+            positions = {doc_id: doc_idx for doc_idx, doc_id in enumerate(segment.doc_ids)}
+            self._load_base(documents, postings, segment.doc_lengths, segment, metadata_index, positions)
+    
+    def _load_base(self, documents: List[Document], postings: Mapping, doc_lengths,
+                   segment: "LexicalSegment" = None, metadata_index: "MetadataIndex" = None,
+                   positions: Dict[int, int] = None):
+        """Install a freshly built (or merged) base segment"""
         self.documents = documents
-        self.vocab, self.idf = build_vocab_and_idf(documents)
-        self.doc_vectors = self._build_tfidf_vectors()
+        if metadata_index is None:
+            metadata_index = MetadataIndex(documents)
+        self.metadata_index = metadata_index
+        self.segment = segment
+        self.postings = self._base_postings = postings
+        self.doc_lengths = doc_lengths
+        self._base_size = len(documents)
+        if positions is None:
+            positions = {doc.id: doc_idx for doc_idx, doc in enumerate(documents)}
+        self._positions = positions
+        
+        # Incremental state, see PART 10
+        self.deleted = set()
+        self._deleted_order = []  # the same tombstones, sorted, for positional lookups
+        self._delta_postings = {}
+        self._df_delta = defaultdict(int)
+        self._total_length = sum(doc_lengths)
+        
+        if segment is None:
+            total_docs = len(documents)
+            self.idf = {
+                term: math.log(total_docs / len(plist))
+                for term, plist in postings.items()
+            }
+            self.avg_doc_length = self._total_length / len(documents) if documents else 0
+            # Length ratio used by BM25's normalization
+            self.doc_norms = [
+                length / self.avg_doc_length if self.avg_doc_length else 0.0
+                for length in doc_lengths
+            ]
+        else:
+            self.idf = _SegmentTermIds(segment.idf, self.analyzer)
+            self.avg_doc_length = segment.avg_doc_length
+            self.doc_norms = segment.norms
+        
+        self._posting_blocks = {}
     
-    def _build_tfidf_vectors(self) -> Dict[int, Dict]:
-        """Build TF-IDF vectors for all documents"""
-        vectors = {}
-        for doc in self.documents:
-            words = preprocess_text(doc.content)
-            tf = defaultdict(int)
-            
-            for word in words:
-                tf[word] += 1
+    def collection_stats(self) -> Tuple[int, Dict[str, int], int]:
+        """(live documents, term -> document frequency, total tokens)"""
+        with self._lock:
+            terms = self.analyzer.terms
+            doc_freqs = {}
+            for term in self.idf:
+                df = self.idf.doc_freq(term) if isinstance(self.idf, _LiveIdf) else len(self.postings[term])
+                doc_freqs[terms[term]] = df
+            return len(self.documents) - len(self.deleted), doc_freqs, self._total_length
+    
+    def use_collection_stats(self, num_docs: int, doc_freqs: Dict[str, int], total_length: int):
+        """Score as one shard of a larger collection with these statistics
+
+        IDF and ``avg_doc_length`` come from the whole collection, so shard
+        scores equal the scores of a single index over all documents. The
+        shard must not be updated afterwards.
+        """
+        with self._lock:
+            vocabulary = self.analyzer.vocabulary
+            self.idf = {
+                vocabulary[word]: math.log(num_docs / df)
+                for word, df in doc_freqs.items() if word in vocabulary
+            }
+            self.avg_doc_length = total_length / num_docs if num_docs else 0
+            self.doc_norms = [
+                length / self.avg_doc_length if self.avg_doc_length else 0.0
+                for length in self.doc_lengths
+            ]
+            self.version += 1
+    
+    @property
+    def vocab(self) -> set:
+        """Terms with at least one live document"""
+        terms = self.analyzer.terms
+        return {terms[term] for term in self.idf}
+    
+    def _query_terms(self, query: str) -> List[int]:
+        """Analyze a query into term ids, in order"""
+        if self.segment is None:
+            return self.analyzer.query_terms(query)
+        # Terms only the segment knows about get an id on first use
+        analyzer = self.analyzer
+        return [
+            analyzer.term_id(w) for w in analyzer.tokenize(query)
+            if w in analyzer.vocabulary or self.segment.term_ordinal(w) >= 0
+        ]
+    
+    def _term_impact(self, weight: float, doc_idx: int, tf: int) -> float:
+        """Score contribution of one posting, given the term's IDF weight"""
+        raise NotImplementedError
+    
+    def _impact_bound(self, weight: float, tf: int, doc_length: int) -> float:
+        """Upper bound on ``_term_impact`` for any posting with at most ``tf``
+        occurrences in a document of at least ``doc_length`` tokens"""
+        raise NotImplementedError
+    
+    def _blocks(self, term: int, plist: List[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+        """Block-max summary of a postings list: (max tf, min doc length)
+        for every ``_BLOCK_SIZE`` postings
+
+        The summary depends only on the postings and doc lengths, not on IDF
+        or the average length, so updates never invalidate it: postings only
+        grow at the end until the next merge, and then only the trailing
+        partial block is recomputed. Tombstoned documents just loosen it.
+        """
+        blocks = self._posting_blocks.get(term)
+        if blocks is not None and blocks[0] == len(plist):
+            return blocks[1:]
+        if blocks is None or blocks[0] > len(plist):
+            max_tfs, min_lengths = [], []
+            start = 0
+        else:
+            _, max_tfs, min_lengths = blocks
+            full = blocks[0] // _BLOCK_SIZE
+            del max_tfs[full:], min_lengths[full:]
+            start = full * _BLOCK_SIZE
+        doc_lengths = self.doc_lengths
+        for i in range(start, len(plist), _BLOCK_SIZE):
+            block = plist[i:i + _BLOCK_SIZE]
+            max_tfs.append(max(tf for _, tf in block))
+            min_lengths.append(min(doc_lengths[doc_idx] for doc_idx, _ in block))
+        self._posting_blocks[term] = (len(plist), max_tfs, min_lengths)
+        return max_tfs, min_lengths
+    
+    def _top_k(self, query_terms: List[int], top_k: int, wand: bool = False,
+               allowed: "RoaringBitmap" = None) -> List[Tuple[int, float]]:
+        """Rank (doc_idx, score) pairs, best first, ties in document order
+
+        If ``allowed`` is given, only those doc positions are scored.
+        """
+        if wand:
+            return maxscore_top_k(self, query_terms, top_k, allowed=allowed)
+        
+        scores = self._scores(query_terms, allowed)
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:top_k]
+    
+    def _scores(self, query_terms: List[int], allowed: "RoaringBitmap" = None) -> Dict[int, float]:
+        """doc_idx -> score for every live (and allowed) document matching a term"""
+        scores = defaultdict(float)
+        for term in query_terms:
+            if term in self.idf:
+                weight = self.idf[term]
+                if allowed is None:
+                    for doc_idx, tf in self.postings[term]:
+                        scores[doc_idx] += self._term_impact(weight, doc_idx, tf)
+                else:
+                    for doc_idx, tf in self.postings[term]:
+                        if doc_idx in allowed:
+                            scores[doc_idx] += self._term_impact(weight, doc_idx, tf)
+        if allowed is None:
+            for doc_idx in self.deleted:
+                scores.pop(doc_idx, None)
+        return scores
+    
+    def _retrieve(self, query: str, top_k: int, wand: bool, filters: Dict = None) -> List[Tuple[Document, float]]:
+        with self._lock:
+            query_terms = self._query_terms(query)
+            allowed = None
+            if filters is not None:
+                # Pre-filter: resolve the metadata filter to doc positions first
+                allowed = self.metadata_index.allowed_docs(**filters)
+            ranked = self._top_k(query_terms, top_k, wand=wand, allowed=allowed)
+            return [(self.documents[doc_idx], score) for doc_idx, score in ranked]
+    
+    def _batch_top_k(self, batch_terms: List[List[int]], top_k: int, allowed: "RoaringBitmap" = None,
+                     impacts: Dict = None) -> List[List[Tuple[int, float]]]:
+        """``_top_k`` for many queries, sharing per-term work
+
+        Each distinct term's postings are walked once: the filtered,
+        tombstone-free (doc_idx, impact) list is kept in ``impacts`` and
+        every query using the term only adds it up. Queries still sum their
+        terms in query order, so scores equal ``_top_k``'s.
+        """
+        if impacts is None:
+            impacts = {}
+        deleted = self.deleted
+        results = []
+        for query_terms in batch_terms:
+            scores = defaultdict(float)
+            for term in query_terms:
+                if term not in impacts:
+                    if term not in self.idf:
+                        impacts[term] = ()
+                    else:
+                        weight = self.idf[term]
+                        impacts[term] = [
+                            (doc_idx, self._term_impact(weight, doc_idx, tf))
+                            for doc_idx, tf in self.postings[term]
+                            if doc_idx not in deleted and (allowed is None or doc_idx in allowed)
+                        ]
+                for doc_idx, impact in impacts[term]:
+                    scores[doc_idx] += impact
+            results.append(heapq.nsmallest(top_k, scores.items(), key=lambda x: (-x[1], x[0])))
+        return results
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 3, filters: Dict = None,
+                       workers: int = 1, processes: bool = False) -> List[List[Tuple[Document, float]]]:
+        """Retrieve for many queries at once; same results as ``retrieve``
+
+        Terms are deduplicated across the batch and each postings list is
+        walked once, with ``filters`` resolved once for the whole batch.
+        ``workers > 1`` splits the queries into chunks scored in parallel
+        threads (sharing the per-term work) or, with ``processes=True``,
+        forked worker processes. Scoring is pure Python, so threads only
+        overlap with I/O and give no speedup under the GIL; processes do.
+        The worker processes are kept for the next batch until the index
+        changes, and ``close()`` shuts them down.
+        """
+        with self._lock:
+            batch_terms = [self._query_terms(query) for query in queries]
+            allowed = None
+            if filters is not None:
+                allowed = self.metadata_index.allowed_docs(**filters)
             
-            # Normalize TF by document length
-            doc_length = len(words)
-            tfidf_vec = {}
-            for word, count in tf.items():
-                normalized_tf = count / doc_length if doc_length > 0 else 0
-                tfidf_vec[word] = normalized_tf * self.idf[word]
+            if workers <= 1 or len(batch_terms) < 2:
+                ranked = self._batch_top_k(batch_terms, top_k, allowed)
+            else:
+                size = -(-len(batch_terms) // workers)
+                chunks = [batch_terms[i:i + size] for i in range(0, len(batch_terms), size)]
+                if processes:
+                    pool = self._batch_pool(len(chunks))
+                    parts = pool.map(_batch_chunk, [(chunk, top_k, allowed) for chunk in chunks])
+                    ranked = [result for part in parts for result in part]
+                else:
+                    impacts = {}
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        parts = pool.map(lambda chunk: self._batch_top_k(chunk, top_k, allowed, impacts), chunks)
+                        ranked = [result for part in parts for result in part]
             
-            vectors[doc.id] = tfidf_vec
+            return [
+                [(self.documents[doc_idx], score) for doc_idx, score in results]
+                for results in ranked
+            ]
+    
+    def _batch_pool(self, workers: int) -> ProcessPoolExecutor:
+        """Forked processes holding a copy of this index, reused while it is unchanged"""
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise ValueError("processes=True needs the 'fork' start method; use threads")
+        if self._process_pool is not None:
+            pool, version, size = self._process_pool
+            if version == self.version and size == workers:
+                return pool
+            pool.shutdown()
+        # Workers fork on the first task, while the caller still holds the lock
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                                   initializer=_init_batch_worker, initargs=(self,))
+        self._process_pool = (pool, self.version, workers)
+        return pool
+    
+    def close(self):
+        """Shut down the batch worker processes, if any"""
+        with self._lock:
+            if self._process_pool is not None:
+                self._process_pool[0].shutdown()
+                self._process_pool = None
+    
+    def save_segment(self, path: str):
+        """Persist the index as a compressed segment that can be mmap'ed later"""
+        with self._lock:
+            if self.deleted:
+                self.merge_segments()
+            terms = self.analyzer.terms
+            postings = {terms[term]: plist for term, plist in self.postings.items()}
+            write_segment(path, self.documents, postings, self.doc_lengths)
+    
+    # ------------------------------------------------------------------
+    # Incremental updates
+    # ------------------------------------------------------------------
+    
+    def add_documents(self, documents: List[Document]):
+        """Index new documents without rebuilding the existing index"""
+        with self._lock:
+            for doc in documents:
+                if doc.id in self._positions:
+                    raise ValueError(f"Document {doc.id} is already indexed; use update_document")
+                self._add(doc)
+            self._changed()
+    
+    def update_document(self, document: Document):
+        """Replace the indexed document that has the same id"""
+        with self._lock:
+            self._delete(document.id)
+            self._add(document)
+            self._changed()
+    
+    def delete_document(self, doc_id: int):
+        """Tombstone a document; its postings are dropped at the next merge"""
+        with self._lock:
+            self._delete(doc_id)
+            self._changed()
+    
+    def _add(self, doc: Document):
+        doc_idx = len(self.documents)
+        tf, doc_length = self.analyzer.term_frequencies(doc)
+        for term, count in tf.items():
+            self._delta_postings.setdefault(term, []).append((doc_idx, count))
+            self._df_delta[term] += 1
         
-        return vectors
+        if not isinstance(self.doc_lengths, (list, array)):
+            self.doc_lengths = array("I", self.doc_lengths)  # segment view is read-only
+        self.doc_lengths.append(doc_length)
+        self.documents.append(doc)
+        self._positions[doc.id] = doc_idx
+        self.metadata_index.add(doc_idx, doc)
+        self._total_length += doc_length
     
-    def retrieve(self, query: str, top_k: int = 3) -> List[Tuple[Document, float]]:
-        """Retrieve documents using TF-IDF scoring"""
-        query_words = preprocess_text(query)
-        scores = defaultdict(float)
+    def _delete(self, doc_id: int):
+        if doc_id not in self._positions:
+            raise KeyError(f"Document {doc_id} is not indexed")
+        doc_idx = self._positions.pop(doc_id)
+        doc = self.documents[doc_idx]
+        tf, _ = self.analyzer.term_frequencies(doc)
+        for term in tf:
+            self._df_delta[term] -= 1
+        if self._owns_analyzer:
+            self.analyzer.evict(doc_id)
+        self.deleted.add(doc_idx)
+        insort(self._deleted_order, doc_idx)
+        self.metadata_index.remove(doc_idx, doc)
+        self._total_length -= self.doc_lengths[doc_idx]
+    
+    def _changed(self):
+        """Refresh derived statistics after documents were added or deleted"""
+        self.version += 1
+        live_docs = len(self.documents) - len(self.deleted)
+        self.avg_doc_length = self._total_length / live_docs if live_docs else 0
         
-        for word in query_words:
-            if word in self.idf:
-                for doc_id, tfidf_vec in self.doc_vectors.items():
-                    if word in tfidf_vec:
-                        scores[doc_id] += tfidf_vec[word]
+        if not isinstance(self.idf, _LiveIdf):
+            self.postings = _LayeredPostings(self)
+            self.idf = _LiveIdf(self)
+            self.doc_norms = _DocNorms(self)
         
-        # Sort and return top-k
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
-        results = [(self._get_doc(doc_id), score) for doc_id, score in ranked]
+        pending = len(self.deleted) + len(self.documents) - self._base_size
+        if self.merge_threshold is not None and pending > self.merge_threshold * len(self.documents):
+            self.merge_segments(background=True)
+    
+    def _merge_snapshot(self):
+        """Subclass state a merge must renumber, copied while the lock is held"""
+        return None
+    
+    def _merge_renumber(self, snapshot, remap: List[int]) -> Dict:
+        """``_load_base`` keyword arguments carrying ``snapshot`` renumbered by
+        ``remap``; runs outside the lock"""
+        return {}
+    
+    def merge_segments(self, background: bool = False):
+        """Fold the delta segment into the base and purge tombstoned documents
+
+        With ``background=True`` the merge runs on a worker thread. Queries
+        and updates keep going meanwhile; the lock is only held to snapshot
+        the index and to swap in the merged segment.
+        """
+        if background:
+            with self._lock:
+                if self._merge_thread is None or not self._merge_thread.is_alive():
+                    self._merge_thread = threading.Thread(target=self.merge_segments, daemon=True)
+                    self._merge_thread.start()
+            return
         
-        return results
+        with self._lock:
+            base = self._base_postings
+            documents = self.documents.copy()
+            doc_lengths = self.doc_lengths[:]
+            positions = dict(self._positions)
+            metadata_index = self.metadata_index.copy()
+            extra = self._merge_snapshot()
+            snapshot_docs = len(documents)
+            snapshot_deleted = set(self.deleted)
+            delta_items = list(self._delta_postings.items())
+        
+        # Renumber surviving documents and rewrite their postings
+        remap = []
+        live = 0
+        for doc_idx in range(snapshot_docs):
+            if doc_idx in snapshot_deleted:
+                remap.append(-1)
+            else:
+                remap.append(live)
+                live += 1
+        
+        merged = defaultdict(list)
+        for word, plist in list(base.items()) + delta_items:
+            for doc_idx, tf in plist[:]:
+                if doc_idx < snapshot_docs and remap[doc_idx] >= 0:
+                    merged[word].append((remap[doc_idx], tf))
+        survivors = [doc_idx for doc_idx in range(snapshot_docs) if remap[doc_idx] >= 0]
+        if isinstance(documents, _StoredDocuments):
+            new_docs = documents.select(survivors)
+        else:
+            new_docs = [documents[i] for i in survivors]
+        new_lengths = [doc_lengths[i] for i in survivors]
+        positions = {doc_id: remap[doc_idx] for doc_id, doc_idx in positions.items()}
+        metadata_index = metadata_index.remapped(remap)
+        extra = self._merge_renumber(extra, remap)
+        
+        with self._lock:
+            if self._base_postings is not base:
+                return  # another merge got there first
+            
+            documents = self.documents
+            late_deletes = [documents[i].id for i in self.deleted - snapshot_deleted if i < snapshot_docs]
+            late_adds = [documents[i] for i in range(snapshot_docs, len(documents)) if i not in self.deleted]
+            
+            self._load_base(new_docs, dict(merged), new_lengths, metadata_index=metadata_index,
+                            positions=positions, **extra)
+            self.version += 1
+            if late_adds or late_deletes:
+                for doc_id in late_deletes:
+                    self._delete(doc_id)
+                for doc in late_adds:
+                    self._add(doc)
+                self._changed()
+
+# ============================================================================
+# PART 3: TF-IDF IMPLEMENTATION
+# ============================================================================
+
+class TFIDFRetriever(LexicalIndex):
+    """Traditional TF-IDF keyword search"""
+    
+    @property
+    def doc_vectors(self) -> Dict[int, Dict]:
+        """TF-IDF vectors keyed by document id, materialized on first access
+
+        Every add or delete shifts IDF for all terms, so the cache is simply
+        dropped on change and rebuilt from the postings when next needed.
+        """
+        with self._lock:
+            if self._doc_vectors is None:
+                self._doc_vectors = self._build_tfidf_vectors()
+            return self._doc_vectors
+    
+    def _changed(self):
+        self._doc_vectors = None
+        super()._changed()
+    
+    def use_collection_stats(self, *args):
+        self._doc_vectors = None
+        super().use_collection_stats(*args)
+    
+    def _load_base(self, *args, **kwargs):
+        self._doc_vectors = None
+        super()._load_base(*args, **kwargs)
+    
+    def _build_tfidf_vectors(self) -> Dict[int, Dict]:
+        """Build TF-IDF vectors for all live documents from the postings"""
+        vectors = {
+            doc.id: {} for doc_idx, doc in enumerate(self.documents)
+            if doc_idx not in self.deleted
+        }
+        terms = self.analyzer.terms
+        for term, plist in self.postings.items():
+            if term not in self.idf:
+                continue
+            word = terms[term]
+            for doc_idx, tf in plist:
+                if doc_idx in self.deleted:
+                    continue
+                # Normalize TF by document length
+                normalized_tf = tf / self.doc_lengths[doc_idx]
+                vectors[self.documents[doc_idx].id][word] = normalized_tf * self.idf[term]
+        
+        return vectors
+    
+    def _term_impact(self, weight: float, doc_idx: int, tf: int) -> float:
+        # Normalize TF by document length
+        normalized_tf = tf / self.doc_lengths[doc_idx]
+        return normalized_tf * weight
+    
+    def _impact_bound(self, weight: float, tf: int, doc_length: int) -> float:
+        return tf / doc_length * weight
     
-    def _get_doc(self, doc_id: int) -> Document:
-        return next(d for d in self.documents if d.id == doc_id)
+    def retrieve(self, query: str, top_k: int = 3, wand: bool = False,
+                 filters: Dict = None) -> List[Tuple[Document, float]]:
+        """Retrieve documents using TF-IDF scoring
+
+        ``wand=True`` finds the top-k with MaxScore dynamic pruning: same results
+        as exhaustive scoring, but documents that cannot make the cut are
+        skipped instead of scored.
+
+        ``filters`` (keyword arguments of ``MetadataIndex.allowed_docs``)
+        restricts scoring to matching documents before ranking.
+        """
+        return self._retrieve(query, top_k, wand, filters)
 
 # ============================================================================
 # PART 4: BM25 IMPLEMENTATION
 # ============================================================================
 
-class BM25Retriever:
-    """BM25 keyword search with saturation and length normalization"""
+class BM25Retriever(LexicalIndex):
+    """BM25 keyword search with saturation and length normalization
+
+    With ``positional=True`` it also keeps delta-coded term positions
+    (see PART 13) for phrase and proximity queries.
+    """
     
-    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75):
-        self.documents = documents
+    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75,
+                 segment: "LexicalSegment" = None, analyzer: Analyzer = None, workers: int = 1,
+                 positional: bool = False, inverted_index: Tuple[Dict, List[int]] = None,
+                 metadata_index: "MetadataIndex" = None):
+        # Set first: loading the base index also builds the positions
+        self.positional = positional
+        self.term_positions = {}  # term id -> {doc_idx: delta-coded positions}
+        # Inverted index: term id -> [(doc_idx, tf), ...], built once
+        super().__init__(documents, segment=segment, analyzer=analyzer, workers=workers,
+                         inverted_index=inverted_index, metadata_index=metadata_index)
         self.k1 = k1  # Saturation parameter
         self.b = b    # Length normalization parameter
-        self.vocab, self.idf = build_vocab_and_idf(documents)
-        
-        # Calculate average document length
-        self.doc_lengths = {}
-        total_length = 0
-        for doc in documents:
-            words = preprocess_text(doc.content)
-            self.doc_lengths[doc.id] = len(words)
-            total_length += len(words)
-        
-        self.avg_doc_length = total_length / len(documents) if documents else 0
     
-    def _bm25_score(self, word: str, doc_id: int, tf: int) -> float:
+    def _bm25_score(self, word: str, doc_idx: int, tf: int) -> float:
         """Calculate BM25 score for a word in a document"""
-        if word not in self.idf:
+        term = self.analyzer.vocabulary.get(word)
+        if term is None or term not in self.idf:
             return 0
         
-        idf = self.idf[word]
-        doc_length = self.doc_lengths[doc_id]
+        return self._term_impact(self.idf[term], doc_idx, tf)
+    
+    def _term_impact(self, weight: float, doc_idx: int, tf: int) -> float:
+        doc_norm = self.doc_norms[doc_idx]  # doc_length / avg_doc_length
         
         # BM25 formula
         numerator = tf * (self.k1 + 1)
-        denominator = tf + self.k1 * (1 - self.b + self.b * (doc_length / self.avg_doc_length))
+        denominator = tf + self.k1 * (1 - self.b + self.b * doc_norm)
         
-        return idf * (numerator / denominator)
+        return weight * (numerator / denominator)
     
-    def retrieve(self, query: str, top_k: int = 3) -> List[Tuple[Document, float]]:
-        """Retrieve documents using BM25 scoring"""
-        query_words = preprocess_text(query)
-        scores = defaultdict(float)
-        
-        for doc in self.documents:
-            words = preprocess_text(doc.content)
-            tf = defaultdict(int)
-            
-            for word in words:
-                tf[word] += 1
+    def _impact_bound(self, weight: float, tf: int, doc_length: int) -> float:
+        # Rises with tf and falls with length, whatever the average length
+        doc_norm = doc_length / self.avg_doc_length if self.avg_doc_length else 0.0
+        return weight * (tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * doc_norm)))
+    
+    def _load_base(self, *args, term_positions: Dict = None, **kwargs):
+        super()._load_base(*args, **kwargs)
+        if term_positions is not None:
+            self.term_positions = term_positions  # renumbered by a merge
+            return
+        self.term_positions = {}
+        if self.positional:
+            for doc_idx, doc in enumerate(self.documents):
+                self._index_positions(doc_idx, doc)
+    
+    def _merge_snapshot(self):
+        if not self.positional:
+            return None
+        return {term: docs.copy() for term, docs in self.term_positions.items()}
+    
+    def _merge_renumber(self, term_positions, remap: List[int]) -> Dict:
+        # Positions never change for a surviving document: only renumber it
+        if term_positions is None:
+            return {}
+        renumbered = {}
+        for term, docs in term_positions.items():
+            kept = {
+                remap[doc_idx]: positions for doc_idx, positions in docs.items()
+                if doc_idx < len(remap) and remap[doc_idx] >= 0
+            }
+            if kept:
+                renumbered[term] = kept
+        return {"term_positions": renumbered}
+    
+    def _add(self, doc: Document):
+        super()._add(doc)
+        if self.positional:
+            self._index_positions(len(self.documents) - 1, doc)
+    
+    def _index_positions(self, doc_idx: int, doc: Document):
+        occurrences = defaultdict(list)
+        for position, term in enumerate(self.analyzer.analyze(doc)):
+            occurrences[term].append(position)
+        for term, positions in occurrences.items():
+            self.term_positions.setdefault(term, {})[doc_idx] = encode_positions(positions)
+    
+    def positional_matches(self, query: str, phrase: bool = False, within: int = None) -> "RoaringBitmap":
+        """Live doc positions containing ``query`` as an exact phrase and/or
+        with all of its terms inside a window of ``within`` words
+
+        Positions count indexed tokens, so dropped short words do not break
+        a phrase.
+        """
+        if not self.positional:
+            raise ValueError("Phrase and proximity queries need BM25Retriever(..., positional=True)")
+        with self._lock:
+            vocabulary = self.analyzer.vocabulary
+            terms = [vocabulary.get(w) for w in self.analyzer.tokenize(query)]
+            if not terms or any(term not in self.term_positions for term in terms):
+                return RoaringBitmap()
+            distinct = list(dict.fromkeys(terms))
             
-            # Score this document
-            for query_word in query_words:
-                if query_word in tf:
-                    score = self._bm25_score(query_word, doc.id, tf[query_word])
-                    scores[doc.id] += score
-        
-        # Sort and return top-k
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
-        results = [(self._get_doc(doc_id), score) for doc_id, score in ranked]
-        
-        return results
+            by_doc = sorted((self.term_positions[term] for term in distinct), key=len)
+            matches = []
+            for doc_idx in sorted(by_doc[0]):
+                if doc_idx in self.deleted or not all(doc_idx in docs for docs in by_doc[1:]):
+                    continue
+                positions = {term: decode_positions(self.term_positions[term][doc_idx]) for term in distinct}
+                if phrase and not phrase_match([positions[term] for term in terms]):
+                    continue
+                if within is not None and not window_match(list(positions.values()), within):
+                    continue
+                matches.append(doc_idx)
+            return RoaringBitmap.from_sorted(matches)
     
-    def _get_doc(self, doc_id: int) -> Document:
-        return next(d for d in self.documents if d.id == doc_id)
+    def retrieve(self, query: str, top_k: int = 3, wand: bool = False, filters: Dict = None,
+                 phrase: bool = False, within: int = None,
+                 proximity_boost: float = None) -> List[Tuple[Document, float]]:
+        """Retrieve documents using BM25 scoring
+
+        ``wand=True`` finds the top-k with MaxScore dynamic pruning: same results
+        as exhaustive scoring, but documents that cannot make the cut are
+        skipped instead of scored.
+
+        ``filters`` (keyword arguments of ``MetadataIndex.allowed_docs``)
+        restricts scoring to matching documents before ranking.
+
+        On a positional index, ``phrase=True`` keeps only documents holding
+        the query as an exact phrase and ``within=n`` only those with every
+        query term inside an n-word window. With ``proximity_boost`` such
+        matches are boosted instead: their score is multiplied by
+        ``1 + proximity_boost`` and other documents stay in the ranking.
+        """
+        if not phrase and within is None:
+            return self._retrieve(query, top_k, wand, filters)
+        
+        with self._lock:
+            query_terms = self._query_terms(query)
+            matches = self.positional_matches(query, phrase=phrase, within=within)
+            allowed = None
+            if filters is not None:
+                allowed = self.metadata_index.allowed_docs(**filters)
+            
+            if proximity_boost is None:
+                allowed = matches if allowed is None else allowed & matches
+                ranked = self._top_k(query_terms, top_k, wand=wand, allowed=allowed)
+            else:
+                factor = 1 + proximity_boost
+                ranked = sorted(
+                    ((doc_idx, score * factor if doc_idx in matches else score)
+                     for doc_idx, score in self._top_k(query_terms, len(self.documents), allowed=allowed)),
+                    key=lambda x: (-x[1], x[0]),
+                )[:top_k]
+            return [(self.documents[doc_idx], score) for doc_idx, score in ranked]
 
 # ============================================================================
 # PART 5: METADATA FILTERING
@@ -246,9 +1129,25 @@ class MetadataFilter:
         documents: List[Document],
         access_level: str = "public",
         region: str = None,
-        category: str = None
+        category: str = None,
+        tags: List[str] = None,
+        tags_any: List[str] = None,
+        date_from: str = None,
+        date_to: str = None,
+        index: "MetadataIndex" = None
     ) -> List[Document]:
-        """Filter documents based on metadata criteria"""
+        """Filter documents based on metadata criteria
+
+        Pass the ``MetadataIndex`` built over ``documents`` to answer with
+        bitmap operations instead of checking every document.
+        """
+        if index is not None:
+            allowed = index.allowed_docs(
+                access_level, region=region, category=category, tags=tags,
+                tags_any=tags_any, date_from=date_from, date_to=date_to
+            )
+            return [documents[doc_idx] for doc_idx in allowed]
+        
         filtered = []
         
         for doc in documents:
@@ -264,59 +1163,735 @@ class MetadataFilter:
             if category and doc.metadata["category"] != category:
                 continue
             
+            # Check tags if specified (document must carry all of them)
+            if tags and not set(tags) <= set(doc.metadata.get("tags", ())):
+                continue
+            if tags_any and not set(tags_any) & set(doc.metadata.get("tags", ())):
+                continue
+            
+            # Check date range if specified (ISO dates, inclusive)
+            if date_from or date_to:
+                date = doc.metadata.get("date")
+                if date is None or (date_from and date < date_from) or (date_to and date > date_to):
+                    continue
+            
             filtered.append(doc)
         
         return filtered
 
+_ARRAY_CONTAINER_MAX = 4096
+_BITMAP_CONTAINER_BYTES = 8192
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+def _bitmap_members(bitmap: bytes) -> array:
+    members = array("H")
+    for byte_idx, byte in enumerate(bitmap):
+        if byte:
+            base = byte_idx << 3
+            members.extend(base + bit for bit in _BYTE_BITS[byte])
+    return members
+
+def _as_container(members: array):
+    """Pick the cheaper representation: sorted uint16 array or 8 KB bitmap"""
+    if len(members) <= _ARRAY_CONTAINER_MAX:
+        return members
+    bitmap = bytearray(_BITMAP_CONTAINER_BYTES)
+    for value in members:
+        bitmap[value >> 3] |= 1 << (value & 7)
+    return bytes(bitmap)
+
+def _container_and(a, b):
+    if isinstance(a, array) and isinstance(b, array):
+        return array("H", sorted(set(a).intersection(b)))
+    if isinstance(a, array) or isinstance(b, array):
+        members, bitmap = (a, b) if isinstance(a, array) else (b, a)
+        return array("H", (v for v in members if bitmap[v >> 3] >> (v & 7) & 1))
+    value = int.from_bytes(a, "little") & int.from_bytes(b, "little")
+    bitmap = value.to_bytes(_BITMAP_CONTAINER_BYTES, "little")
+    return bitmap if value.bit_count() > _ARRAY_CONTAINER_MAX else _bitmap_members(bitmap)
+
+def _container_or(a, b):
+    if isinstance(a, bytes) and isinstance(b, bytes):
+        value = int.from_bytes(a, "little") | int.from_bytes(b, "little")
+        return value.to_bytes(_BITMAP_CONTAINER_BYTES, "little")
+    if isinstance(a, array) and isinstance(b, array):
+        return _as_container(array("H", sorted(set(a).union(b))))
+    members, bitmap = (a, b) if isinstance(a, array) else (b, a)
+    bitmap = bytearray(bitmap)
+    for value in members:
+        bitmap[value >> 3] |= 1 << (value & 7)
+    return bytes(bitmap)
+
+class RoaringBitmap:
+    """Compressed set of doc positions, in the style of Roaring bitmaps
+
+    Positions are split by their high 16 bits into chunks. A chunk with up
+    to 4096 members is a sorted uint16 array, a denser one an 8 KB bitmap,
+    so AND/OR work chunk by chunk on compact containers.
+    """
+    
+    __slots__ = ("chunks",)
+    
+    def __init__(self, chunks: Dict = None):
+        self.chunks = chunks or {}
+    
+    @classmethod
+    def from_sorted(cls, values) -> "RoaringBitmap":
+        """Build from ascending doc positions"""
+        chunks = {}
+        for high, group in groupby(values, key=lambda v: v >> 16):
+            chunks[high] = _as_container(array("H", (v & 0xFFFF for v in group)))
+        return cls(chunks)
+    
+    def copy(self) -> "RoaringBitmap":
+        # Array containers are mutable; bitmap containers are immutable bytes
+        return RoaringBitmap({high: c[:] if isinstance(c, array) else c for high, c in self.chunks.items()})
+    
+    def __contains__(self, value: int) -> bool:
+        container = self.chunks.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, bytes):
+            return bool(container[low >> 3] >> (low & 7) & 1)
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+    
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self.chunks):
+            container = self.chunks[high]
+            if isinstance(container, bytes):
+                container = _bitmap_members(container)
+            base = high << 16
+            for low in container:
+                yield base + low
+    
+    def __len__(self) -> int:
+        return sum(
+            int.from_bytes(c, "little").bit_count() if isinstance(c, bytes) else len(c)
+            for c in self.chunks.values()
+        )
+    
+    def __and__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        chunks = {}
+        for high in self.chunks.keys() & other.chunks.keys():
+            container = _container_and(self.chunks[high], other.chunks[high])
+            if container:
+                chunks[high] = container
+        return RoaringBitmap(chunks)
+    
+    def __or__(self, other: "RoaringBitmap") -> "RoaringBitmap":
+        # Copy array containers: they are mutable and the result must not alias
+        chunks = {high: c[:] if isinstance(c, array) else c for high, c in self.chunks.items()}
+        for high, container in other.chunks.items():
+            if high in chunks:
+                chunks[high] = _container_or(chunks[high], container)
+            else:
+                chunks[high] = container[:] if isinstance(container, array) else container
+        return RoaringBitmap(chunks)
+    
+    @classmethod
+    def union(cls, bitmaps: List["RoaringBitmap"]) -> "RoaringBitmap":
+        """OR many bitmaps at once, merging each chunk in a single pass"""
+        arrays = defaultdict(set)
+        dense = defaultdict(int)
+        for bitmap in bitmaps:
+            for high, container in bitmap.chunks.items():
+                if isinstance(container, bytes):
+                    dense[high] |= int.from_bytes(container, "little")
+                else:
+                    arrays[high].update(container)
+        
+        chunks = {}
+        for high in arrays.keys() | dense.keys():
+            if high in dense:
+                bitmap = bytearray(dense[high].to_bytes(_BITMAP_CONTAINER_BYTES, "little"))
+                for value in arrays.get(high, ()):
+                    bitmap[value >> 3] |= 1 << (value & 7)
+                chunks[high] = bytes(bitmap)
+            else:
+                chunks[high] = _as_container(array("H", sorted(arrays[high])))
+        return cls(chunks)
+    
+    def add(self, value: int):
+        high, low = value >> 16, value & 0xFFFF
+        container = self.chunks.get(high)
+        if container is None:
+            self.chunks[high] = array("H", [low])
+        elif isinstance(container, bytes):
+            bitmap = bytearray(container)
+            bitmap[low >> 3] |= 1 << (low & 7)
+            self.chunks[high] = bytes(bitmap)
+        else:
+            i = bisect_left(container, low)
+            if i == len(container) or container[i] != low:
+                container.insert(i, low)
+                self.chunks[high] = _as_container(container)
+    
+    def discard(self, value: int):
+        high, low = value >> 16, value & 0xFFFF
+        container = self.chunks.get(high)
+        if container is None:
+            return
+        if isinstance(container, bytes):
+            bitmap = bytearray(container)
+            bitmap[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+            container = bytes(bitmap)
+            if int.from_bytes(container, "little").bit_count() <= _ARRAY_CONTAINER_MAX:
+                container = _bitmap_members(container)
+        else:
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                del container[i]
+        if container:
+            self.chunks[high] = container
+        else:
+            del self.chunks[high]
+
+class MetadataIndex:
+    """Columnar, bitmap-indexed metadata store over doc positions
+
+    * equality fields are dictionary-encoded: one integer code per document
+      in ``columns`` plus a ``RoaringBitmap`` of documents per code
+    * set-valued fields (tags) map each value to a bitmap of documents
+    * ``date`` is a sorted column of distinct dates with a bitmap each, so a
+      range is two bisects plus an OR over the dates in between
+
+    Filters are evaluated as bitmap AND/OR instead of a Python loop over
+    every document's metadata dict.
+    """
+    
+    FIELDS = ("access_level", "region", "category")
+    SET_FIELDS = ("tags",)
+    DATE_FIELD = "date"
+    
+    def __init__(self, documents: List[Document] = ()):
+        self.dictionaries = {field: {} for field in self.FIELDS}   # value -> code
+        self.columns = {field: array("I") for field in self.FIELDS}  # doc_idx -> code
+        self.bitmaps = {field: [] for field in self.FIELDS}        # code -> bitmap
+        self.set_bitmaps = {field: {} for field in self.SET_FIELDS}  # value -> bitmap
+        self.dates = []         # sorted distinct dates
+        self.date_bitmaps = []  # bitmap for each entry in ``dates``
+        
+        # Bulk load: collect doc positions per value, then build each bitmap once
+        postings = {field: defaultdict(list) for field in self.FIELDS + self.SET_FIELDS}
+        dated = defaultdict(list)
+        for doc_idx, doc in enumerate(documents):
+            for field in self.FIELDS:
+                code = self._code(field, doc.metadata.get(field))
+                self.columns[field].append(code)
+                postings[field][code].append(doc_idx)
+            for field in self.SET_FIELDS:
+                for value in set(doc.metadata.get(field, ())):
+                    postings[field][value].append(doc_idx)
+            if doc.metadata.get(self.DATE_FIELD) is not None:
+                dated[doc.metadata[self.DATE_FIELD]].append(doc_idx)
+        
+        for field in self.FIELDS:
+            for code, doc_idxs in postings[field].items():
+                self.bitmaps[field][code] = RoaringBitmap.from_sorted(doc_idxs)
+        for field in self.SET_FIELDS:
+            for value, doc_idxs in postings[field].items():
+                self.set_bitmaps[field][value] = RoaringBitmap.from_sorted(doc_idxs)
+        self.dates = sorted(dated)
+        self.date_bitmaps = [RoaringBitmap.from_sorted(dated[date]) for date in self.dates]
+    
+    def copy(self) -> "MetadataIndex":
+        """An independent copy, without reading the documents again"""
+        other = MetadataIndex()
+        other.dictionaries = {field: dict(codes) for field, codes in self.dictionaries.items()}
+        other.columns = {field: column[:] for field, column in self.columns.items()}
+        other.bitmaps = {field: [bitmap.copy() for bitmap in bitmaps] for field, bitmaps in self.bitmaps.items()}
+        other.set_bitmaps = {
+            field: {value: bitmap.copy() for value, bitmap in bitmaps.items()}
+            for field, bitmaps in self.set_bitmaps.items()
+        }
+        other.dates = self.dates[:]
+        other.date_bitmaps = [bitmap.copy() for bitmap in self.date_bitmaps]
+        return other
+    
+    def remapped(self, remap: List[int]) -> "MetadataIndex":
+        """The index over positions renumbered by ``remap`` (-1 drops a document)
+
+        Used by merges, so compaction never has to read the documents again.
+        """
+        def renumber(bitmap: RoaringBitmap) -> RoaringBitmap:
+            return RoaringBitmap.from_sorted(
+                remap[doc_idx] for doc_idx in bitmap if doc_idx < len(remap) and remap[doc_idx] >= 0
+            )
+        
+        other = MetadataIndex()
+        other.dictionaries = {field: dict(codes) for field, codes in self.dictionaries.items()}
+        other.columns = {
+            field: array("I", (code for doc_idx, code in enumerate(column[:len(remap)]) if remap[doc_idx] >= 0))
+            for field, column in self.columns.items()
+        }
+        other.bitmaps = {field: [renumber(bitmap) for bitmap in bitmaps] for field, bitmaps in self.bitmaps.items()}
+        other.set_bitmaps = {
+            field: {value: renumber(bitmap) for value, bitmap in bitmaps.items()}
+            for field, bitmaps in self.set_bitmaps.items()
+        }
+        other.dates = self.dates[:]
+        other.date_bitmaps = [renumber(bitmap) for bitmap in self.date_bitmaps]
+        return other
+    
+    def _code(self, field: str, value) -> int:
+        codes = self.dictionaries[field]
+        if value not in codes:
+            codes[value] = len(codes)
+            self.bitmaps[field].append(RoaringBitmap())
+        return codes[value]
+    
+    def add(self, doc_idx: int, doc: Document):
+        """Index a document appended at position ``doc_idx``"""
+        for field in self.FIELDS:
+            code = self._code(field, doc.metadata.get(field))
+            self.columns[field].append(code)
+            self.bitmaps[field][code].add(doc_idx)
+        for field in self.SET_FIELDS:
+            for value in doc.metadata.get(field, ()):
+                self.set_bitmaps[field].setdefault(value, RoaringBitmap()).add(doc_idx)
+        date = doc.metadata.get(self.DATE_FIELD)
+        if date is not None:
+            i = bisect_left(self.dates, date)
+            if i == len(self.dates) or self.dates[i] != date:
+                self.dates.insert(i, date)
+                self.date_bitmaps.insert(i, RoaringBitmap())
+            self.date_bitmaps[i].add(doc_idx)
+    
+    def remove(self, doc_idx: int, doc: Document):
+        """Drop a (tombstoned) document from every bitmap"""
+        for field in self.FIELDS:
+            self.bitmaps[field][self.columns[field][doc_idx]].discard(doc_idx)
+        for field in self.SET_FIELDS:
+            for value in doc.metadata.get(field, ()):
+                if value in self.set_bitmaps[field]:
+                    self.set_bitmaps[field][value].discard(doc_idx)
+        date = doc.metadata.get(self.DATE_FIELD)
+        if date is not None:
+            self.date_bitmaps[bisect_left(self.dates, date)].discard(doc_idx)
+    
+    def _docs(self, field: str, value) -> RoaringBitmap:
+        if field in self.set_bitmaps:
+            return self.set_bitmaps[field].get(value, RoaringBitmap())
+        code = self.dictionaries[field].get(value)
+        return RoaringBitmap() if code is None else self.bitmaps[field][code]
+    
+    def all_docs(self) -> RoaringBitmap:
+        """Every live document (each has exactly one access_level code)"""
+        return RoaringBitmap.union(self.bitmaps["access_level"])
+    
+    def facet_counts(self, docs: RoaringBitmap, fields: List[str] = None) -> Dict[str, Dict]:
+        """Per field, value -> how many of ``docs`` have it, most common first
+
+        Each count is one bitmap intersection; documents missing a field
+        are not counted for it.
+        """
+        counts = {}
+        for field in fields or self.FIELDS + self.SET_FIELDS:
+            if field in self.set_bitmaps:
+                values = self.set_bitmaps[field].items()
+            elif field in self.dictionaries:
+                values = ((value, self.bitmaps[field][code]) for value, code in self.dictionaries[field].items())
+            elif field == self.DATE_FIELD:
+                values = zip(self.dates, self.date_bitmaps)
+            else:
+                raise ValueError(f"Cannot aggregate over metadata field {field!r}")
+            
+            field_counts = {}
+            for value, bitmap in values:
+                if value is not None:
+                    count = len(bitmap & docs)
+                    if count:
+                        field_counts[value] = count
+            counts[field] = dict(sorted(field_counts.items(), key=lambda item: (-item[1], str(item[0]))))
+        return counts
+    
+    def date_range(self, date_from: str = None, date_to: str = None) -> RoaringBitmap:
+        """Documents dated within [date_from, date_to] (ISO strings, inclusive)"""
+        start = 0 if date_from is None else bisect_left(self.dates, date_from)
+        end = len(self.dates) if date_to is None else bisect_right(self.dates, date_to)
+        return RoaringBitmap.union(self.date_bitmaps[start:end])
+    
+    def allowed_docs(
+        self,
+        access_level: str = "public",
+        region: str = None,
+        category: str = None,
+        tags: List[str] = None,
+        tags_any: List[str] = None,
+        date_from: str = None,
+        date_to: str = None
+    ) -> RoaringBitmap:
+        """Doc positions passing the filter (same rules as filter_documents)
+
+        ``tags`` must all be present (contains_all); with ``tags_any`` at
+        least one must be (contains_any).
+        """
+        allowed = self._docs("access_level", "public") | self._docs("access_level", access_level)
+        
+        if region:
+            allowed &= self._docs("region", region)
+        if category:
+            allowed &= self._docs("category", category)
+        for tag in tags or ():
+            allowed &= self._docs("tags", tag)
+        if tags_any:
+            allowed &= RoaringBitmap.union([self._docs("tags", tag) for tag in tags_any])
+        if date_from or date_to:
+            allowed &= self.date_range(date_from, date_to)
+        
+        return allowed
+
 # ============================================================================
 # PART 6: COMPLETE RAG SYSTEM
 # ============================================================================
 
+class QueryCache:
+    """Bounded LRU cache of retrieval results with an optional TTL
+
+    Each entry remembers the index version it was computed against; a
+    lookup under any other version is a miss, so adds, deletes and merges
+    invalidate stale results without an explicit flush. ``hits`` and
+    ``misses`` count lookups for sizing the cache.
+    """
+    
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl  # seconds, None = no expiry
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, expires_at, results)
+        self._lock = threading.Lock()
+    
+    def get(self, key: Tuple, version: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, results = entry
+                if entry_version == version and (expires_at is None or expires_at > time.monotonic()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return results
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key: Tuple, version: int, results):
+        if self.max_size <= 0:
+            return
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (version, expires_at, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+    
+    def __len__(self):
+        return len(self._entries)
+
 class RAGSystem:
     """Complete RAG system combining retrieval techniques"""
     
-    def __init__(self, documents: List[Document]):
-        self.documents = documents
-        self.tfidf = TFIDFRetriever(documents)
-        self.bm25 = BM25Retriever(documents)
+    def __init__(self, documents: List[Document], analyzer: Analyzer = None, workers: int = 1,
+                 cache_size: int = 1024, cache_ttl: float = None, segment: "LexicalSegment" = None,
+                 embedder: Callable = None):
+        # One analyzer for both retrievers: each document is tokenized once
+        # and both indexes share term ids; term offsets are kept for snippets
+        self.analyzer = analyzer or Analyzer(offsets=True)
+        # Both retrievers index the same terms and metadata: build them once
+        inverted_index = None
+        if not isinstance(documents, DocumentStore):
+            documents = list(documents)
+        if segment is None:
+            inverted_index = build_inverted_index(documents, self.analyzer, workers)
+            metadata_index = MetadataIndex(documents)
+        else:
+            metadata_index = MetadataIndex(segment.checked(documents))
+        self.tfidf = TFIDFRetriever(documents, segment=segment, analyzer=self.analyzer,
+                                    inverted_index=inverted_index, metadata_index=metadata_index.copy())
+        self.bm25 = BM25Retriever(documents, segment=segment, analyzer=self.analyzer,
+                                  inverted_index=inverted_index, metadata_index=metadata_index)
         self.metadata_filter = MetadataFilter()
+        self.cache = QueryCache(cache_size, cache_ttl)
+        # Dense branch of retrieve_hybrid, embedded on first use (see PART 16)
+        self.embedder = embedder
+        self._dense = None
+        self._dense_lock = threading.Lock()
+        self._hybrid_pool = None
+        self._owned_store = None  # the DocumentStore from_stream created, closed with the system
     
-    def retrieve_with_tfidf(self, query: str, top_k: int = 3, user_access: str = None, user_region: str = None) -> List[Tuple[Document, float]]:
-        """Retrieve using TF-IDF with optional metadata filtering"""
-        results = self.tfidf.retrieve(query, top_k=top_k)
-        
-        if user_access or user_region:
-            filtered_docs = self.metadata_filter.filter_documents(
-                self.documents,
-                access_level=user_access or "public",
-                region=user_region
-            )
-            filtered_ids = {d.id for d in filtered_docs}
-            results = [(doc, score) for doc, score in results if doc.id in filtered_ids]
+    @classmethod
+    def from_stream(cls, documents: Iterable[Document], directory: str, batch_size: int = 10_000,
+                    analyzer: Analyzer = None, **kwargs) -> "RAGSystem":
+        """Index a document stream in bounded memory and serve it from disk
+
+        See ``stream_index``; the documents are never all loaded at once.
+        """
+        analyzer = analyzer or Analyzer(offsets=True)
+        segment, store = stream_index(documents, directory, batch_size=batch_size, analyzer=analyzer)
+        system = cls(store, analyzer=analyzer, segment=segment, **kwargs)
+        system._owned_store = store
+        return system
+    
+    @property
+    def documents(self) -> Sequence:
+        """The live documents, in index order (a view, not a copy)"""
+        return _LiveDocuments(self.bm25)
+    
+    def add_documents(self, documents: List[Document]):
+        """Add documents to both retrievers without rebuilding their indexes"""
+        self.tfidf.add_documents(documents)
+        self.bm25.add_documents(documents)
+        if self._dense is not None:
+            self._dense.add(documents)
+    
+    def update_document(self, document: Document):
+        """Replace the document that has the same id"""
+        self.tfidf.update_document(document)
+        self.bm25.update_document(document)
+        if self._dense is not None:
+            self._dense.delete(document.id)
+            self._dense.add([document])
+    
+    def delete_document(self, doc_id: int):
+        """Remove a document from the knowledge base"""
+        self.tfidf.delete_document(doc_id)
+        self.bm25.delete_document(doc_id)
+        if self._dense is not None:
+            self._dense.delete(doc_id)
+        self.analyzer.evict(doc_id)
+    
+    @staticmethod
+    def _filters(user_access: str = None, user_region: str = None, category: str = None,
+                 tags: List[str] = None, tags_any: List[str] = None,
+                 date_from: str = None, date_to: str = None) -> Dict:
+        if not (user_access or user_region or category or tags or tags_any or date_from or date_to):
+            return None
+        return {
+            "access_level": user_access or "public",
+            "region": user_region,
+            "category": category,
+            "tags": tags,
+            "tags_any": tags_any,
+            "date_from": date_from,
+            "date_to": date_to,
+        }
+    
+    def _cached_retrieve(self, name: str, retriever: LexicalIndex, query: str, top_k: int,
+                         filters: Dict) -> List[Tuple[Document, float]]:
+        # Key on the analyzed terms (in order, since order fixes the score
+        # summation) so queries differing only in case or punctuation share
+        # an entry
+        filter_key = None if filters is None else tuple(
+            (field, tuple(value) if isinstance(value, list) else value)
+            for field, value in sorted(filters.items())
+        )
+        key = (name, tuple(self.analyzer.tokenize(query)), top_k, filter_key)
+        version = retriever.version
+        results = self.cache.get(key, version)
+        if results is None:
+            results = retriever.retrieve(query, top_k=top_k, filters=filters)
+            self.cache.put(key, version, results)
+        return list(results)
+    
+    def retrieve_with_tfidf(self, query: str, top_k: int = 3, user_access: str = None, user_region: str = None,
+                            category: str = None, tags: List[str] = None, tags_any: List[str] = None,
+                            date_from: str = None, date_to: str = None) -> List[Tuple[Document, float]]:
+        """Retrieve using TF-IDF with optional metadata filtering
+
+        Filters are applied before scoring, so up to ``top_k`` allowed
+        documents come back even when the best global matches are restricted.
+        Results are served from ``self.cache`` while the index is unchanged.
+        """
+        filters = self._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
+        return self._cached_retrieve("tfidf", self.tfidf, query, top_k, filters)
+    
+    def retrieve_with_bm25(self, query: str, top_k: int = 3, user_access: str = None, user_region: str = None,
+                           category: str = None, tags: List[str] = None, tags_any: List[str] = None,
+                           date_from: str = None, date_to: str = None) -> List[Tuple[Document, float]]:
+        """Retrieve using BM25 with optional metadata filtering
+
+        Filters are applied before scoring, so up to ``top_k`` allowed
+        documents come back even when the best global matches are restricted.
+        Results are served from ``self.cache`` while the index is unchanged.
+        """
+        filters = self._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
+        return self._cached_retrieve("bm25", self.bm25, query, top_k, filters)
+    
+    def aggregate(self, query: str = None, facets: List[str] = ("category", "region", "tags"),
+                  top_k: int = 3, method: str = "bm25", user_access: str = None, user_region: str = None,
+                  category: str = None, tags: List[str] = None, tags_any: List[str] = None,
+                  date_from: str = None, date_to: str = None) -> Dict:
+        """Top-k hits plus facet counts over the filtered, matching documents
+
+        One scoring pass yields both the hits and the matching set (every
+        allowed document containing a query term, or every allowed document
+        when there is no query); each facet value is then counted with a
+        bitmap intersection against it. Like Weaviate's
+        ``collection.aggregate.over_all(filters=...)``, but in-process::
+
+            {"total_count": 12, "hits": [(doc, score), ...],
+             "facets": {"category": {"Recipe": 8, "Culture": 4}, ...}}
+        """
+        retrievers = {"bm25": self.bm25, "tfidf": self.tfidf}
+        if method not in retrievers:
+            raise ValueError(f"Unknown retrieval method: {method}")
+        retriever = retrievers[method]
+        filters = self._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
         
-        return results
+        with retriever._lock:
+            index = retriever.metadata_index
+            allowed = None if filters is None else index.allowed_docs(**filters)
+            hits = []
+            if query:
+                scores = retriever._scores(retriever._query_terms(query), allowed)
+                hits = [
+                    (retriever.documents[doc_idx], score)
+                    for doc_idx, score in sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:top_k]
+                ]
+                matching = RoaringBitmap.from_sorted(sorted(scores))
+            else:
+                matching = index.all_docs() if allowed is None else allowed
+            
+            return {
+                "total_count": len(matching),
+                "hits": hits,
+                "facets": index.facet_counts(matching, list(facets)),
+            }
+    
+    @property
+    def dense(self) -> "EmbeddingIndex":
+        """Embedding index over ``Document.content``, built on first access"""
+        with self._dense_lock:
+            if self._dense is None:
+                embedder = self.embedder or HashingEmbedder(analyzer=self.analyzer)
+                with self.bm25._lock:
+                    live = [doc for i, doc in enumerate(self.bm25.documents) if i not in self.bm25.deleted]
+                self._dense = EmbeddingIndex(live, embedder)
+            return self._dense
     
-    def retrieve_with_bm25(self, query: str, top_k: int = 3, user_access: str = None, user_region: str = None) -> List[Tuple[Document, float]]:
-        """Retrieve using BM25 with optional metadata filtering"""
-        results = self.bm25.retrieve(query, top_k=top_k)
+    def retrieve_hybrid(self, query: str, top_k: int = 3, fusion: str = "rrf", alpha: float = 0.5,
+                        rrf_k: int = 60, candidates: int = None, user_access: str = None,
+                        user_region: str = None, category: str = None, tags: List[str] = None,
+                        tags_any: List[str] = None, date_from: str = None,
+                        date_to: str = None) -> List[Tuple[Document, float]]:
+        """Fuse BM25 with embedding search over ``Document.content``
+
+        The metadata filter is resolved once and handed to both branches,
+        which then run concurrently, so latency tracks the slower branch.
+        Each branch returns ``candidates`` hits (default ``4 * top_k``).
+        ``fusion="rrf"`` ranks by reciprocal rank fusion with constant
+        ``rrf_k``; ``fusion="weighted"`` by ``alpha * dense + (1 - alpha) *
+        bm25`` over min-max normalized scores (alpha=1 is pure dense).
         
-        if user_access or user_region:
-            filtered_docs = self.metadata_filter.filter_documents(
-                self.documents,
-                access_level=user_access or "public",
-                region=user_region
-            )
-            filtered_ids = {d.id for d in filtered_docs}
-            results = [(doc, score) for doc, score in results if doc.id in filtered_ids]
+        Without an ``embedder`` the dense branch is ``HashingEmbedder``, a
+        hashed bag of words: it only re-weights the same exact-term matches
+        and adds no semantic recall. Pass a real sentence-embedding model to
+        ``RAGSystem(embedder=...)`` for that. The branch thread is kept
+        until ``close()``.
+        """
+        if fusion not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion method: {fusion}")
+        candidates = candidates or 4 * top_k
+        filters = self._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
+        dense = self.dense
+        with self._dense_lock:
+            if self._hybrid_pool is None:
+                self._hybrid_pool = ThreadPoolExecutor(max_workers=1)
+            pool = self._hybrid_pool
         
-        return results
+        bm25 = self.bm25
+        # Hold the BM25 lock across both branches so the filter's doc
+        # positions stay valid; the worker thread scores without locking
+        with bm25._lock:
+            allowed = allowed_ids = None
+            if filters is not None:
+                allowed = bm25.metadata_index.allowed_docs(**filters)
+                allowed_ids = [bm25.documents[doc_idx].id for doc_idx in allowed]
+            lexical = pool.submit(bm25._top_k, bm25._query_terms(query), candidates, False, allowed)
+            dense_hits = dense.search(query, candidates, allowed_ids)
+            lexical_hits = [(bm25.documents[doc_idx], score) for doc_idx, score in lexical.result()]
+        
+        if fusion == "rrf":
+            fused = reciprocal_rank_fusion([lexical_hits, dense_hits], k=rrf_k)
+        else:
+            fused = weighted_fusion(lexical_hits, dense_hits, alpha)
+        return fused[:top_k]
+    
+    def close(self):
+        """Shut down the hybrid branch thread and the batch worker processes,
+        and unmap the document store ``from_stream`` opened"""
+        with self._dense_lock:
+            pool, self._hybrid_pool = self._hybrid_pool, None
+        if pool is not None:
+            pool.shutdown()
+        self.tfidf.close()
+        self.bm25.close()
+        if self._owned_store is not None:
+            self._owned_store.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def snippets(self, query: str, results: List[Tuple[Document, float]], window: int = 30,
+                 highlight: Tuple[str, str] = ("**", "**")) -> List[str]:
+        """Query-biased snippet of each result document, for display or as
+        compact LLM context (see ``make_snippet``)
+
+        Term positions and offsets come from the analysis cached at
+        indexing time; a document not in that cache is analyzed here once,
+        into the analyzer's span LRU, without growing the vocabulary.
+        Query terms are weighted by BM25 IDF when choosing the window.
+        """
+        analyzer = self.analyzer
+        idf = self.bm25.idf
+        # Words outside the vocabulary get throwaway ids, so documents that
+        # were never indexed neither grow the vocabulary nor fill the unbounded analysis cache
+        unknown = {}
+        snippets = []
+        for doc, _ in results:
+            term_ids, spans = analyzer.analyze_with_spans(doc, unknown)
+            weights = {term: idf.get(term, 1.0) for term in analyzer.query_terms(query, unknown)}
+            snippets.append(make_snippet(doc.content, term_ids, spans, weights, window, highlight))
+        return snippets
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 3, method: str = "bm25",
+                       user_access: str = None, user_region: str = None, category: str = None,
+                       tags: List[str] = None, tags_any: List[str] = None, date_from: str = None,
+                       date_to: str = None, workers: int = 1,
+                       processes: bool = False) -> List[List[Tuple[Document, float]]]:
+        """Retrieve for a batch of queries with ``method`` "bm25" or "tfidf"
+
+        Same results as one ``retrieve_with_*`` call per query, but terms and
+        the filter are resolved once for the whole batch (see
+        ``LexicalIndex.retrieve_batch``). Batches bypass the result cache.
+        """
+        retrievers = {"bm25": self.bm25, "tfidf": self.tfidf}
+        if method not in retrievers:
+            raise ValueError(f"Unknown retrieval method: {method}")
+        filters = self._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
+        return retrievers[method].retrieve_batch(queries, top_k=top_k, filters=filters,
+                                                 workers=workers, processes=processes)
 
 # ============================================================================
 # PART 7: DEMONSTRATION
 # ============================================================================
 
-def print_results(title: str, results: List[Tuple[Document, float]]):
-    """Pretty print retrieval results"""
+def print_results(title: str, results: List[Tuple[Document, float]], snippets: List[str] = None):
+    """Pretty print retrieval results, with ``RAGSystem.snippets`` if given"""
     print(f"\n{'='*70}")
     print(f"{title}")
     print(f"{'='*70}")
@@ -331,7 +1906,1461 @@ def print_results(title: str, results: List[Tuple[Document, float]]):
         print(f"   Category: {doc.metadata['category']} | Region: {doc.metadata['region']}")
         print(f"   Access Level: {doc.metadata['access_level']}")
         print(f"   Score: {score:.4f}")
-        print(f"   Preview: {doc.content[:100]}...")
+        if snippets is not None:
+            print(f"   Snippet: {snippets[idx - 1]}")
+        else:
+            print(f"   Preview: {doc.content[:100]}...")
+
+# ============================================================================
+# PART 8: ON-DISK INDEX SEGMENTS
+# ============================================================================
+#
+# Segment layout (little-endian, every section 8-byte aligned):
+#
+#   header     magic, num_docs, num_terms, avg_doc_length, section offsets
+#   doc_ids    int64[num_docs]      Document.id per doc_idx
+#   lengths    uint32[num_docs]     token count per document
+#   norms      float64[num_docs]    doc_length / avg_doc_length
+#   term_offs  uint64[num_terms+1]  offsets of each term in the term blob
+#   post_offs  uint64[num_terms+1]  offsets of each postings list
+#   doc_freqs  uint32[num_terms]
+#   terms      sorted UTF-8 terms, concatenated
+#   postings   per term: varint(doc_idx gap), varint(tf), ...
+
+SEGMENT_MAGIC = b"RAGSEG01"
+_SEGMENT_HEADER = struct.Struct("<8sIId8Q")
+_POSTINGS_FLUSH_BYTES = 1 << 20
+
+def _encode_varint(value: int, out: bytearray):
+    """Append ``value`` as a LEB128 varint"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _decode_postings(buf, start: int, end: int) -> List[Tuple[int, int]]:
+    """Decode delta/varint-coded (doc_idx, tf) pairs from ``buf[start:end]``"""
+    postings = []
+    values = []
+    value = shift = 0
+    for byte in buf[start:end]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value = shift = 0
+    
+    doc_idx = 0
+    for i in range(0, len(values), 2):
+        doc_idx += values[i]
+        postings.append((doc_idx, values[i + 1]))
+    return postings
+
+def _pad8(out: bytearray):
+    out.extend(b"\0" * (-len(out) % 8))
+
+def write_segment(path: str, documents: List[Document], postings: Mapping, doc_lengths) -> None:
+    """Write an index segment to ``path`` (atomically, via a temp file)"""
+    _write_segment_file(
+        path, [doc.id for doc in documents], doc_lengths,
+        ((term, postings[term]) for term in sorted(postings)),
+    )
+
+def _write_segment_file(path: str, doc_ids, doc_lengths, term_postings) -> None:
+    """Write a segment from ``(term, postings)`` pairs in sorted term order
+
+    Postings are encoded straight into a temporary file, so only the term
+    dictionary and per-document arrays are held in memory.
+    """
+    num_docs = len(doc_ids)
+    total_length = sum(doc_lengths)
+    avg_doc_length = total_length / num_docs if num_docs else 0
+    
+    body = bytearray()
+    offsets = []
+    
+    def section(fmt: str, values):
+        offsets.append(_SEGMENT_HEADER.size + len(body))
+        body.extend(struct.pack(f"<{len(values)}{fmt}", *values))
+        _pad8(body)
+    
+    section("q", list(doc_ids))
+    section("I", list(doc_lengths))
+    section("d", [length / avg_doc_length if avg_doc_length else 0.0 for length in doc_lengths])
+    
+    term_blob = bytearray()
+    term_offsets = [0]
+    postings_offsets = [0]
+    doc_freqs = []
+    with tempfile.TemporaryFile() as postings_file:
+        postings_blob = bytearray()
+        flushed = 0
+        for term, plist in term_postings:
+            term_blob.extend(term.encode("utf-8"))
+            term_offsets.append(len(term_blob))
+            previous = 0
+            for doc_idx, tf in plist:
+                _encode_varint(doc_idx - previous, postings_blob)
+                _encode_varint(tf, postings_blob)
+                previous = doc_idx
+            postings_offsets.append(flushed + len(postings_blob))
+            doc_freqs.append(len(plist))
+            if len(postings_blob) >= _POSTINGS_FLUSH_BYTES:
+                postings_file.write(postings_blob)
+                flushed += len(postings_blob)
+                postings_blob.clear()
+        postings_file.write(postings_blob)
+        
+        section("Q", term_offsets)
+        section("Q", postings_offsets)
+        section("I", doc_freqs)
+        offsets.append(_SEGMENT_HEADER.size + len(body))
+        body.extend(term_blob)
+        _pad8(body)
+        offsets.append(_SEGMENT_HEADER.size + len(body))
+        
+        header = _SEGMENT_HEADER.pack(SEGMENT_MAGIC, num_docs, len(doc_freqs), avg_doc_length, *offsets)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(body)
+            postings_file.seek(0)
+            shutil.copyfileobj(postings_file, f)
+    os.replace(tmp_path, path)
+
+class LexicalSegment:
+    """Read-only, mmap'ed view of a segment written by ``write_segment``
+
+    Nothing is deserialized up front: doc lengths and norms are zero-copy
+    views over the mapping, and a term's postings are decoded only when a
+    query asks for them.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        
+        (magic, self.num_docs, self.num_terms, self.avg_doc_length,
+         docs_at, lengths_at, norms_at, term_offs_at, post_offs_at,
+         freqs_at, terms_at, postings_at) = _SEGMENT_HEADER.unpack_from(buf)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a RAG index segment")
+        
+        n, t = self.num_docs, self.num_terms
+        self.doc_ids = buf[docs_at:docs_at + 8 * n].cast("q")
+        self.doc_lengths = buf[lengths_at:lengths_at + 4 * n].cast("I")
+        self.norms = buf[norms_at:norms_at + 8 * n].cast("d")
+        self._term_offsets = buf[term_offs_at:term_offs_at + 8 * (t + 1)].cast("Q")
+        self._postings_offsets = buf[post_offs_at:post_offs_at + 8 * (t + 1)].cast("Q")
+        self._doc_freqs = buf[freqs_at:freqs_at + 4 * t].cast("I")
+        self._terms_at = terms_at
+        self._postings_at = postings_at
+        self._buf = buf
+        
+        self.postings = _SegmentPostings(self)
+        self.idf = _SegmentIdf(self)
+    
+    def check_documents(self, documents: List[Document]):
+        """Make sure ``documents`` is the list the segment was built from"""
+        for _ in self.checked(documents):
+            pass
+    
+    def checked(self, documents: List[Document]) -> Iterator[Document]:
+        """Yield ``documents``, raising ValueError once one doesn't match the segment
+
+        Lets a single pass over a ``DocumentStore`` both check and index it.
+        """
+        if len(documents) != self.num_docs:
+            raise ValueError(f"Documents don't match segment {self.path}")
+        for doc, doc_id in zip(documents, self.doc_ids):
+            if doc.id != doc_id:
+                raise ValueError(f"Documents don't match segment {self.path}")
+            yield doc
+    
+    def term(self, ordinal: int) -> str:
+        start = self._terms_at + self._term_offsets[ordinal]
+        end = self._terms_at + self._term_offsets[ordinal + 1]
+        return str(self._buf[start:end], "utf-8")
+    
+    def terms(self) -> Iterator[str]:
+        return (self.term(i) for i in range(self.num_terms))
+    
+    def term_ordinal(self, term: str) -> int:
+        """Binary search the sorted term dictionary; -1 if absent"""
+        ordinal = bisect_left(range(self.num_terms), term, key=self.term)
+        if ordinal < self.num_terms and self.term(ordinal) == term:
+            return ordinal
+        return -1
+    
+    def doc_freq(self, ordinal: int) -> int:
+        return self._doc_freqs[ordinal]
+    
+    def read_postings(self, ordinal: int) -> List[Tuple[int, int]]:
+        start = self._postings_at + self._postings_offsets[ordinal]
+        end = self._postings_at + self._postings_offsets[ordinal + 1]
+        return _decode_postings(self._buf, start, end)
+
+class _SegmentPostings(Mapping):
+    """term -> [(doc_idx, tf), ...] over a LexicalSegment"""
+    
+    def __init__(self, segment: LexicalSegment):
+        self.segment = segment
+    
+    def __getitem__(self, term: str) -> List[Tuple[int, int]]:
+        ordinal = self.segment.term_ordinal(term)
+        if ordinal < 0:
+            raise KeyError(term)
+        return self.segment.read_postings(ordinal)
+    
+    def __iter__(self):
+        return self.segment.terms()
+    
+    def __len__(self):
+        return self.segment.num_terms
+
+class _SegmentIdf(_SegmentPostings):
+    """term -> IDF, computed from the stored document frequency"""
+    
+    def __getitem__(self, term: str) -> float:
+        ordinal = self.segment.term_ordinal(term)
+        if ordinal < 0:
+            raise KeyError(term)
+        return math.log(self.segment.num_docs / self.segment.doc_freq(ordinal))
+
+class _SegmentTermIds(Mapping):
+    """Re-keys a term-keyed segment mapping by an analyzer's term ids"""
+    
+    def __init__(self, mapping: Mapping, analyzer: Analyzer):
+        self.mapping = mapping
+        self.analyzer = analyzer
+    
+    def __getitem__(self, term_id: int):
+        terms = self.analyzer.terms
+        if not 0 <= term_id < len(terms):
+            raise KeyError(term_id)
+        return self.mapping[terms[term_id]]
+    
+    def __iter__(self):
+        return (self.analyzer.term_id(term) for term in self.mapping)
+    
+    def __len__(self):
+        return len(self.mapping)
+
+# ============================================================================
+# PART 9: DYNAMIC PRUNING (MAXSCORE)
+# ============================================================================
+
+# Upper bounds are inflated (and thresholds deflated) by this relative
+# margin so floating-point rounding, and partial scores summed in a
+# different order than the exact ones, can never prune a document that
+# belongs in the exact top-k.
+_PRUNING_SLACK = 1e-9
+# Postings summarized by one block-max entry
+_BLOCK_SIZE = 64
+
+def _lookup_tfs(plist: List[Tuple[int, int]], doc_ids: List[int]) -> Dict[int, int]:
+    """doc_idx -> tf for the ascending ``doc_ids`` that appear in ``plist``"""
+    if len(doc_ids) * 8 >= len(plist):
+        wanted = set(doc_ids)
+        return {doc_idx: tf for doc_idx, tf in plist if doc_idx in wanted}
+    found = {}
+    pos = 0
+    for doc_idx in doc_ids:
+        pos = bisect_left(plist, (doc_idx,), pos)
+        if pos == len(plist):
+            break
+        if plist[pos][0] == doc_idx:
+            found[doc_idx] = plist[pos][1]
+    return found
+
+def maxscore_top_k(index: LexicalIndex, query_terms: List[int], top_k: int,
+                   allowed: "RoaringBitmap" = None) -> List[Tuple[int, float]]:
+    """Exact top-k over ``index`` using term-at-a-time MaxScore (Turtle & Flood, 1995)
+
+    Terms are processed from the largest upper bound (the rarest) down.
+    While the bounds of the terms still to come could lift an unseen
+    document past the current k-th best partial score, every posting is
+    accumulated; after that only documents already seen are looked up,
+    and those that can no longer make the cut are dropped. The few
+    survivors are then rescored term by term in query order, exactly like
+    the exhaustive path, so scores and tie order are identical.
+
+    The upper bounds come from block maxima (``LexicalIndex._blocks``),
+    which stay valid across updates. If ``allowed`` is given, only those
+    doc positions are considered.
+    """
+    if top_k <= 0:
+        return []
+    
+    terms = {}  # term -> (weight, postings, query count, upper bound)
+    for term, count in Counter(t for t in query_terms if t in index.idf).items():
+        weight = index.idf[term]
+        plist = index.postings[term]
+        max_tfs, min_lengths = index._blocks(term, plist)
+        upper_bound = max(
+            (index._impact_bound(weight, tf, length) for tf, length in zip(max_tfs, min_lengths)),
+            default=0.0,
+        )
+        terms[term] = (weight, plist, count, count * upper_bound * (1 + _PRUNING_SLACK))
+    order = sorted(terms, key=lambda term: -terms[term][3])
+    remaining = list(accumulate(terms[term][3] for term in reversed(order)))[::-1] + [0.0]
+    
+    partial = {}  # doc_idx -> score over the terms processed so far
+    found = {}  # term -> {doc_idx: tf} for the terms only looked up
+    threshold = -math.inf
+    for i, term in enumerate(order):
+        weight, plist, count, _ = terms[term]
+        if remaining[i] >= threshold:
+            # An unseen document could still make the top-k: take every posting
+            for doc_idx, tf in plist:
+                if allowed is None or doc_idx in allowed:
+                    partial[doc_idx] = partial.get(doc_idx, 0.0) + count * index._term_impact(weight, doc_idx, tf)
+            for doc_idx in index.deleted:
+                partial.pop(doc_idx, None)
+        else:
+            tfs = found[term] = _lookup_tfs(plist, sorted(partial))
+            for doc_idx, tf in tfs.items():
+                partial[doc_idx] += count * index._term_impact(weight, doc_idx, tf)
+        
+        if len(partial) >= top_k:
+            threshold = heapq.nlargest(top_k, partial.values())[-1] * (1 - _PRUNING_SLACK)
+        if remaining[i + 1] < threshold:
+            cutoff = threshold - remaining[i + 1]
+            partial = {
+                doc_idx: score for doc_idx, score in partial.items()
+                if score * (1 + _PRUNING_SLACK) >= cutoff
+            }
+    
+    # Exact scores for the survivors, summed in query order
+    candidates = sorted(partial)
+    for term in order:
+        if term not in found:
+            found[term] = _lookup_tfs(terms[term][1], candidates)
+    scores = []
+    for doc_idx in candidates:
+        score = 0.0
+        for term in query_terms:
+            tf = found[term].get(doc_idx) if term in terms else None
+            if tf is not None:
+                score += index._term_impact(terms[term][0], doc_idx, tf)
+        scores.append((doc_idx, score))
+    return sorted(scores, key=lambda x: (-x[1], x[0]))[:top_k]
+
+# ============================================================================
+# PART 10: INCREMENTAL INDEX UPDATES
+# ============================================================================
+
+class _ChainedPostings(Sequence):
+    """One term's base postings followed by its delta postings, read in place
+
+    Delta documents are always numbered after the base ones, so the chain
+    stays sorted by doc_idx without copying the base list per lookup.
+    """
+    
+    __slots__ = ("base", "delta")
+    
+    def __init__(self, base, delta: List[Tuple[int, int]]):
+        self.base = base
+        self.delta = delta
+    
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+    
+    def __iter__(self):
+        return chain(self.base, self.delta)
+    
+    def __getitem__(self, i):
+        split = len(self.base)
+        if isinstance(i, slice):
+            start, stop, step = i.indices(split + len(self.delta))
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            head = list(self.base[start:stop]) if start < split else []
+            return head + self.delta[max(0, start - split):max(0, stop - split)]
+        if i < 0:
+            i += split + len(self.delta)
+        return self.base[i] if i < split else self.delta[i - split]
+
+class _LayeredPostings(Mapping):
+    """Base segment postings followed by the in-memory delta segment"""
+    
+    def __init__(self, index: LexicalIndex):
+        self.index = index
+    
+    def __getitem__(self, term: str) -> List[Tuple[int, int]]:
+        base = self.index._base_postings.get(term)
+        delta = self.index._delta_postings.get(term)
+        if base is None and delta is None:
+            raise KeyError(term)
+        if delta is None:
+            return base
+        return delta if base is None else _ChainedPostings(base, delta)
+    
+    def __iter__(self):
+        yield from self.index._base_postings
+        for term in self.index._delta_postings:
+            if term not in self.index._base_postings:
+                yield term
+    
+    def __len__(self):
+        return sum(1 for _ in self)
+
+class _LiveIdf(Mapping):
+    """term -> IDF over live documents, from base + delta document frequencies"""
+    
+    def __init__(self, index: LexicalIndex):
+        self.index = index
+    
+    def doc_freq(self, term: int) -> int:
+        index = self.index
+        if index.segment is not None:
+            ordinal = index.segment.term_ordinal(index.analyzer.terms[term])
+            base_df = index.segment.doc_freq(ordinal) if ordinal >= 0 else 0
+        else:
+            base_df = len(index._base_postings.get(term, ()))
+        return base_df + index._df_delta.get(term, 0)
+    
+    def __getitem__(self, term: int) -> float:
+        df = self.doc_freq(term)
+        if df <= 0:
+            raise KeyError(term)
+        live_docs = len(self.index.documents) - len(self.index.deleted)
+        return math.log(live_docs / df)
+    
+    def __iter__(self):
+        return (term for term in self.index.postings if self.doc_freq(term) > 0)
+    
+    def __len__(self):
+        return sum(1 for _ in self)
+
+class _LiveDocuments(Sequence):
+    """The untombstoned documents of an index, in position order
+
+    Reads go straight to ``index.documents``, which is located by id
+    through ``index._positions``; nothing is copied on update or delete.
+    """
+    
+    def __init__(self, index: LexicalIndex):
+        self.index = index
+    
+    def __len__(self):
+        with self.index._lock:
+            return len(self.index.documents) - len(self.index.deleted)
+    
+    def __iter__(self):
+        with self.index._lock:
+            documents, deleted = self.index.documents, set(self.index.deleted)
+        return (doc for doc_idx, doc in enumerate(documents) if doc_idx not in deleted)
+    
+    def __contains__(self, doc) -> bool:
+        with self.index._lock:
+            doc_idx = self.index._positions.get(getattr(doc, "id", None))
+            return doc_idx is not None and self.index.documents[doc_idx] == doc
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        with self.index._lock:
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError("document index out of range")
+            # The i-th live position is i plus the k tombstones before it,
+            # the smallest k whose tombstone lies past i + k
+            tombstones = self.index._deleted_order
+            lo, hi = 0, len(tombstones)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if tombstones[mid] - mid <= i:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return self.index.documents[i + lo]
+
+class _DocNorms:
+    """doc_length / avg_doc_length, computed on access since the average moves"""
+    
+    def __init__(self, index: LexicalIndex):
+        self.index = index
+    
+    def __getitem__(self, doc_idx: int) -> float:
+        avg_doc_length = self.index.avg_doc_length
+        return self.index.doc_lengths[doc_idx] / avg_doc_length if avg_doc_length else 0.0
+
+# ============================================================================
+# PART 11: SPARSE MATRIX SCORING ENGINE
+# ============================================================================
+
+class SparseScoringEngine:
+    """Vectorized scoring over a CSR term-document matrix
+
+    Row t of the matrix holds term t's precomputed TF-IDF or BM25 weight
+    for every document containing it, so scoring a query (or a whole batch)
+    is one sparse product followed by an ``argpartition`` top-k.
+
+    Query rows list their terms in query order, repeats included, and
+    scipy accumulates the product in that same order, so the scores are
+    bit-for-bit those of ``retriever.retrieve``.
+    """
+    
+    def __init__(self, retriever: LexicalIndex):
+        if sparse is None:
+            raise ImportError("SparseScoringEngine requires numpy and scipy")
+        if not isinstance(retriever, (TFIDFRetriever, BM25Retriever)):
+            raise TypeError(f"Unsupported retriever: {type(retriever).__name__}")
+        self.retriever = retriever
+        self._build()
+    
+    def _build(self):
+        retriever = self.retriever
+        with retriever._lock:
+            self.version = retriever.version
+            self.documents = retriever.documents.copy()
+            deleted = retriever.deleted
+            
+            self.term_ids = {}
+            idf = []
+            indptr = [0]
+            doc_indices = []
+            tfs = []
+            for term, plist in retriever.postings.items():
+                if term not in retriever.idf:
+                    continue
+                self.term_ids[term] = len(idf)
+                idf.append(retriever.idf[term])
+                for doc_idx, tf in plist:
+                    if doc_idx not in deleted:
+                        doc_indices.append(doc_idx)
+                        tfs.append(tf)
+                indptr.append(len(doc_indices))
+            
+            num_docs = len(self.documents)
+            doc_lengths = np.array(retriever.doc_lengths, dtype=np.float64)
+            avg_doc_length = retriever.avg_doc_length
+            self.live = np.ones(num_docs, dtype=bool)
+            self.live[list(deleted)] = False
+        
+        indptr = np.array(indptr, dtype=np.int64)
+        doc_indices = np.array(doc_indices, dtype=np.int64)
+        tf = np.array(tfs, dtype=np.float64)
+        idf = np.array(idf, dtype=np.float64)
+        term_idf = np.repeat(idf, np.diff(indptr))
+        
+        # Same operations, in the same order, as each retriever's _term_impact
+        if isinstance(retriever, BM25Retriever):
+            k1, b = retriever.k1, retriever.b
+            doc_norm = doc_lengths[doc_indices] / avg_doc_length
+            weights = term_idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * doc_norm)))
+        else:
+            weights = (tf / doc_lengths[doc_indices]) * term_idf
+        
+        self.matrix = sparse.csr_matrix(
+            (weights, doc_indices, indptr), shape=(len(idf), num_docs)
+        )
+        # Terms found in every live document have zero IDF: they match
+        # everything but leave no entries in the product
+        self.zero_idf = idf == 0
+    
+    def _query_matrix(self, queries: List[str]):
+        indptr = [0]
+        indices = []
+        for query in queries:
+            indices.extend(
+                self.term_ids[term] for term in self.retriever._query_terms(query)
+                if term in self.term_ids
+            )
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.ones(len(indices)), indices, indptr),
+            shape=(len(queries), len(self.term_ids)),
+        )
+    
+    def retrieve(self, query: str, top_k: int = 3) -> List[Tuple[Document, float]]:
+        """Score one query with a single sparse vector-matrix product"""
+        return self.retrieve_batch([query], top_k=top_k)[0]
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 3) -> List[List[Tuple[Document, float]]]:
+        """Score a batch of queries with one sparse matrix-matrix product"""
+        if self.retriever.version != self.version:
+            self._build()
+        
+        query_matrix = self._query_matrix(queries)
+        scores = (query_matrix @ self.matrix).tocsr()
+        matches_all = query_matrix @ self.zero_idf.astype(np.float64) > 0
+        
+        results = []
+        for row in range(len(queries)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            doc_idx, row_scores = self._top_k(
+                scores.indices[start:end], scores.data[start:end], top_k, matches_all[row]
+            )
+            results.append([
+                (self.documents[i], float(score)) for i, score in zip(doc_idx, row_scores)
+            ])
+        return results
+    
+    def _top_k(self, doc_idx, row_scores, top_k: int, matches_all: bool):
+        if top_k <= 0:
+            return doc_idx[:0], row_scores[:0]
+        
+        if len(row_scores) > top_k:
+            # Keep everything tied with the k-th best so ties resolve by doc
+            kth = -np.partition(-row_scores, top_k - 1)[top_k - 1]
+            keep = row_scores >= kth
+            doc_idx, row_scores = doc_idx[keep], row_scores[keep]
+        
+        order = np.lexsort((doc_idx, -row_scores))[:top_k]
+        doc_idx, row_scores = doc_idx[order], row_scores[order]
+        
+        if matches_all and len(doc_idx) < top_k:
+            # Pad with zero-score matches, in document order
+            zero = np.flatnonzero(self.live)
+            zero = zero[~np.isin(zero, doc_idx)][:top_k - len(doc_idx)]
+            doc_idx = np.concatenate([doc_idx, zero])
+            row_scores = np.concatenate([row_scores, np.zeros(len(zero))])
+        return doc_idx, row_scores
+
+# ============================================================================
+# PART 12: SHARDED SCATTER-GATHER RETRIEVAL
+# ============================================================================
+
+def global_collection_stats(part_stats: List[Tuple]) -> List[Tuple]:
+    """Sum ``collection_stats()`` of index parts into whole-collection
+    statistics, returning for each part the arguments of its
+    ``use_collection_stats`` (document frequencies limited to its terms)
+    """
+    num_docs = sum(part_docs for part_docs, _, _ in part_stats)
+    total_length = sum(part_length for _, _, part_length in part_stats)
+    doc_freqs = Counter()
+    for _, part_freqs, _ in part_stats:
+        doc_freqs.update(part_freqs)
+    return [
+        (num_docs, {word: doc_freqs[word] for word in part_freqs}, total_length)
+        for _, part_freqs, _ in part_stats
+    ]
+
+def _shard_worker(conn, documents: List[Document], shard: int, num_shards: int):
+    """Worker process loop serving retrieval requests for one shard
+
+    The shard holds every ``num_shards``-th document starting at ``shard``,
+    so local position i is global position ``shard + i * num_shards``.
+    """
+    rag = RAGSystem(documents)
+    retrievers = {"tfidf": rag.tfidf, "bm25": rag.bm25}
+    
+    # Exchange statistics with the coordinator before serving queries
+    conn.send(rag.bm25.collection_stats())
+    stats = conn.recv()
+    for retriever in retrievers.values():
+        retriever.use_collection_stats(*stats)
+    positions = {doc.id: shard + i * num_shards for i, doc in enumerate(documents)}
+    
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        name, query, top_k, filters = request
+        try:
+            results = retrievers[name].retrieve(query, top_k=top_k, filters=filters)
+            conn.send([(score, positions[doc.id]) for doc, score in results])
+        except Exception as exc:
+            conn.send(exc)
+    conn.close()
+
+class ShardedRAGSystem:
+    """RAG system partitioned across worker processes (scatter-gather)
+
+    Documents are dealt round-robin to ``num_shards`` worker processes, each
+    with its own TF-IDF and BM25 index. At startup the shards' document
+    frequencies and lengths are summed and pushed back, so every shard
+    scores with collection-wide IDF and average length and results match
+    an unsharded ``RAGSystem`` exactly. Each query goes to all shards at
+    once; their top-k lists, already ordered by score then position, are
+    merged with a heap.
+
+    The shards are a read-only snapshot: build a new system to pick up
+    changes. Call ``close()`` (or use ``with``) to stop the workers.
+    """
+    
+    def __init__(self, documents: List[Document], num_shards: int = None):
+        self.documents = list(documents)
+        num_shards = num_shards or os.cpu_count() or 1
+        self.num_shards = max(1, min(num_shards, len(self.documents)))
+        self._lock = threading.Lock()
+        self._conns = []
+        self._workers = []
+        for shard in range(self.num_shards):
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=_shard_worker,
+                args=(worker_conn, self.documents[shard::self.num_shards], shard, self.num_shards),
+                daemon=True,
+            )
+            worker.start()
+            worker_conn.close()
+            self._conns.append(conn)
+            self._workers.append(worker)
+        
+        # Global statistics: sum the shard counts, then send each shard the
+        # document frequencies of its own terms
+        shard_stats = [conn.recv() for conn in self._conns]
+        for conn, stats in zip(self._conns, global_collection_stats(shard_stats)):
+            conn.send(stats)
+    
+    def _gather(self, name: str, query: str, top_k: int, filters: Dict) -> List[Tuple[Document, float]]:
+        with self._lock:
+            for conn in self._conns:
+                conn.send((name, query, top_k, filters))
+            replies = [conn.recv() for conn in self._conns]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        
+        merged = heapq.merge(*replies, key=lambda hit: (-hit[0], hit[1]))
+        return [(self.documents[position], score) for score, position in islice(merged, max(top_k, 0))]
+    
+    def retrieve_with_tfidf(self, query: str, top_k: int = 3, user_access: str = None, user_region: str = None,
+                            category: str = None, tags: List[str] = None, tags_any: List[str] = None,
+                            date_from: str = None, date_to: str = None) -> List[Tuple[Document, float]]:
+        """Retrieve using TF-IDF across all shards, same filters as ``RAGSystem``"""
+        filters = RAGSystem._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
+        return self._gather("tfidf", query, top_k, filters)
+    
+    def retrieve_with_bm25(self, query: str, top_k: int = 3, user_access: str = None, user_region: str = None,
+                           category: str = None, tags: List[str] = None, tags_any: List[str] = None,
+                           date_from: str = None, date_to: str = None) -> List[Tuple[Document, float]]:
+        """Retrieve using BM25 across all shards, same filters as ``RAGSystem``"""
+        filters = RAGSystem._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
+        return self._gather("bm25", query, top_k, filters)
+    
+    def close(self):
+        """Stop the worker processes"""
+        with self._lock:
+            for conn in self._conns:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+            for worker in self._workers:
+                worker.join()
+            for conn in self._conns:
+                conn.close()
+            self._conns, self._workers = [], []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+# ============================================================================
+# PART 13: POSITIONAL POSTINGS (PHRASE & PROXIMITY)
+# ============================================================================
+
+def encode_positions(positions: List[int]) -> bytes:
+    """Ascending token positions as varint gaps"""
+    out = bytearray()
+    previous = 0
+    for position in positions:
+        _encode_varint(position - previous, out)
+        previous = position
+    return bytes(out)
+
+def decode_positions(buf: bytes) -> List[int]:
+    positions = []
+    position = value = shift = 0
+    for byte in buf:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        position += value
+        positions.append(position)
+        value = shift = 0
+    return positions
+
+def phrase_match(position_lists: List[List[int]]) -> bool:
+    """True if some start p has term i at position p + i for every term"""
+    following = [set(positions) for positions in position_lists[1:]]
+    return any(
+        all(start + offset in positions for offset, positions in enumerate(following, 1))
+        for start in position_lists[0]
+    )
+
+def window_match(position_lists: List[List[int]], window: int) -> bool:
+    """True if one occurrence of every term fits in ``window`` consecutive words"""
+    events = sorted((position, i) for i, positions in enumerate(position_lists) for position in positions)
+    counts = [0] * len(position_lists)
+    covered = left = 0
+    for position, i in events:
+        if counts[i] == 0:
+            covered += 1
+        counts[i] += 1
+        # Shrink from the left while every term is still covered
+        while covered == len(position_lists):
+            left_position, left_i = events[left]
+            if position - left_position < window:
+                return True
+            counts[left_i] -= 1
+            if counts[left_i] == 0:
+                covered -= 1
+            left += 1
+    return False
+
+# ============================================================================
+# PART 14: IMPACT-ORDERED QUANTIZED BM25
+# ============================================================================
+
+class ImpactIndex:
+    """BM25 scored at index time: quantized impacts in impact order
+
+    Every posting's full BM25 contribution (IDF, saturation and length
+    normalization, with the retriever's ``k1`` and ``b`` frozen in) is
+    computed once and linearly quantized to ``bits`` bits, with one scale
+    per term (its largest impact maps to the top level). A single global
+    scale would squash common, low-IDF terms into one or two levels and
+    leave their documents tied. Each term's scale is a whole multiple of
+    one index-wide unit (2**-24 of the largest scale), so a query adds
+    integer levels times integer multipliers into an int64 accumulator
+    array and converts to a score once at the end.
+
+    Each term's postings are stored in decreasing impact order, grouped
+    into runs of equal impact. A query merges the runs of its terms,
+    highest impact first; it stops once the top-k set is settled, i.e. no
+    document outside it could still catch up, and then completes the
+    scores of just those k documents.
+
+    Results are exact for the quantized scores, which differ from the
+    float BM25 score by at most half of each query term's quantization
+    step. The index is rebuilt when the retriever changes.
+    """
+    
+    def __init__(self, retriever: "BM25Retriever", bits: int = 8):
+        if np is None:
+            raise ImportError("ImpactIndex requires numpy")
+        if not isinstance(retriever, BM25Retriever):
+            raise TypeError(f"Unsupported retriever: {type(retriever).__name__}")
+        self.retriever = retriever
+        self.levels = (1 << bits) - 1
+        self._build()
+    
+    def _build(self):
+        retriever = self.retriever
+        with retriever._lock:
+            self.version = retriever.version
+            self.documents = retriever.documents.copy()
+            deleted = retriever.deleted
+            doc_lengths = np.array(retriever.doc_lengths, dtype=np.float64)
+            avg_doc_length = retriever.avg_doc_length
+            k1, b = retriever.k1, retriever.b
+            
+            impacts = {}
+            for term, plist in retriever.postings.items():
+                if term not in retriever.idf:
+                    continue
+                live = [(doc_idx, tf) for doc_idx, tf in plist if doc_idx not in deleted]
+                if not live:
+                    continue
+                docs = np.array([doc_idx for doc_idx, _ in live], dtype=np.int64)
+                tf = np.array([tf for _, tf in live], dtype=np.float64)
+                doc_norm = doc_lengths[docs] / avg_doc_length
+                impacts[term] = (docs, retriever.idf[term] * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * doc_norm))))
+        
+        dtype = np.uint8 if self.levels <= 0xFF else np.uint16
+        
+        # Score of one accumulator unit; rounding a term's scale to a whole
+        # number of units moves it by at most half a unit
+        max_impacts = {term: float(weights.max()) for term, (_, weights) in impacts.items()}
+        self.unit = max(max_impacts.values(), default=0.0) / self.levels / (1 << 24) or 1.0
+        
+        # term -> (docs by impact, run impacts, run starts, docs by doc_idx, impacts by doc_idx)
+        self.postings = {}
+        self.multipliers = {}  # term -> accumulator units per quantization level
+        self.scales = {}  # term -> score of one quantization level
+        for term, (docs, weights) in impacts.items():
+            multiplier = self.multipliers[term] = max(1, round(max_impacts[term] / self.levels / self.unit))
+            scale = self.scales[term] = multiplier * self.unit
+            quantized = np.rint(weights / scale).astype(dtype)
+            order = np.lexsort((docs, -quantized.astype(np.int64)))
+            by_impact, ordered = docs[order], quantized[order]
+            starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+            self.postings[term] = (by_impact, ordered[starts].astype(np.int64), starts, docs, quantized)
+        
+        self.live = np.ones(len(self.documents), dtype=bool)
+        self.live[list(deleted)] = False
+    
+    def retrieve(self, query: str, top_k: int = 3, filters: Dict = None) -> List[Tuple[Document, float]]:
+        """Top-k by quantized BM25, ``filters`` as in ``BM25Retriever.retrieve``"""
+        retriever = self.retriever
+        with retriever._lock:
+            if retriever.version != self.version:
+                self._build()
+            query_terms = Counter(t for t in retriever._query_terms(query) if t in self.postings)
+            candidates = self.live
+            if filters is not None:
+                candidates = np.zeros(len(self.documents), dtype=bool)
+                candidates[np.fromiter(retriever.metadata_index.allowed_docs(**filters), dtype=np.int64)] = True
+        if top_k <= 0 or not query_terms:
+            return []
+        
+        terms = list(query_terms)
+        # Accumulator units of one level of each term; a repeated query term
+        # counts once per occurrence, as in the float scorer
+        steps = [self.multipliers[term] * query_terms[term] for term in terms]
+        # Runs of all query terms, highest impact first
+        runs = sorted(
+            ((int(impact) * steps[i], i, run)
+             for i, term in enumerate(terms)
+             for run, impact in enumerate(self.postings[term][1])),
+            key=lambda r: -r[0],
+        )
+        heads = [int(self.postings[term][1][0]) * steps[i] for i, term in enumerate(terms)]
+        remaining = sum(heads)  # most any document can still gain
+        
+        accumulators = np.zeros(len(self.documents), dtype=np.int64)
+        touched = np.zeros(len(self.documents), dtype=bool)
+        next_check = remaining / 2
+        settled = False
+        for impact, i, run in runs:
+            by_impact, run_impacts, starts = self.postings[terms[i]][:3]
+            end = starts[run + 1] if run + 1 < len(starts) else len(by_impact)
+            docs = by_impact[starts[run]:end]
+            accumulators[docs] += impact
+            touched[docs] = True
+            
+            remaining -= heads[i]
+            heads[i] = int(run_impacts[run + 1]) * steps[i] if run + 1 < len(run_impacts) else 0
+            remaining += heads[i]
+            # Checking costs a pass over the accumulators, so only do it
+            # each time the remaining bound halves
+            if 0 < remaining <= next_check:
+                next_check = remaining / 2
+                if self._settled(accumulators[touched & candidates], top_k, remaining):
+                    settled = True
+                    break
+        
+        doc_idx = np.flatnonzero(touched & candidates)
+        scores = accumulators[doc_idx]
+        if len(scores) > top_k:
+            kth = -np.partition(-scores, top_k - 1)[top_k - 1]
+            keep = scores >= kth
+            doc_idx, scores = doc_idx[keep], scores[keep]
+        if settled:
+            # Add what the unprocessed runs still owe the chosen documents
+            for i, term in enumerate(terms):
+                if heads[i]:
+                    _, run_impacts, _, by_doc, quantized = self.postings[term]
+                    pos = np.minimum(np.searchsorted(by_doc, doc_idx), len(by_doc) - 1)
+                    owed = quantized[pos].astype(np.int64)
+                    # Levels at or below the current head were not added yet
+                    unpaid = (by_doc[pos] == doc_idx) & (owed * steps[i] <= heads[i])
+                    scores = scores + np.where(unpaid, owed * steps[i], 0)
+        order = np.lexsort((doc_idx, -scores))[:top_k]
+        return [(self.documents[i], float(score) * self.unit) for i, score in zip(doc_idx[order], scores[order])]
+    
+    @staticmethod
+    def _settled(scores, top_k: int, remaining: int) -> bool:
+        """True if no document outside the current top-k can reach it"""
+        if len(scores) <= top_k:
+            return False
+        best = -np.partition(-scores, [top_k - 1, top_k])
+        return best[top_k] + remaining < best[top_k - 1]
+
+# ============================================================================
+# PART 15: STREAMING INGESTION
+# ============================================================================
+
+def read_jsonl(path: str) -> Iterator[Document]:
+    """Lazily read documents, one JSON object per line
+
+    Each object has ``id``, ``title``, ``content`` and optional
+    ``metadata``, the format ``DocumentStore`` writes.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield Document(record["id"], record["title"], record["content"], record.get("metadata", {}))
+
+def read_csv(path: str, list_fields: Tuple[str, ...] = ("tags",), list_separator: str = "|") -> Iterator[Document]:
+    """Lazily read documents from a CSV with ``id``, ``title`` and ``content``
+    columns; every other column becomes metadata, and ``list_fields`` are
+    split on ``list_separator``
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            doc_id, title, content = int(row.pop("id")), row.pop("title"), row.pop("content")
+            for field in list_fields:
+                if field in row:
+                    row[field] = [value for value in row[field].split(list_separator) if value]
+            yield Document(doc_id, title, content, row)
+
+class DocumentStore(Sequence):
+    """Documents in an append-only JSONL file, read back by position
+
+    Only line offsets are kept in memory; ``store[i]`` decodes one line from
+    an mmap of the file, so indexes can serve corpora larger than RAM.
+    Indexes treat the store as read-only and keep their updates in memory
+    on top of it (``_StoredDocuments``). ``close()``, or leaving a ``with``
+    block, releases the mapping.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._offsets = array("Q", [0])
+        self._mmap = None
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    self._offsets.append(self._offsets[-1] + len(line))
+            self._map()
+    
+    def _map(self):
+        mapped = None
+        if self._offsets[-1]:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Swap in the map of the grown file and release the old one
+        with self._lock:
+            previous, self._mmap = self._mmap, mapped
+        if previous is not None:
+            previous.close()
+    
+    def close(self):
+        """Unmap the file; the store cannot be read afterwards"""
+        with self._lock:
+            previous, self._mmap = self._mmap, None
+        if previous is not None:
+            previous.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def extend(self, documents: Iterable[Document]):
+        with open(self.path, "ab") as f:
+            for doc in documents:
+                line = json.dumps(
+                    {"id": doc.id, "title": doc.title, "content": doc.content, "metadata": doc.metadata}
+                ).encode("utf-8") + b"\n"
+                f.write(line)
+                self._offsets.append(self._offsets[-1] + len(line))
+        self._map()
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("DocumentStore index out of range")
+        with self._lock:
+            if self._mmap is None:
+                raise ValueError("DocumentStore is closed")
+            line = self._mmap[self._offsets[index]:self._offsets[index + 1]]
+        record = json.loads(line)
+        return Document(record["id"], record["title"], record["content"], record["metadata"])
+    
+    def __len__(self):
+        return len(self._offsets) - 1
+
+class _StoredDocuments(Sequence):
+    """Rows of a ``DocumentStore`` followed by documents appended in memory
+
+    What an index holds instead of copying the store into a list: reading a
+    position decodes one row, updates only append, and a merge keeps just
+    the surviving row numbers.
+    """
+    
+    def __init__(self, store: DocumentStore, rows: Sequence[int] = None, appended: List[Document] = None):
+        self.store = store
+        self.rows = range(len(store)) if rows is None else rows
+        self.appended = [] if appended is None else appended
+    
+    def __len__(self):
+        return len(self.rows) + len(self.appended)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("document index out of range")
+        if index < len(self.rows):
+            return self.store[self.rows[index]]
+        return self.appended[index - len(self.rows)]
+    
+    def append(self, doc: Document):
+        self.appended.append(doc)
+    
+    def copy(self) -> "_StoredDocuments":
+        return _StoredDocuments(self.store, self.rows, self.appended[:])
+    
+    def select(self, positions: List[int]) -> "_StoredDocuments":
+        """The documents at the ascending ``positions``"""
+        split = bisect_left(positions, len(self.rows))
+        rows = array("Q", (self.rows[i] for i in positions[:split]))
+        appended = [self.appended[i - len(self.rows)] for i in positions[split:]]
+        return _StoredDocuments(self.store, rows, appended)
+
+def merge_segment_files(paths: List[str], out_path: str) -> None:
+    """k-way merge of segments into one, in the given document order
+
+    Terms are merged in sorted order and each term's postings are
+    concatenated with doc positions shifted by the preceding segments'
+    sizes, so only one term's postings are in memory at a time.
+    """
+    segments = [LexicalSegment(path) for path in paths]
+    starts = []
+    doc_ids = array("q")
+    doc_lengths = array("I")
+    for segment in segments:
+        starts.append(len(doc_ids))
+        doc_ids.extend(segment.doc_ids)
+        doc_lengths.extend(segment.doc_lengths)
+    
+    def terms_of(i: int):
+        return ((term, i, ordinal) for ordinal, term in enumerate(segments[i].terms()))
+    
+    def term_postings():
+        cursors = [terms_of(i) for i in range(len(segments))]
+        for term, group in groupby(heapq.merge(*cursors), key=itemgetter(0)):
+            plist = []
+            for _, i, ordinal in group:
+                start = starts[i]
+                plist.extend((doc_idx + start, tf) for doc_idx, tf in segments[i].read_postings(ordinal))
+            yield term, plist
+    
+    _write_segment_file(out_path, doc_ids, doc_lengths, term_postings())
+
+def stream_index(documents: Iterable[Document], directory: str, batch_size: int = 10_000,
+                 analyzer: Analyzer = None) -> Tuple["LexicalSegment", DocumentStore]:
+    """Index a stream of documents with bounded memory
+
+    Documents are consumed ``batch_size`` at a time: each batch is appended
+    to a ``DocumentStore`` and flushed to its own segment file, then
+    dropped. At the end the batch segments are k-way merged into
+    ``index.seg``. Returns the merged segment and the store, ready for
+    ``RAGSystem(store, segment=segment)`` or ``RAGSystem.from_stream``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # The analyzer's per-document cache would grow with the corpus
+    batch_analyzer = Analyzer(*(analyzer or Analyzer()).config, cache=False)
+    store_path = os.path.join(directory, "documents.jsonl")
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    store = DocumentStore(store_path)
+    
+    batch_paths = []
+    documents = iter(documents)
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            break
+        postings, doc_lengths = build_inverted_index(batch, batch_analyzer)
+        terms = batch_analyzer.terms
+        batch_path = os.path.join(directory, f"batch-{len(batch_paths):05d}.seg")
+        write_segment(batch_path, batch, {terms[term]: plist for term, plist in postings.items()}, doc_lengths)
+        store.extend(batch)
+        batch_paths.append(batch_path)
+    
+    index_path = os.path.join(directory, "index.seg")
+    merge_segment_files(batch_paths, index_path)
+    for batch_path in batch_paths:
+        os.remove(batch_path)
+    return LexicalSegment(index_path), store
+
+# ============================================================================
+# PART 16: DENSE RETRIEVAL & HYBRID FUSION
+# ============================================================================
+
+class HashingEmbedder:
+    """Dependency-free stand-in for a sentence-embedding model
+
+    Feature-hashes analyzed terms (with log-scaled counts and a hashed
+    sign) into ``dim`` dimensions and L2-normalizes. This is a hashed bag
+    of words with no semantic value: "oven" and "bake" share nothing. Any
+    callable mapping a list of texts to an (n, dim) array, e.g. a
+    SentenceTransformer's ``encode``, can be used in its place.
+    """
+    
+    def __init__(self, dim: int = 384, analyzer: Analyzer = None):
+        if np is None:
+            raise ImportError("HashingEmbedder requires numpy")
+        self.dim = dim
+        self.analyzer = analyzer or Analyzer()
+    
+    def __call__(self, texts: List[str]):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word, count in Counter(self.analyzer.tokenize(text)).items():
+                hashed = zlib.crc32(word.encode("utf-8"))
+                sign = 1.0 if hashed & 0x80000000 else -1.0
+                vectors[row, hashed % self.dim] += sign * (1 + math.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+class EmbeddingIndex:
+    """Cosine search over document embeddings in one float32 matrix
+
+    Rows are normalized once when added, so a query is a single
+    matrix-vector product followed by an ``argpartition`` top-k. Deletes
+    only mask their row.
+    """
+    
+    def __init__(self, documents: List[Document], embed: Callable):
+        if np is None:
+            raise ImportError("EmbeddingIndex requires numpy")
+        self.embed = embed
+        self.documents = []
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.live = np.zeros(0, dtype=bool)
+        self.matrix = None
+        self._rows = {}  # doc id -> row
+        self._lock = threading.Lock()
+        self.add(documents)
+    
+    def _normalized(self, texts: List[str]):
+        vectors = np.asarray(self.embed(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+    
+    def add(self, documents: List[Document]):
+        documents = list(documents)
+        if not documents:
+            return
+        vectors = self._normalized([doc.content for doc in documents])
+        with self._lock:
+            for doc in documents:
+                self._rows[doc.id] = len(self.documents)
+                self.documents.append(doc)
+            self.matrix = vectors if self.matrix is None else np.vstack([self.matrix, vectors])
+            self.ids = np.concatenate([self.ids, [doc.id for doc in documents]])
+            self.live = np.concatenate([self.live, np.ones(len(documents), dtype=bool)])
+    
+    def delete(self, doc_id: int):
+        with self._lock:
+            row = self._rows.pop(doc_id, None)
+            if row is not None:
+                self.live[row] = False
+    
+    def search(self, query: str, top_k: int = 3, allowed_ids: List[int] = None) -> List[Tuple[Document, float]]:
+        """Top-k live documents by cosine similarity, ties in insertion order
+
+        ``allowed_ids`` restricts the search to those document ids.
+        """
+        query_vector = self._normalized([query])[0]
+        with self._lock:
+            if self.matrix is None or top_k <= 0:
+                return []
+            candidates = self.live
+            if allowed_ids is not None:
+                candidates = candidates & np.isin(self.ids, np.asarray(allowed_ids, dtype=np.int64))
+            rows = np.flatnonzero(candidates)
+            if 2 * len(rows) < len(candidates):
+                scores = self.matrix[rows] @ query_vector  # selective filter: gather first
+            else:
+                scores = (self.matrix @ query_vector)[rows]
+            if len(scores) > top_k:
+                keep = np.argpartition(-scores, top_k - 1)[:top_k]
+                rows, scores = rows[keep], scores[keep]
+            order = np.lexsort((rows, -scores))
+            return [(self.documents[row], float(score)) for row, score in zip(rows[order], scores[order])]
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[Document, float]]], k: int = 60) -> List[Tuple[Document, float]]:
+    """Fuse ranked lists by summing 1 / (k + rank) per document (rank from 1)"""
+    fused = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            documents.setdefault(doc.id, doc)
+            fused[doc.id] = fused.get(doc.id, 0.0) + 1 / (k + rank)
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [(documents[doc_id], fused[doc_id]) for doc_id in order]
+
+def _min_max(hits: List[Tuple[Document, float]]) -> Dict[int, float]:
+    if not hits:
+        return {}
+    low = min(score for _, score in hits)
+    high = max(score for _, score in hits)
+    return {doc.id: (score - low) / (high - low) if high > low else 1.0 for doc, score in hits}
+
+def weighted_fusion(lexical: List[Tuple[Document, float]], dense: List[Tuple[Document, float]],
+                    alpha: float = 0.5) -> List[Tuple[Document, float]]:
+    """``alpha * dense + (1 - alpha) * lexical`` over min-max normalized scores"""
+    lexical_scores, dense_scores = _min_max(lexical), _min_max(dense)
+    documents = {doc.id: doc for doc, _ in lexical + dense}
+    fused = {
+        doc_id: alpha * dense_scores.get(doc_id, 0.0) + (1 - alpha) * lexical_scores.get(doc_id, 0.0)
+        for doc_id in documents
+    }
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [(documents[doc_id], fused[doc_id]) for doc_id in order]
+
+# ============================================================================
+# PART 17: METADATA-PARTITIONED INDEXES
+# ============================================================================
+
+class PartitionedRAGSystem:
+    """One index per value of a metadata field, visited only when allowed
+
+    Documents are grouped by ``partition_by`` (``access_level``, ``region``
+    or ``category``) and each group gets its own ``RAGSystem`` with its own
+    postings and statistics. Partition statistics are summed into
+    collection-wide IDF and average length (as in ``ShardedRAGSystem``), so
+    scores match an unpartitioned ``RAGSystem``. A query only visits the
+    partitions its user context can see, e.g. public traffic never touches
+    the premium partition, and their top-k lists are merged with a heap.
+
+    The partitions are a read-only snapshot.
+    """
+    
+    def __init__(self, documents: List[Document], partition_by: str = "access_level",
+                 analyzer: Analyzer = None):
+        if partition_by not in MetadataIndex.FIELDS:
+            raise ValueError(f"Can only partition by one of {MetadataIndex.FIELDS}")
+        self.documents = list(documents)
+        self.partition_by = partition_by
+        self.analyzer = analyzer or Analyzer()
+        self._positions = {doc.id: doc_idx for doc_idx, doc in enumerate(self.documents)}
+        
+        groups = defaultdict(list)
+        for doc in self.documents:
+            groups[doc.metadata.get(partition_by)].append(doc)
+        self.partitions = {
+            value: RAGSystem(docs, analyzer=self.analyzer, cache_size=0)
+            for value, docs in groups.items()
+        }
+        part_stats = [part.bm25.collection_stats() for part in self.partitions.values()]
+        for part, stats in zip(self.partitions.values(), global_collection_stats(part_stats)):
+            part.tfidf.use_collection_stats(*stats)
+            part.bm25.use_collection_stats(*stats)
+    
+    def partition_stats(self) -> Dict:
+        """Per partition: document count, vocabulary size and average length"""
+        return {
+            value: {
+                "num_docs": len(part.bm25.documents),
+                "num_terms": len(part.bm25.postings),
+                "avg_doc_length": sum(part.bm25.doc_lengths) / len(part.bm25.documents),
+            }
+            for value, part in self.partitions.items()
+        }
+    
+    def _visible_partitions(self, filters: Dict) -> List:
+        if filters is None:
+            return list(self.partitions)
+        if self.partition_by == "access_level":
+            visible = {"public", filters["access_level"]}
+        elif filters[self.partition_by]:
+            visible = {filters[self.partition_by]}
+        else:
+            return list(self.partitions)
+        return [value for value in self.partitions if value in visible]
+    
+    def _merge(self, method: str, query: str, top_k: int, filters: Dict) -> List[Tuple[Document, float]]:
+        hits = []
+        for value in self._visible_partitions(filters):
+            retriever = getattr(self.partitions[value], method)
+            hits.append([
+                (self._positions[doc.id], score, doc)
+                for doc, score in retriever.retrieve(query, top_k=top_k, filters=filters)
+            ])
+        # Ties resolve by position in the original document list
+        merged = heapq.merge(*hits, key=lambda hit: (-hit[1], hit[0]))
+        return [(doc, score) for _, score, doc in islice(merged, max(top_k, 0))]
+    
+    def retrieve_with_tfidf(self, query: str, top_k: int = 3, user_access: str = None, user_region: str = None,
+                            category: str = None, tags: List[str] = None, tags_any: List[str] = None,
+                            date_from: str = None, date_to: str = None) -> List[Tuple[Document, float]]:
+        """Retrieve using TF-IDF over the visible partitions, same filters as ``RAGSystem``"""
+        filters = RAGSystem._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
+        return self._merge("tfidf", query, top_k, filters)
+    
+    def retrieve_with_bm25(self, query: str, top_k: int = 3, user_access: str = None, user_region: str = None,
+                           category: str = None, tags: List[str] = None, tags_any: List[str] = None,
+                           date_from: str = None, date_to: str = None) -> List[Tuple[Document, float]]:
+        """Retrieve using BM25 over the visible partitions, same filters as ``RAGSystem``"""
+        filters = RAGSystem._filters(user_access, user_region, category, tags, tags_any, date_from, date_to)
+        return self._merge("bm25", query, top_k, filters)
+
+# ============================================================================
+# PART 18: QUERY-BIASED SNIPPETS
+# ============================================================================
+
+def best_window(term_ids: Sequence[int], weights: Dict[int, float], window: int) -> Tuple[int, int]:
+    """[start, end) token range of at most ``window`` terms covering the
+    most query weight
+
+    A window scores the summed weight of the distinct query terms inside
+    it, then the number of query-term occurrences; the earliest best
+    window wins. Only matching positions are visited, sliding two
+    pointers over them.
+    """
+    hits = [(pos, term) for pos, term in enumerate(term_ids) if term in weights]
+    if not hits:
+        return 0, min(window, len(term_ids))
+    
+    counts = Counter()
+    score = 0.0
+    best = (-1.0, 0, 0, 0)  # (score, hits, first hit, last hit)
+    left = 0
+    for right, (pos, term) in enumerate(hits):
+        if not counts[term]:
+            score += weights[term]
+        counts[term] += 1
+        while pos - hits[left][0] >= window:
+            left_term = hits[left][1]
+            counts[left_term] -= 1
+            if not counts[left_term]:
+                score -= weights[left_term]
+            left += 1
+        if (score, right - left) > best[:2]:
+            best = (score, right - left, hits[left][0], pos)
+    
+    # Centre the hits in the window, clamped to the document
+    first, last = best[2], best[3]
+    start = max(0, first - (window - (last - first + 1)) // 2)
+    end = min(len(term_ids), start + window)
+    return max(0, end - window), end
+
+def make_snippet(text: str, term_ids: Sequence[int], spans: Sequence[int], weights: Dict[int, float],
+                 window: int = 30, highlight: Tuple[str, str] = ("**", "**"),
+                 ellipsis: str = "...") -> str:
+    """Cut the best ``window``-term passage of ``text`` and mark query terms
+
+    ``term_ids`` and flat ``spans`` are the analysis of ``text`` (see
+    ``Analyzer.tokenize_with_spans``) and ``weights`` maps query term ids
+    to their importance. Only the chosen passage is copied; the document
+    is never tokenized again.
+    """
+    if window < 1:
+        raise ValueError("window must be at least one term")
+    if not term_ids:
+        return text[:window * 8].strip()
+    start, end = best_window(term_ids, weights, window)
+    begin, finish = spans[2 * start], spans[2 * end - 1]
+    
+    open_mark, close_mark = highlight
+    parts = [ellipsis] if begin > 0 else []
+    cursor = begin
+    for pos in range(start, end):
+        if term_ids[pos] in weights:
+            term_start, term_end = spans[2 * pos], spans[2 * pos + 1]
+            parts += [text[cursor:term_start], open_mark, text[term_start:term_end], close_mark]
+            cursor = term_end
+    parts.append(text[cursor:finish])
+    if finish < len(text.rstrip()):
+        parts.append(ellipsis)
+    # Collapse the source's line breaks and indentation
+    return " ".join("".join(parts).split())
 
 # ============================================================================
 # RUN EXAMPLES
@@ -397,4 +3426,42 @@ if __name__ == "__main__":
     for doc in documents:
         print(f"\n📄 [{doc.id}] {doc.title}")
         print(f"   Category: {doc.metadata['category']} | Region: {doc.metadata['region']}")
-        print(f"   Access: {doc.metadata['access_level']}")
\ No newline at end of file
+        print(f"   Access: {doc.metadata['access_level']}")
+    
+    # Example 6: Serve BM25 from an mmap'ed on-disk segment
+    segment_path = os.path.join(tempfile.mkdtemp(), "bm25.seg")
+    rag.bm25.save_segment(segment_path)
+    bm25_from_disk = BM25Retriever(documents, segment=LexicalSegment(segment_path))
+    print_results("BM25 Results (served from segment)", bm25_from_disk.retrieve(query2, top_k=3))
+    
+    # Example 7: Incremental updates, no full rebuild
+    rag.add_documents([
+        Document(
+            id=5,
+            title="Neapolitan Pizza in a Home Oven",
+            content="""Get close to wood-fired results in a home oven. Preheat a pizza
+        steel for an hour, stretch the dough thin and bake the pizza on the top rack.""",
+            metadata={
+                "author": "Chef Maria",
+                "date": "2024-05-01",
+                "category": "Recipe",
+                "region": "Italy",
+                "access_level": "public",
+                "tags": ["pizza", "oven", "recipe"]
+            }
+        )
+    ])
+    rag.delete_document(2)
+    print_results("BM25 Results (after adding doc 5, deleting doc 2)", rag.retrieve_with_bm25(query, top_k=3))
+    
+    # Example 8: Scatter-gather over worker processes, same scores as above
+    with ShardedRAGSystem(rag.documents, num_shards=2) as sharded:
+        print_results("BM25 Results (2 shards)", sharded.retrieve_with_bm25(query, top_k=3))
+    
+    # Example 9: Hybrid BM25 + embedding retrieval, fused with RRF
+    print_results("Hybrid Results (BM25 + dense, RRF)", rag.retrieve_hybrid(query, top_k=3))
+    
+    # Example 10: Query-biased snippets with highlighted terms
+    results = rag.retrieve_with_bm25(query2, top_k=3)
+    print_results("BM25 Results with snippets", results, rag.snippets(query2, results, window=12))
+    rag.close()
@@ -0,0 +1,51 @@
+"""
+Tests for the synthetic-corpus benchmark in rag_benchmark.py: the corpus is
+reproducible and every benchmarked configuration answers the same queries
+with the same results, so their timings are comparable
+
+Usage:
+    python -m pytest -q test_rag_benchmark.py
+"""
+
+import json
+
+import pytest
+
+import rag_benchmark as bench
+
+@pytest.fixture(scope="module")
+def corpus():
+    return bench.generate_corpus(800, vocab_size=2_000, seed=3)
+
+def test_corpus_and_queries_are_reproducible(corpus):
+    assert bench.generate_corpus(800, vocab_size=2_000, seed=3) == corpus
+    assert bench.generate_corpus(800, vocab_size=2_000, seed=4) != corpus
+    queries = bench.generate_queries(50, vocab_size=2_000, seed=5, min_terms=2, max_terms=3)
+    assert queries == bench.generate_queries(50, vocab_size=2_000, seed=5, min_terms=2, max_terms=3)
+    assert all(2 <= len(query.split()) <= 3 for query in queries)
+    assert [doc.id for doc in corpus] == list(range(len(corpus)))
+
+def test_benchmarked_configurations_agree(corpus):
+    queries = bench.generate_queries(60, vocab_size=2_000, seed=5)
+    user_filters = bench.generate_filters(60, seed=6)
+    names = ("tfidf", "tfidf-wand", "bm25", "bm25-wand", "rag", "partitioned")
+    indexes = {name: bench.build(name, corpus) for name in names}
+    for query, filters in zip(queries, user_filters):
+        for context in (None, filters):
+            results = {
+                name: [(doc.id, score) for doc, score in bench.search(name, index, query, 10, context)]
+                for name, index in indexes.items()
+            }
+            assert results["tfidf-wand"] == results["tfidf"]
+            assert results["bm25-wand"] == results["bm25"] == results["rag"] == results["partitioned"], (query, context)
+
+def test_compare_flags_slowdowns_beyond_tolerance(corpus, tmp_path):
+    queries = bench.generate_queries(20, vocab_size=2_000, seed=5)
+    result = bench.benchmark("bm25", corpus, queries, bench.generate_filters(20), measure_memory=False, warmup=2)
+    baseline = json.loads(json.dumps(result))
+    baseline["latency"]["filtered"]["p95_ms"] = result["latency"]["filtered"]["p95_ms"] / 2
+    path = str(tmp_path / "baseline.json")
+    with open(path, "w") as f:
+        json.dump({"results": [baseline]}, f)
+    assert [line.split(":")[1].split()[0] for line in bench.compare([result], path, 0.2)] == ["filtered.p95_ms"]
+    assert bench.compare([result], path, 1.5) == []
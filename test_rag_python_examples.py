@@ -0,0 +1,744 @@
+"""
+Equivalence tests for the alternative index paths in rag_python_examples.py
+Every optimized path is checked against a plain reference: the exhaustive
+in-memory retrievers, a fresh rebuild, or a brute-force scan
+
+Usage:
+    python -m pytest -q test_rag_python_examples.py
+"""
+
+import os
+import random
+from collections import Counter
+
+import pytest
+
+import rag_python_examples as rag
+from rag_python_examples import (
+    Analyzer, BM25Retriever, Document, LexicalSegment, MetadataFilter, MetadataIndex, RAGSystem, RoaringBitmap,
+    TFIDFRetriever,
+)
+
+RETRIEVERS = [TFIDFRetriever, BM25Retriever]
+WORDS = [f"term{i}" for i in range(600)] + ["pizza", "oven", "dough"]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+FILTERS = [
+    None,
+    {"access_level": "public"},
+    {"access_level": "premium", "region": "UAE"},
+    {"access_level": "public", "category": "Recipe", "date_from": "2024-03-01"},
+    {"access_level": "public", "tags_any": ["oven", "history"]},
+]
+USER_CONTEXTS = [
+    {},
+    {"user_access": "public", "user_region": "UAE"},
+    {"user_access": "premium", "date_from": "2024-03-01"},
+    {"user_access": "public", "category": "Recipe"},
+]
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def make_documents(num_docs: int, seed: int, first_id: int = 0):
+    """Zipf-worded documents with every metadata field the filters use"""
+    rng = random.Random(seed)
+    return [
+        Document(
+            id=first_id + i,
+            title=f"Document {i}",
+            content=" ".join(rng.choices(WORDS, weights=WEIGHTS, k=rng.randint(0, 60))),
+            metadata={
+                "author": rng.choice(["Chef Maria", "Chef Marco"]),
+                "date": f"2024-{rng.randint(1, 9):02d}-{rng.randint(10, 28)}",
+                "category": rng.choice(["Recipe", "Business", "Culture"]),
+                "region": rng.choice(["UAE", "Italy", "USA"]),
+                "access_level": rng.choice(["public", "public", "premium"]),
+                "tags": rng.sample(["pizza", "oven", "dough", "history"], 2),
+            },
+        )
+        for i in range(num_docs)
+    ]
+
+def make_queries(num_queries: int, seed: int, max_terms: int = 6):
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choices(WORDS, weights=WEIGHTS, k=rng.randint(1, max_terms)))
+        for _ in range(num_queries)
+    ] + ["", "unknownword", "pizza pizza oven"]
+
+def ranked(results):
+    return [(doc.id, score) for doc, score in results]
+
+def live_documents(index):
+    return [doc for doc_idx, doc in enumerate(index.documents) if doc_idx not in index.deleted]
+
+@pytest.fixture(scope="module")
+def documents():
+    return make_documents(1500, seed=1)
+
+@pytest.fixture(scope="module")
+def queries():
+    return make_queries(120, seed=2)
+
+# ============================================================================
+# INVERTED INDEX, SEGMENTS AND DYNAMIC PRUNING
+# ============================================================================
+
+@pytest.mark.parametrize("cls", RETRIEVERS)
+def test_postings_match_forward_scan(cls, documents, queries):
+    index = cls(documents)
+    for query in queries:
+        # Score every document from its own term frequencies, terms in query order
+        query_terms = index._query_terms(query)
+        expected = []
+        for doc_idx, doc in enumerate(documents):
+            tfs = Counter(index.analyzer.analyze(doc))
+            if not any(term in tfs for term in query_terms):
+                continue
+            score = 0.0
+            for term in query_terms:
+                if term in tfs and term in index.idf:
+                    score += index._term_impact(index.idf[term], doc_idx, tfs[term])
+            expected.append((doc_idx, score))
+        expected.sort(key=lambda x: (-x[1], x[0]))
+        assert ranked(index.retrieve(query, 10)) == [(documents[i].id, s) for i, s in expected[:10]]
+
+@pytest.mark.parametrize("cls", RETRIEVERS)
+def test_segment_round_trip(cls, documents, queries, tmp_path):
+    index = cls(documents)
+    path = str(tmp_path / "index.seg")
+    index.save_segment(path)
+    served = cls(documents, segment=LexicalSegment(path))
+
+    assert served.avg_doc_length == index.avg_doc_length
+    assert served.vocab == index.vocab
+    for query in queries:
+        assert ranked(served.retrieve(query, 5)) == ranked(index.retrieve(query, 5))
+    if cls is TFIDFRetriever:
+        assert served.doc_vectors == index.doc_vectors
+    with pytest.raises(ValueError):
+        cls(documents[:-1], segment=LexicalSegment(path))
+
+@pytest.mark.parametrize("cls", RETRIEVERS)
+def test_maxscore_matches_exhaustive(cls, documents, queries):
+    index = cls(documents)
+    long_queries = make_queries(30, seed=3, max_terms=12)
+    for query in queries[:60] + long_queries:
+        for top_k in (1, 10, 50):
+            for filters in FILTERS[:3]:
+                assert ranked(index.retrieve(query, top_k, wand=True, filters=filters)) == \
+                    ranked(index.retrieve(query, top_k, filters=filters)), (query, top_k, filters)
+
+# ============================================================================
+# INCREMENTAL UPDATES AND MERGES
+# ============================================================================
+
+@pytest.mark.parametrize("cls", RETRIEVERS)
+@pytest.mark.parametrize("merge_threshold", [None, 0.05])
+@pytest.mark.parametrize("from_segment", [False, True])
+def test_incremental_updates_match_rebuild(cls, merge_threshold, from_segment, tmp_path):
+    rng = random.Random(7)
+    documents = make_documents(300, seed=4)
+    if from_segment:
+        path = str(tmp_path / "index.seg")
+        cls(documents).save_segment(path)
+        index = cls(documents, segment=LexicalSegment(path))
+    else:
+        index = cls(documents)
+    index.merge_threshold = merge_threshold
+    pool = make_documents(200, seed=5, first_id=10**6)
+
+    for step in range(80):
+        ids = [doc.id for doc in live_documents(index)]
+        op = rng.random()
+        if op < 0.4 and pool:
+            index.add_documents([pool.pop() for _ in range(rng.randint(1, 3)) if pool])
+        elif op < 0.7:
+            index.delete_document(rng.choice(ids))
+        elif op < 0.9:
+            replacement = make_documents(1, seed=100 + step)[0]
+            replacement.id = rng.choice(ids)
+            index.update_document(replacement)
+        else:
+            index.merge_segments(background=rng.random() < 0.5)
+        if index._merge_thread:
+            index._merge_thread.join()
+
+        rebuilt = cls(live_documents(index))
+        assert index.avg_doc_length == rebuilt.avg_doc_length
+        assert index.vocab == rebuilt.vocab
+        for query in make_queries(4, seed=200 + step):
+            top_k = rng.randint(1, 8)
+            expected = ranked(rebuilt.retrieve(query, top_k))
+            assert ranked(index.retrieve(query, top_k)) == expected, (step, query)
+            assert ranked(index.retrieve(query, top_k, wand=True)) == expected, (step, query)
+
+    with pytest.raises(KeyError):
+        index.delete_document(-5)
+    with pytest.raises(ValueError):
+        index.add_documents([live_documents(index)[0]])
+
+@pytest.mark.parametrize("cls", RETRIEVERS)
+def test_maxscore_matches_exhaustive_after_updates(cls, documents, queries):
+    index = cls(documents)
+    index.merge_threshold = None
+    for step in range(2):
+        # Tombstones and appended postings loosen the block bounds
+        for doc in documents[step::7]:
+            index.delete_document(doc.id)
+        index.add_documents(make_documents(100, seed=10 + step, first_id=10**6 * (step + 1)))
+        for query in queries[:60]:
+            for top_k in (1, 10, 50):
+                assert ranked(index.retrieve(query, top_k, wand=True)) == ranked(index.retrieve(query, top_k))
+
+def test_live_documents_view_matches_list(documents):
+    system = RAGSystem(documents[:400])
+    rng = random.Random(14)
+    for doc in rng.sample(documents[:400], 120):
+        system.delete_document(doc.id)
+    system.add_documents(make_documents(30, seed=15, first_id=10**6))
+    expected = live_documents(system.bm25)
+    assert len(system.documents) == len(expected)
+    assert list(system.documents) == expected
+    assert [system.documents[i] for i in range(len(expected))] == expected
+    assert system.documents[-1] == expected[-1] and system.documents[5:9] == expected[5:9]
+    with pytest.raises(IndexError):
+        system.documents[len(expected)]
+
+def test_chained_postings_read_like_the_concatenated_list():
+    base, delta = [(i, i % 3 + 1) for i in range(0, 40, 2)], [(41, 1), (45, 2), (50, 1)]
+    chained, expected = rag._ChainedPostings(base, delta), base + delta
+    assert len(chained) == len(expected) and list(chained) == expected
+    assert [chained[i] for i in range(-len(expected), len(expected))] == expected + expected
+    for start in range(-3, len(expected) + 2):
+        for stop in range(start, len(expected) + 3):
+            assert chained[start:stop] == expected[start:stop]
+    assert chained[::3] == expected[::3]
+
+# ============================================================================
+# SPARSE AND IMPACT-ORDERED SCORING
+# ============================================================================
+
+@pytest.mark.parametrize("cls", RETRIEVERS)
+def test_sparse_engine_matches_retriever(cls, documents, queries):
+    pytest.importorskip("scipy")
+    index = cls(documents)
+    index.merge_threshold = None
+    engine = rag.SparseScoringEngine(index)
+    for top_k in (0, 1, 10):
+        for query, results in zip(queries, engine.retrieve_batch(queries, top_k)):
+            assert ranked(results) == ranked(index.retrieve(query, top_k)), (query, top_k)
+    index.delete_document(documents[5].id)
+    index.add_documents(make_documents(20, seed=12, first_id=10**6))
+    for query in queries[:40]:
+        assert ranked(engine.retrieve(query, 5)) == ranked(index.retrieve(query, 5))
+
+def test_impact_index_matches_quantized_brute_force(documents, queries):
+    pytest.importorskip("numpy")
+    index = BM25Retriever(documents)
+    impacts = rag.ImpactIndex(index)
+
+    def brute_force(query, top_k, allowed=None):
+        scores = {}
+        for term, count in Counter(t for t in index._query_terms(query) if t in impacts.postings).items():
+            _, _, _, docs, quantized = impacts.postings[term]
+            for doc_idx, level in zip(docs.tolist(), quantized.tolist()):
+                if allowed is None or doc_idx in allowed:
+                    scores[doc_idx] = scores.get(doc_idx, 0) + level * impacts.scales[term] * count
+        best = sorted(scores.items(), key=lambda x: (-round(x[1], 9), x[0]))[:top_k]
+        return [(index.documents[doc_idx].id, round(score, 6)) for doc_idx, score in best]
+
+    def rounded(results):
+        return [(doc.id, round(score, 6)) for doc, score in results]
+
+    for query in queries:
+        for top_k in (1, 10):
+            assert rounded(impacts.retrieve(query, top_k)) == brute_force(query, top_k), (query, top_k)
+    allowed = set(index.metadata_index.allowed_docs(access_level="public"))
+    for query in queries[:40]:
+        assert rounded(impacts.retrieve(query, 10, filters={"access_level": "public"})) == \
+            brute_force(query, 10, allowed)
+
+    # The index rebuilds itself after the retriever changes
+    index.delete_document(documents[0].id)
+    index.add_documents([Document(10**6, "new", "pizza pizza oven", {"access_level": "public"})])
+    assert rounded(impacts.retrieve("pizza oven", 10)) == brute_force("pizza oven", 10)
+
+def test_impact_index_terminates_early(documents, queries, monkeypatch):
+    pytest.importorskip("numpy")
+    index = BM25Retriever(documents)
+    impacts = rag.ImpactIndex(index)
+    settled = []
+    check = rag.ImpactIndex._settled
+
+    def counting_settled(scores, top_k, remaining):
+        result = check(scores, top_k, remaining)
+        settled.append(result)
+        return result
+
+    monkeypatch.setattr(rag.ImpactIndex, "_settled", staticmethod(counting_settled))
+    for query in queries:
+        impacts.retrieve(query, 3)
+    # Skipping the tail runs must actually happen, not only give exact results
+    assert sum(settled) >= len(queries) // 8, (sum(settled), len(settled))
+    assert all(isinstance(level, int) for level in impacts.multipliers.values())
+
+# ============================================================================
+# METADATA FILTERING
+# ============================================================================
+
+@pytest.fixture(scope="module")
+def system(documents):
+    return RAGSystem(documents, cache_size=0)
+
+def test_filters_apply_before_scoring(system, documents, queries):
+    for context in USER_CONTEXTS[1:]:
+        filters = RAGSystem._filters(**context)
+        allowed = {doc.id for doc in MetadataFilter.filter_documents(documents, **filters)}
+        for query in queries[:40]:
+            for method in ("bm25", "tfidf"):
+                retrieve = getattr(system, f"retrieve_with_{method}")
+                # The first 5 allowed documents of the unfiltered ranking
+                everything = [hit for hit in ranked(retrieve(query, len(documents))) if hit[0] in allowed]
+                assert ranked(retrieve(query, 5, **context)) == everything[:5], (query, context)
+
+def test_roaring_bitmap_matches_set():
+    rng = random.Random(9)
+    for _ in range(20):
+        size = rng.choice([1_000, 70_000, 140_000])
+        a = {x for x in range(size) if rng.random() < rng.choice([0.001, 0.05, 0.9])}
+        b = {x for x in range(size) if rng.random() < rng.choice([0.01, 0.3, 0.8])}
+        bitmap_a, bitmap_b = RoaringBitmap.from_sorted(sorted(a)), RoaringBitmap.from_sorted(sorted(b))
+        assert list(bitmap_a) == sorted(a) and len(bitmap_a) == len(a)
+        assert list(bitmap_a & bitmap_b) == sorted(a & b)
+        assert list(bitmap_a | bitmap_b) == sorted(a | b)
+        for x in rng.sample(range(size + 10), 100):
+            assert (x in bitmap_a) == (x in a)
+        for x in rng.sample(range(size), 200):
+            if rng.random() < 0.5:
+                bitmap_a.add(x)
+                a.add(x)
+            else:
+                bitmap_a.discard(x)
+                a.discard(x)
+        assert list(bitmap_a) == sorted(a)
+        # Results never alias their inputs
+        before = list(bitmap_a)
+        union = bitmap_a | bitmap_b
+        union.add(size + 5)
+        assert list(bitmap_a) == before
+
+@pytest.mark.parametrize("cls", RETRIEVERS)
+def test_metadata_index_matches_filter_scan(cls, documents, queries):
+    index = cls(documents)
+    index.merge_threshold = None
+    index.add_documents(make_documents(50, seed=11, first_id=10**6))
+    for doc in documents[:300:4]:
+        index.delete_document(doc.id)
+
+    for merged in (False, True):
+        if merged:
+            index.merge_segments()
+        live = live_documents(index)
+        for filters in FILTERS[1:]:
+            allowed = {doc.id for doc in MetadataFilter.filter_documents(live, **filters)}
+            assert {index.documents[i].id for i in index.metadata_index.allowed_docs(**filters)} == allowed
+            for query in queries[:30]:
+                everything = [hit for hit in ranked(index.retrieve(query, len(index.documents))) if hit[0] in allowed]
+                assert ranked(index.retrieve(query, 5, filters=filters)) == everything[:5]
+    assert MetadataFilter.filter_documents(documents, access_level="public") == \
+        MetadataFilter.filter_documents(documents, index=MetadataIndex(documents), access_level="public")
+
+# ============================================================================
+# ANALYZER
+# ============================================================================
+
+def test_analyzer_matches_preprocess_text(documents):
+    analyzer = Analyzer()
+    texts = [doc.content for doc in documents[:200]] + ["Pizza, pizza! Oven-baked: DOUGH; ok a an the.", ""]
+    for doc_id, text in enumerate(texts):
+        doc = Document(doc_id, "t", text, {})
+        term_ids = analyzer.analyze(doc)
+        assert [analyzer.terms[term] for term in term_ids] == rag.preprocess_text(text)
+        # Cached per document, and the same term always gets the same id
+        assert analyzer.analyze(doc) is term_ids
+        assert list(term_ids) == [analyzer.vocabulary[word] for word in rag.preprocess_text(text)]
+        words, spans = analyzer.tokenize_with_spans(text)
+        assert words == analyzer.tokenize(text)
+        assert [text[spans[i]:spans[i + 1]].lower() for i in range(0, len(spans), 2)] == words
+    assert analyzer.query_terms("PIZZA oven unknownword pizza") == \
+        [analyzer.vocabulary["pizza"], analyzer.vocabulary["oven"], analyzer.vocabulary["pizza"]]
+
+def test_shared_analyzer_gives_retrievers_the_same_term_ids(documents, queries):
+    analyzer = Analyzer()
+    tfidf, bm25 = TFIDFRetriever(documents, analyzer=analyzer), BM25Retriever(documents, analyzer=analyzer)
+    for query in queries:
+        assert tfidf._query_terms(query) == bm25._query_terms(query)
+    assert ranked(bm25.retrieve("pizza oven", 10)) == ranked(BM25Retriever(documents).retrieve("pizza oven", 10))
+
+# ============================================================================
+# PARALLEL BUILDS, SHARDS AND CACHING
+# ============================================================================
+
+def test_parallel_build_matches_serial(documents, queries):
+    serial_analyzer, parallel_analyzer = Analyzer(), Analyzer()
+    serial, serial_lengths = rag.build_inverted_index(documents, serial_analyzer)
+    parallel, parallel_lengths = rag.build_inverted_index(documents, parallel_analyzer, workers=3)
+    assert list(parallel_lengths) == list(serial_lengths)
+    assert {parallel_analyzer.terms[term]: plist for term, plist in parallel.items()} == \
+        {serial_analyzer.terms[term]: plist for term, plist in serial.items()}
+
+    serial_system = RAGSystem(documents, cache_size=0)
+    parallel_system = RAGSystem(documents, workers=3, cache_size=0)
+    for query in queries[:40]:
+        assert ranked(parallel_system.retrieve_with_bm25(query, 10)) == ranked(serial_system.retrieve_with_bm25(query, 10))
+        assert ranked(parallel_system.retrieve_with_tfidf(query, 10)) == ranked(serial_system.retrieve_with_tfidf(query, 10))
+
+@pytest.mark.parametrize("num_shards", [1, 3])
+def test_sharded_matches_single_system(num_shards, system, documents, queries):
+    with rag.ShardedRAGSystem(documents, num_shards=num_shards) as sharded:
+        for query in queries[:40]:
+            for context in USER_CONTEXTS:
+                assert ranked(sharded.retrieve_with_bm25(query, 10, **context)) == \
+                    ranked(system.retrieve_with_bm25(query, 10, **context))
+                assert ranked(sharded.retrieve_with_tfidf(query, 10, **context)) == \
+                    ranked(system.retrieve_with_tfidf(query, 10, **context))
+
+def test_query_cache_hits_misses_and_lru_eviction():
+    cache = rag.QueryCache(max_size=2)
+    assert cache.get("a", 0) is None
+    cache.put("a", 0, ["A"])
+    cache.put("b", 0, ["B"])
+    assert cache.get("a", 0) == ["A"]
+    # "b" is now the least recently used entry
+    cache.put("c", 0, ["C"])
+    assert len(cache) == 2
+    assert cache.get("b", 0) is None
+    assert cache.get("a", 0) == ["A"] and cache.get("c", 0) == ["C"]
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert cache.hit_rate == 3 / 5
+    # Another index version is a miss and drops the stale entry
+    assert cache.get("a", 1) is None
+    assert len(cache) == 1
+
+    disabled = rag.QueryCache(max_size=0)
+    disabled.put("a", 0, ["A"])
+    assert disabled.get("a", 0) is None and len(disabled) == 0
+
+def test_query_cache_ttl_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rag.time, "monotonic", lambda: now[0])
+    cache = rag.QueryCache(max_size=8, ttl=5)
+    cache.put("a", 0, ["A"])
+    now[0] = 104.9
+    assert cache.get("a", 0) == ["A"]
+    now[0] = 105.0
+    assert cache.get("a", 0) is None
+    assert len(cache) == 0
+
+def test_rag_system_cache_invalidates_on_updates(documents):
+    system = RAGSystem(documents[:300], cache_size=16)
+    system.bm25.merge_threshold = system.tfidf.merge_threshold = None
+    first = system.retrieve_with_bm25("pizza oven", 5)
+    assert system.retrieve_with_bm25("Pizza, OVEN!", 5) == first
+    assert (system.cache.hits, system.cache.misses) == (1, 1)
+
+    best = first[0][0]
+    system.delete_document(best.id)
+    after_delete = system.retrieve_with_bm25("pizza oven", 5)
+    assert system.cache.misses == 2
+    assert best.id not in [doc.id for doc, _ in after_delete]
+    assert ranked(after_delete) == ranked(RAGSystem(live_documents(system.bm25)).retrieve_with_bm25("pizza oven", 5))
+
+    system.add_documents([Document(10**6, "new", "pizza oven pizza oven", {"access_level": "public"})])
+    assert system.retrieve_with_bm25("pizza oven", 5)[0][0].id == 10**6
+    assert system.cache.misses == 3
+
+# ============================================================================
+# POSITIONAL POSTINGS
+# ============================================================================
+
+def test_positional_merge_matches_rebuild(documents):
+    index = BM25Retriever(documents, positional=True)
+    index.merge_threshold = None
+    for doc in documents[::5]:
+        index.delete_document(doc.id)
+    index.add_documents(make_documents(200, seed=6, first_id=10**6))
+    index.merge_segments()
+
+    rebuilt = BM25Retriever(live_documents(index), positional=True, analyzer=index.analyzer)
+    assert index.term_positions == rebuilt.term_positions
+    for query in ["term1 term2", "pizza oven", "term0 term0"]:
+        for options in ({"phrase": True}, {"within": 4}, {"within": 4, "proximity_boost": 0.5}):
+            assert ranked(index.retrieve(query, 10, **options)) == ranked(rebuilt.retrieve(query, 10, **options))
+
+def test_phrase_and_window_match_brute_force():
+    rng = random.Random(8)
+    words = [f"w{i:02d}" for i in range(12)]
+    documents = [Document(i, "t", " ".join(rng.choices(words, k=rng.randint(1, 40))), {"access_level": "public"})
+                 for i in range(300)]
+    index = BM25Retriever(documents, positional=True)
+
+    def has_phrase(tokens, phrase):
+        return any(tokens[i:i + len(phrase)] == phrase for i in range(len(tokens)))
+
+    def has_window(tokens, terms, window):
+        return any(all(term in tokens[i:i + window] for term in terms) for i in range(len(tokens)))
+
+    for _ in range(150):
+        terms = rng.choices(words, k=rng.randint(1, 3))
+        window = rng.randint(1, 8)
+        query = " ".join(terms)
+        assert set(index.positional_matches(query, phrase=True)) == \
+            {i for i, doc in enumerate(documents) if has_phrase(doc.content.split(), terms)}
+        assert set(index.positional_matches(query, within=window)) == \
+            {i for i, doc in enumerate(documents) if has_window(doc.content.split(), terms, window)}
+
+# ============================================================================
+# STREAMING INGESTION
+# ============================================================================
+
+def test_stream_index_matches_in_memory(system, documents, queries, tmp_path):
+    directory = str(tmp_path / "index")
+    streamed = RAGSystem.from_stream(iter(documents), directory, batch_size=400, cache_size=0)
+    assert isinstance(streamed.bm25.documents.store, rag.DocumentStore)
+    assert list(streamed.documents) == documents
+
+    # The merged stream segment is byte-for-byte the in-memory one
+    system.bm25.save_segment(str(tmp_path / "memory.seg"))
+    with open(str(tmp_path / "memory.seg"), "rb") as memory, open(os.path.join(directory, "index.seg"), "rb") as stream:
+        assert memory.read() == stream.read()
+
+    in_memory = RAGSystem(documents, cache_size=0)
+    for query in queries[:40]:
+        for context in USER_CONTEXTS:
+            assert ranked(streamed.retrieve_with_bm25(query, 10, **context)) == \
+                ranked(in_memory.retrieve_with_bm25(query, 10, **context))
+            assert ranked(streamed.retrieve_with_tfidf(query, 10, **context)) == \
+                ranked(in_memory.retrieve_with_tfidf(query, 10, **context))
+
+    # Updates keep the store on disk and the results in step
+    added = make_documents(30, seed=13, first_id=10**6)
+    for target in (streamed, in_memory):
+        target.add_documents(added)
+        target.update_document(Document(documents[3].id, "updated", "pizza dough oven", {"region": "UAE"}))
+        target.delete_document(documents[7].id)
+        target.bm25.merge_segments()
+        target.tfidf.merge_segments()
+    assert isinstance(streamed.bm25.documents, rag._StoredDocuments)
+    assert list(streamed.documents) == list(in_memory.documents)
+    for query in queries[:40]:
+        assert ranked(streamed.retrieve_with_bm25(query, 10)) == ranked(in_memory.retrieve_with_bm25(query, 10))
+
+def test_document_store_releases_old_maps_and_closes(documents, tmp_path):
+    path = str(tmp_path / "documents.jsonl")
+    with rag.DocumentStore(path) as store:
+        store.extend(documents[:10])
+        first_map = store._mmap
+        store.extend(documents[10:25])
+        assert first_map.closed and not store._mmap.closed
+        assert list(store) == documents[:25]
+        assert list(rag.DocumentStore(path)) == documents[:25]
+    assert store._mmap is None
+    with pytest.raises(ValueError):
+        store[0]
+
+    system = RAGSystem.from_stream(iter(documents[:50]), str(tmp_path / "index"), batch_size=20)
+    store = system.bm25.documents.store
+    with system:
+        assert system.retrieve_with_bm25("term0", 1)
+    assert store._mmap is None
+
+# ============================================================================
+# BATCH RETRIEVAL
+# ============================================================================
+
+@pytest.mark.parametrize("method", ["bm25", "tfidf"])
+def test_retrieve_batch_matches_single_queries(method, system, queries):
+    single = getattr(system, f"retrieve_with_{method}")
+    for context in USER_CONTEXTS[:2]:
+        expected = [ranked(single(query, 10, **context)) for query in queries]
+        for workers, processes in ((1, False), (3, False), (2, True)):
+            batch = system.retrieve_batch(queries, 10, method, workers=workers, processes=processes, **context)
+            assert [ranked(results) for results in batch] == expected, (workers, processes)
+
+@pytest.mark.parametrize("cls", RETRIEVERS)
+def test_retriever_batch_matches_single_queries(cls, documents, queries):
+    index = cls(documents)
+    for filters in FILTERS[:3]:
+        expected = [ranked(index.retrieve(query, 7, filters=filters)) for query in queries]
+        assert [ranked(results) for results in index.retrieve_batch(queries, 7, filters=filters)] == expected
+
+def test_batch_process_pool_is_reused_until_the_index_changes(documents, queries):
+    index = BM25Retriever(documents[:500])
+    index.merge_threshold = None
+    index.retrieve_batch(queries, 5, workers=2, processes=True)
+    pool = index._process_pool[0]
+    index.retrieve_batch(queries, 5, workers=2, processes=True)
+    assert index._process_pool[0] is pool
+    # Workers forked before the delete would score a stale index
+    index.delete_document(index.retrieve("term0", 1)[0][0].id)
+    batch = index.retrieve_batch(queries, 5, workers=2, processes=True)
+    assert [ranked(results) for results in batch] == [ranked(index.retrieve(query, 5)) for query in queries]
+    index.close()
+    assert index._process_pool is None
+
+# ============================================================================
+# HYBRID RETRIEVAL
+# ============================================================================
+
+def test_fusion_scores_match_hand_computed_values():
+    a, b, c, d = (Document(i, "t", "", {}) for i in range(4))
+    fused = rag.reciprocal_rank_fusion([[(a, 9.0), (b, 5.0), (c, 1.0)], [(c, 0.9), (a, 0.8), (d, 0.1)]], k=60)
+    assert [(doc.id, score) for doc, score in fused] == pytest.approx(
+        [(0, 1 / 61 + 1 / 62), (2, 1 / 63 + 1 / 61), (1, 1 / 62), (3, 1 / 63)])
+
+    # Lexical 9/5/1 -> 1/0.5/0, dense 0.9/0.8/0.1 -> 1/0.875/0
+    fused = rag.weighted_fusion([(a, 9.0), (b, 5.0), (c, 1.0)], [(c, 0.9), (a, 0.8), (d, 0.1)], alpha=0.25)
+    assert [(doc.id, score) for doc, score in fused] == pytest.approx(
+        [(0, 0.25 * 0.875 + 0.75), (1, 0.75 * 0.5), (2, 0.25), (3, 0.0)])
+    # A single hit normalizes to 1
+    assert rag.weighted_fusion([(a, 3.0)], [], alpha=0.5)[0][1] == 0.5
+
+@pytest.mark.parametrize("fusion", ["rrf", "weighted"])
+def test_hybrid_fuses_filtered_lexical_and_dense_lists(fusion, documents, queries):
+    np = pytest.importorskip("numpy")
+    with RAGSystem(documents, cache_size=0) as system:
+        embed = rag.HashingEmbedder(analyzer=system.analyzer)
+        vectors = np.asarray(embed([doc.content for doc in documents]), dtype=np.float32)
+        vectors /= np.where(np.linalg.norm(vectors, axis=1, keepdims=True) == 0, 1,
+                            np.linalg.norm(vectors, axis=1, keepdims=True))
+        for context in USER_CONTEXTS[:3]:
+            filters = RAGSystem._filters(**context)
+            allowed = {doc.id for doc in MetadataFilter.filter_documents(documents, **filters)} \
+                if filters else {doc.id for doc in documents}
+            for query in queries[:25]:
+                # Both branches see only the allowed documents
+                lexical = system.bm25.retrieve(query, 20, filters=filters)
+                query_vector = np.asarray(embed([query]), dtype=np.float32)[0]
+                query_vector /= np.linalg.norm(query_vector) or 1
+                scores = vectors @ query_vector
+                rows = sorted((row for row, doc in enumerate(documents) if doc.id in allowed),
+                              key=lambda row: (-scores[row], row))[:20]
+                dense = [(documents[row], float(scores[row])) for row in rows]
+                assert all(doc.id in allowed for doc, _ in lexical + dense)
+
+                fused = {}
+                if fusion == "rrf":
+                    for ranking in (lexical, dense):
+                        for rank, (doc, _) in enumerate(ranking, start=1):
+                            fused[doc.id] = fused.get(doc.id, 0.0) + 1 / (60 + rank)
+                else:
+                    for weight, ranking in ((0.7, lexical), (0.3, dense)):
+                        low, high = min(s for _, s in ranking), max(s for _, s in ranking)
+                        for doc, score in ranking:
+                            normalized = (score - low) / (high - low) if high > low else 1.0
+                            fused[doc.id] = fused.get(doc.id, 0.0) + weight * normalized
+                if not lexical:
+                    continue
+                hybrid = system.retrieve_hybrid(query, 5, fusion=fusion, alpha=0.3, candidates=20, **context)
+                # Every hit carries its fused score, and they are the 5 best (tie order aside)
+                assert [score for _, score in hybrid] == pytest.approx(sorted(fused.values(), reverse=True)[:5])
+                assert all(score == pytest.approx(fused[doc.id]) for doc, score in hybrid), (query, context)
+
+# ============================================================================
+# FACETED AGGREGATION
+# ============================================================================
+
+def brute_force_facets(system, documents, query, fields, filters):
+    allowed = MetadataFilter.filter_documents(documents, **filters) if filters else documents
+    query_words = set(system.analyzer.tokenize(query or ""))
+    matching = [doc for doc in allowed if not query or query_words & set(system.analyzer.tokenize(doc.content))]
+    facets = {}
+    for field in fields:
+        counts = Counter()
+        for doc in matching:
+            value = doc.metadata.get(field)
+            counts.update(value if isinstance(value, list) else [] if value is None else [value])
+        facets[field] = dict(sorted(counts.items(), key=lambda item: (-item[1], str(item[0]))))
+    return len(matching), facets
+
+@pytest.mark.parametrize("method", ["bm25", "tfidf"])
+def test_facet_counts_match_brute_force(method, documents, queries):
+    fields = ["category", "region", "tags", "access_level", "date"]
+    with RAGSystem(documents[:600], cache_size=0) as system:
+        for doc in documents[:600:9]:
+            system.delete_document(doc.id)
+        system.add_documents(make_documents(40, seed=16, first_id=10**6))
+        live = list(system.documents)
+        for context in USER_CONTEXTS + [{"tags_any": ["oven"], "date_to": "2024-06-30"}]:
+            filters = RAGSystem._filters(**context)
+            for query in [None, ""] + queries[:15]:
+                result = system.aggregate(query, fields, top_k=4, method=method, **context)
+                total_count, facets = brute_force_facets(system, live, query, fields, filters)
+                assert result["total_count"] == total_count, (query, context)
+                assert result["facets"] == facets, (query, context)
+                assert list(result["facets"]["tags"]) == list(facets["tags"])
+                if query:
+                    retrieve = getattr(system, f"retrieve_with_{method}")
+                    assert ranked(result["hits"]) == ranked(retrieve(query, 4, **context))
+        with pytest.raises(ValueError):
+            system.aggregate("pizza", ["author"])
+
+# ============================================================================
+# PARTITIONED INDEXES
+# ============================================================================
+
+@pytest.mark.parametrize("partition_by", ["access_level", "region", "category"])
+def test_partitioned_matches_single_system(partition_by, system, documents, queries):
+    partitioned = rag.PartitionedRAGSystem(documents, partition_by=partition_by)
+    for query in queries[:40]:
+        for context in USER_CONTEXTS:
+            assert ranked(partitioned.retrieve_with_bm25(query, 10, **context)) == \
+                ranked(system.retrieve_with_bm25(query, 10, **context))
+            assert ranked(partitioned.retrieve_with_tfidf(query, 10, **context)) == \
+                ranked(system.retrieve_with_tfidf(query, 10, **context))
+
+# ============================================================================
+# SNIPPETS
+# ============================================================================
+
+def test_snippets_match_between_stores_and_leave_vocabulary_alone(tmp_path):
+    documents = [
+        Document(0, "Dough", "Pizza dough needs time.\n  Rest the dough overnight, then bake pizza hot.", {}),
+        Document(1, "Oven", "Oven oven oven " * 40 + " pizza at the end", {}),
+        Document(2, "Other", "Nothing relevant here", {}),
+    ]
+    in_memory = RAGSystem(documents)
+    streamed = RAGSystem.from_stream(iter(documents), str(tmp_path / "index"), batch_size=2)
+    for query in ("pizza dough", "oven"):
+        assert in_memory.snippets(query, in_memory.retrieve_with_bm25(query, 3), window=6) == \
+            streamed.snippets(query, streamed.retrieve_with_bm25(query, 3), window=6)
+
+    vocabulary = dict(in_memory.analyzer.vocabulary)
+    unindexed = Document(99, "New", "Brand new words about pizza", {})
+    assert "**pizza**" in in_memory.snippets("pizza", [(unindexed, 0.0)])[0]
+    assert in_memory.analyzer.vocabulary == vocabulary
+    with pytest.raises(ValueError):
+        in_memory.snippets("pizza", [(documents[0], 0.0)], window=0)
+
+def test_snippets_tokenize_each_uncached_document_once(documents, tmp_path, monkeypatch):
+    system = RAGSystem.from_stream(iter(documents[:200]), str(tmp_path / "index"), batch_size=50)
+    system.analyzer.span_cache_size = 8
+    results = system.retrieve_with_bm25("term0 term1", 5)
+    expected = system.snippets("term0 term1", results, window=8)
+
+    calls = []
+    tokenize = system.analyzer.tokenize_with_spans
+    monkeypatch.setattr(system.analyzer, "tokenize_with_spans", lambda text: calls.append(text) or tokenize(text))
+    for _ in range(3):
+        assert system.snippets("term0 term1", results, window=8) == expected
+    assert calls == []
+
+    # Only the 8 most recently shown documents stay cached
+    system.snippets("term0", [(doc, 0.0) for doc in documents[:12]])
+    assert len(system.analyzer._span_cache) == 8
+    calls.clear()
+    system.snippets("term0", [(doc, 0.0) for doc in documents[4:12]])
+    assert calls == []
+    system.snippets("term0", [(documents[0], 0.0)])
+    assert calls == [documents[0].content]
+    # A changed document is analyzed again
+    changed = Document(documents[5].id, "t", "pizza term0 pizza", {})
+    assert "**pizza**" in system.snippets("pizza", [(changed, 0.0)])[0]